@@ -0,0 +1,183 @@
+"""
+Parse the NIDAQmx.h header into a table of function signatures and constants, and cache that table on disk.
+The cache is keyed by the header's path, size and modification time, so it is regenerated automatically whenever the header changes.
+Regenerate it by hand with :func:`regenerate` or the `regenerate_daqmx_bindings` script.
+"""
+import re
+import os
+import cPickle as pickle
+from config import dot_h_file, cache_file
+
+# Bump this whenever the layout of the table changes, to invalidate old caches
+CACHE_FORMAT_VERSION = 1
+
+##############################
+# Regular expressions to parse the NIDAQmx.h file
+##############################
+# Each argument regular expression is associated with a type specification - a python expression evaluated by :mod:`daqmx.functions`
+# to give the ctypes type - and a number giving the group in which the name of the variable is defined
+function_parser = re.compile(r'.* (DAQ\S+)\s*\((.*)\);')
+type_list = ['int8','uInt8','int16','uInt16','int32','uInt32','float32','float64','int64','uInt64','bool32','TaskHandle']
+type_list_array = ['int8','uInt8','int16','uInt16','int32','uInt32','float32','float64','int64','uInt64']
+
+const_char = [(re.compile(r'(const char)\s*([^\s]*)\[\]'), 'c_char_p', 2)]
+simple_type = [(re.compile('('+_type+')\s*([^\*\[]*)\Z'), _type, 2) for _type in type_list]
+pointer_type = [(re.compile('('+_type+')\s*\*([^\*]*)\Z'), 'POINTER('+_type+')', 2) for _type in type_list]
+pointer_type_array = [(re.compile('('+_type+')\s*((?:readArray|writeArray).*)\[\]\Z'), 'array_type("'+_type+'")', 2) for _type in type_list_array]
+pointer_type_2 = [(re.compile('('+_type+')\s*([^\s]*)\[\]\Z'), 'POINTER('+_type+')', 2) for _type in type_list]
+
+char_etoile = [(re.compile(r'(char)\s*\*([^\*]*)\Z'), 'c_char_p', 2)] # match "char * name"
+void_etoile = [(re.compile(r'(void)\s*\*([^\*]*)\Z'), 'c_void_p', 2)] # match "void * name"
+char_array = [(re.compile(r'(char)\s*([^\s]*)\[\]'), 'c_char_p', 2)] # match "char name[]"
+call_back_A = [(re.compile(r'(DAQmxEveryNSamplesEventCallbackPtr)\s*([^\s]*)'), 'DAQmxEveryNSamplesEventCallbackPtr', 2)]
+call_back_B = [(re.compile(r'(DAQmxDoneEventCallbackPtr)\s*([^\s]*)'), 'DAQmxDoneEventCallbackPtr', 2)]
+call_back_C = [(re.compile(r'(DAQmxSignalEventCallbackPtr)\s*([^\s]*)'), 'DAQmxSignalEventCallbackPtr', 2)]
+
+# Create a list with all regular expressions
+c_to_ctype_map = []
+for l in [const_char, simple_type, pointer_type, pointer_type_array, pointer_type_2, char_etoile, void_etoile, char_array, call_back_A, call_back_B, call_back_C]:
+    c_to_ctype_map.extend(l)
+
+# Parse line like : #define PI 3.141592
+# The first group is the name of the constant
+# The second group the value
+define = re.compile(r'\#define (\S+)\s*(".*"|\S*)')
+notempty = re.compile(r'\S')
+
+def parse_header(path):
+    """
+    Read the NIDAQmx.h file and extract every __CFUNC function signature and every #define constant
+
+    :param path: full path of the NIDAQmx.h file
+
+    :returns: table with keys 'functions', a list of (name, [argument type specification], [argument name]), and 'constants', a list of (name, value)
+    :type table: dict
+    """
+    functions = []
+    constants = []
+    namespace = {}
+    include_file = open(path, 'r')
+    try:
+        for line in include_file:
+            line = line.rstrip('\r\n')
+            if '__CFUNC' in line and function_parser.match(line):
+                name, arg_string = function_parser.match(line).groups()
+                arg_specs = []
+                arg_names = []
+                for arg in re.split(', |,', arg_string): # Almost everywhere there is a space after the comma
+                    for (reg_expr, spec, group_nb) in c_to_ctype_map:
+                        reg_expr_result = reg_expr.search(arg)
+                        if reg_expr_result is not None:
+                            arg_specs.append(spec)
+                            arg_names.append(reg_expr_result.group(group_nb))
+                            break
+                functions.append((name, arg_specs, arg_names))
+            elif line.startswith('#define'):
+                a = define.match(line)
+                if a and notempty.match(a.group(2)):
+                    name, value = a.groups()
+                    # constants may be defined in terms of earlier constants, so evaluate them all in one namespace
+                    try:
+                        exec(name + '=' + value, namespace)
+                    except (NameError, SyntaxError):
+                        pass
+                    else:
+                        constants.append((name, namespace[name]))
+    finally:
+        include_file.close()
+    return {'functions': functions, 'constants': constants}
+
+def header_key(path):
+    """
+    Identify a particular version of the header file
+
+    :param path: full path of the NIDAQmx.h file
+
+    :returns: (absolute path, size, modification time)
+    :type key: tuple
+    """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+def read_cache(path, key):
+    """
+    Load the binding table from the cache file
+
+    :param path: cache file path
+    :param key: the :func:`header_key` the cache must have been generated from
+
+    :returns: the table, or None if the cache is missing, unreadable or stale
+    """
+    try:
+        cache = open(path, 'rb')
+        try:
+            content = pickle.load(cache)
+        finally:
+            cache.close()
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+    if content.get('version') != CACHE_FORMAT_VERSION or content.get('key') != key:
+        return None
+    return content['table']
+
+def write_cache(path, key, table):
+    """
+    Write the binding table to the cache file.  The file is written to a temporary path first, so a half-written cache is never read.
+
+    :param path: cache file path
+    :param key: the :func:`header_key` of the header the table was parsed from
+    :param table: the table, as returned by :func:`parse_header`
+
+    :returns: True if the cache was written, False if the location is not writable
+    """
+    tmp_path = path + '.tmp'
+    try:
+        cache = open(tmp_path, 'wb')
+        try:
+            pickle.dump({'version': CACHE_FORMAT_VERSION, 'key': key, 'table': table}, cache, pickle.HIGHEST_PROTOCOL)
+        finally:
+            cache.close()
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        return False
+    return True
+
+# Tables already loaded in this process, so functions and constants share one load
+_loaded_tables = {}
+
+def load_table(header = dot_h_file, cache = cache_file):
+    """
+    Return the binding table for a header: from this process if already loaded, else from the cache file if it is up to date, else by parsing the header (and refreshing the cache)
+
+    :param header: full path of the NIDAQmx.h file
+    :param cache: cache file path
+
+    :returns: the table, as returned by :func:`parse_header`
+    """
+    key = header_key(header)
+    if key not in _loaded_tables:
+        table = read_cache(cache, key)
+        if table is None:
+            table = parse_header(header)
+            write_cache(cache, key, table)
+        _loaded_tables[key] = table
+    return _loaded_tables[key]
+
+def regenerate(header = dot_h_file, cache = cache_file):
+    """
+    Parse the header and rewrite the cache file, whether or not it is stale
+
+    :param header: full path of the NIDAQmx.h file
+    :param cache: cache file path
+
+    :returns: the number of functions and constants written
+    :type counts: (int, int) tuple
+    """
+    key = header_key(header)
+    table = parse_header(header)
+    if not write_cache(cache, key, table):
+        raise IOError("Cannot write DAQmx binding cache to {0}".format(cache))
+    _loaded_tables[key] = table
+    return len(table['functions']), len(table['constants'])
@@ -1,3 +1,4 @@
+import os
 import sys
 import platform
 from config import FILE_LOC_WINXP, FILE_LOC_WIN7_64BIT, FILE_LOC_LINUX, LIB_NAME_WIN, LIB_NAME_LINUX
@@ -16,3 +17,9 @@ elif sys.platform.startswith('linux'):
 
 else:
     raise NotImplementedError, "Location of niDAQmx library and include file unknown on %s - if you find out, please let the PyDAQmx project know" % (sys.platform)
+
+# Parsed header cache, see daqmx.bindings - kept next to this package
+cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NIDAQmx_bindings.cache")
+
+# Bind each DAQmx function on first use, rather than every function in the header at import - see daqmx.functions
+lazy_binding = True
@@ -1,8 +1,9 @@
-import re
 import sys
 from ctypes import *
-from config import dot_h_file, lib_name
+from config import dot_h_file, lib_name, lazy_binding
 from types import *
+from bindings import load_table
+from tracing import traced
 
 class DAQError(Exception):
     """
@@ -27,11 +28,11 @@ def catch_error(f):
         error = f(*arg)
         if error < 0:
             errBuff = create_string_buffer(2048)
-            DAQmxGetExtendedErrorInfo(errBuff, 2048)
+            bind_function('DAQmxGetExtendedErrorInfo')(errBuff, 2048)
             raise DAQError(error, errBuff.value.decode("utf-8"), f.__name__)
         elif error > 0:
             errBuff = create_string_buffer(2048)
-            DAQmxGetErrorString (error, errBuff, 2048);
+            bind_function('DAQmxGetErrorString')(error, errBuff, 2048);
             print "WARNING :", error, "  ", errBuff.value.decode("utf-8")
             raise DAQError(error, errBuff.value.decode("utf-8"), f.__name__)
         return error
@@ -69,78 +70,94 @@ else:
 
 
 ##############################
-# Read the .h file and convert the functions for Python
+# Load the function table (see daqmx.bindings) and convert the functions for Python
 ##############################
-# Open NIDAQmx.h file
-include_file = open(dot_h_file,'r')
-
-# Regular expressions to parse the NIDAQmx.h file ... almost all the function defined in NIDAQmx.h file are imported
-# Each regular expression is associated with a ctypes type and a number giving the group in which the name of the variable is defined
-function_parser = re.compile(r'.* (DAQ\S+)\s*\((.*)\);')
-const_char = re.compile(r'(const char)\s*([^\s]*)\[\]')
-string_type = '|'.join(['int8','uInt8','int16','uInt16','int32','uInt32','float32','float64','int64','uInt64','bool32','TaskHandle'])
-type_list = ['int8','uInt8','int16','uInt16','int32','uInt32','float32','float64','int64','uInt64','bool32','TaskHandle']
-type_list_array = ['int8','uInt8','int16','uInt16','int32','uInt32','float32','float64','int64','uInt64']
-
-const_char = [(re.compile(r'(const char)\s*([^\s]*)\[\]'), c_char_p ,2)]
-simple_type = [(re.compile('('+_type+')\s*([^\*\[]*)\Z'),eval(_type),2) for _type in type_list]
-pointer_type = [(re.compile('('+_type+')\s*\*([^\*]*)\Z'),eval('POINTER('+_type+')'),2) for _type in type_list]
-pointer_type_array = [(re.compile('('+_type+')\s*((?:readArray|writeArray).*)\[\]\Z'),array_type(_type),2) for _type in type_list_array]
-pointer_type_2 = [(re.compile('('+_type+')\s*([^\s]*)\[\]\Z'),eval('POINTER('+_type+')'),2) for _type in type_list]
-
-char_etoile = [(re.compile(r'(char)\s*\*([^\*]*)\Z'), c_char_p, 2)] # match "char * name"
-void_etoile = [(re.compile(r'(void)\s*\*([^\*]*)\Z'), c_void_p, 2)] # match "void * name"
-char_array = [(re.compile(r'(char)\s*([^\s]*)\[\]'), c_char_p,2)] # match "char name[]"
-call_back_A = [(re.compile(r'(DAQmxEveryNSamplesEventCallbackPtr)\s*([^\s]*)'),DAQmxEveryNSamplesEventCallbackPtr ,2)]
-call_back_B = [(re.compile(r'(DAQmxDoneEventCallbackPtr)\s*([^\s]*)'),DAQmxDoneEventCallbackPtr,2)]
-call_back_C = [(re.compile(r'(DAQmxSignalEventCallbackPtr)\s*([^\s]*)'),DAQmxSignalEventCallbackPtr,2)]
-
-# Create a list with all regular expressions
-c_to_ctype_map = []
-for l in [const_char, simple_type, pointer_type, pointer_type_array, pointer_type_array,pointer_type_2,char_etoile, void_etoile,char_array,call_back_A, call_back_B, call_back_C]:
-    c_to_ctype_map.extend(l)
-
 # The list of all functions
-# function_dict: the keys are function name, the value is a dictionary with 'arg_type' and 'arg_name', the type and name of each argument 
+# function_dict: the keys are function name, the value is a dictionary with 'arg_spec' and 'arg_name', the type specification and name of each argument,
+# and, once the function is bound, 'arg_type', the ctypes type of each argument
 function_list = [] 
 function_dict = {} 
 
-def _define_function(name, arg_list, arg_name):
+# Names of the functions bound so far, in the order they were bound
+bound_functions = []
+_bound = {}
+
+# Each type specification in the table is a python expression giving the ctypes type, e.g. 'POINTER(int32)'; each is evaluated once
+_resolved_types = {}
+
+def _resolve_type(spec):
+    """
+    Convert a type specification from the binding table into a ctypes type
+    """
+    if spec not in _resolved_types:
+        _resolved_types[spec] = eval(spec)
+    return _resolved_types[spec]
+
+def bind_function(name):
     """ 
-    Record details of function
     Fetch the C function and apply argument checks
     Create error-raising wrapper for the C function and add to the module's dict
+    Each call of the wrapper is traced as a span named `daqmx.<name>` (see :mod:`tracing`)
+    Each function is only bound once - later calls return the same wrapper
+
+    :param name: the function name, as in NIDAQmx.h
+
+    :returns: the error-raising wrapper
     """
-    function_dict[name] = {'arg_type':arg_list, 'arg_name':arg_name}
+    if name in _bound:
+        return _bound[name]
+    details = function_dict[name]
+    arg_list = [_resolve_type(spec) for spec in details['arg_spec']]
+    details['arg_type'] = arg_list
     cfunc = getattr(DAQlib, name)
     setattr(cfunc, 'argtypes', arg_list)
     func = catch_error(cfunc)
     func.__name__ = name
-    func.__doc__ = '%s(%s) -> error.' % (name, ','.join(arg_name))
+    func = traced("daqmx." + name)(func)
+    func.__doc__ = '%s(%s) -> error.' % (name, ','.join(details['arg_name']))
+    _bound[name] = func
+    bound_functions.append(name)
     globals()[name] = func
+    return func
 
+def binding_stats():
+    """
+    Summarise how many of the header's functions have actually been bound
 
-for line in include_file:
-    line = line[0:-1]
-    if '__CFUNC' in line and function_parser.match(line):
-        name = function_parser.match(line).group(1)
-        function_list.append(name)
-        arg_string = function_parser.match(line).group(2)
-        arg_list = []
-        arg_name = []
-        for arg in re.split(', |,',arg_string): # Almost everywhere there is a space after the comma
-            for (reg_expr, new_type, groug_nb) in c_to_ctype_map:
-                reg_expr_result = reg_expr.search(arg)
-                if reg_expr_result is not None:
-                    arg_list.append(new_type)
-                    arg_name.append(reg_expr_result.group(groug_nb))
-                    break # break the for loop
-        _define_function(name, arg_list, arg_name)
+    :returns: dictionary with 'declared' (number of functions in the header), 'bound' (number bound so far) and 'functions' (names of the bound functions, in bind order)
+    """
+    return {'declared' : len(function_list),
+            'bound' : len(bound_functions),
+            'functions' : list(bound_functions)}
 
-include_file.close()
+for name, arg_spec, arg_name in load_table(dot_h_file)['functions']:
+    function_list.append(name)
+    function_dict[name] = {'arg_spec':arg_spec, 'arg_name':arg_name}
 
 
 ##############################
-#  Clean private functions from namespace
+# Lazy binding
 ##############################
-del _define_function
+class _LazyFunctionModule(type(sys)):
+    """
+    Stands in for this module in sys.modules when lazy_binding is set in config.py.
+    Functions from the header are bound by :func:`bind_function` the first time they are accessed as attributes, and are plain attributes afterwards.
+    """
+    def __init__(self, module):
+        super(_LazyFunctionModule, self).__init__(module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # keep the real module alive - python 2 clears a module's globals when it is deleted
+        self._module = module
+
+    def __getattr__(self, name):
+        if name not in function_dict:
+            raise AttributeError("module '{0}' has no attribute '{1}'".format(self.__name__, name))
+        func = bind_function(name)
+        setattr(self, name, func)
+        return func
+
+if lazy_binding:
+    sys.modules[__name__] = _LazyFunctionModule(sys.modules[__name__])
+else:
+    for name in function_list:
+        bind_function(name)
@@ -0,0 +1,205 @@
+"""
+A pure-python stand-in for the NI-DAQmx library, so the SMELLIE gain voltage and trigger generators can run their real task code on a machine without the NI Unit (see smellie.simulator).
+It implements the DAQmx functions and constants those generators use, keeping the state of each task: analogue output tasks keep the last buffer written to them,
+and finite tasks run for as long as their samples or pulses would take on the hardware, then fire their Done event.
+"""
+from types import TaskHandle
+from threading import Event, Lock, Timer
+import numpy
+
+# Values of the DAQmx constants used, as defined in NIDAQmx.h
+DAQmx_Val_Volts = 10348
+DAQmx_Val_Rising = 10280
+DAQmx_Val_FiniteSamps = 10178
+DAQmx_Val_ContSamps = 10123
+DAQmx_Val_GroupByChannel = 0
+DAQmx_Val_Seconds = 10364
+DAQmx_Val_Low = 10214
+
+# Error codes raised by the stand-in, as the real library's
+ERR_INVALID_TASK = -200088
+ERR_WAIT_TIMEOUT = -200560
+
+class StandInDAQmxError(Exception):
+    """
+    Thrown where the real library would return a negative error code (and :mod:`daqmx.functions` would raise a DAQError)
+    """
+    def __init__(self, error, mess, fname):
+        Exception.__init__(self, "{0} in function {1} (error {2})".format(mess, fname, error))
+        self.error = error
+        self.mess = mess
+        self.fname = fname
+
+class StandInTask(object):
+    """
+    The state of one DAQmx task
+    """
+    def __init__(self):
+        self.channel = None
+        self.kind = None
+        self.sample_mode = None
+        self.rate = None
+        self.n_samples = None
+        self.data = None
+        self.high_times = None
+        self.low_times = None
+        self.running = False
+        self.done = Event()
+        self.timer = None
+        self.done_callback = None
+        self.callback_data = None
+
+class StandInDAQmx(object):
+    """
+    Stand-in for the DAQmx functions (:mod:`daqmx.functions`) and constants (:mod:`daqmx.constants`) - pass it to a generator as its DAQmx library.
+    Keeps counts of what has been asked of it, for :func:`smellie.simulator.simulator_stats`.
+    """
+    TaskHandle = TaskHandle
+    DAQmx_Val_Volts = DAQmx_Val_Volts
+    DAQmx_Val_Rising = DAQmx_Val_Rising
+    DAQmx_Val_FiniteSamps = DAQmx_Val_FiniteSamps
+    DAQmx_Val_ContSamps = DAQmx_Val_ContSamps
+    DAQmx_Val_GroupByChannel = DAQmx_Val_GroupByChannel
+    DAQmx_Val_Seconds = DAQmx_Val_Seconds
+    DAQmx_Val_Low = DAQmx_Val_Low
+
+    def __init__(self, task_setup = None):
+        """
+        :param task_setup: optional object whose wait() is called when a task is created, to model the time taken to create and configure it (see smellie.simulator)
+        """
+        self.task_setup = task_setup
+        self.tasks = {}
+        self.next_handle = 1
+        self.lock = Lock()
+        self.task_setups = 0
+        self.writes = 0
+        self.starts = 0
+        self.pulses_sent = 0
+        self.pulse_time = 0.0
+        # the last analogue output buffer written
+        self.output = None
+
+    def _task(self, handle, fname):
+        """
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        try:
+            return self.tasks[getattr(handle, "value", handle)]
+        except KeyError:
+            raise StandInDAQmxError(ERR_INVALID_TASK, "Task specified is invalid or does not exist", fname)
+
+    def _finish(self, handle, task):
+        """
+        A finite task has output all its samples or pulses: stop it, and fire its Done event
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        with self.lock:
+            if not task.running:
+                return
+            task.running = False
+            task.done.set()
+        if task.done_callback is not None:
+            task.done_callback(handle, 0, task.callback_data)
+
+    def is_running(self):
+        """
+        :returns: True if any task is running
+        """
+        return any(task.running for task in self.tasks.values())
+
+    def DAQmxCreateTask(self, name, handle_ref):
+        if self.task_setup is not None:
+            self.task_setup.wait()
+        with self.lock:
+            handle = self.next_handle
+            self.next_handle += 1
+            self.tasks[handle] = StandInTask()
+            self.task_setups += 1
+        handle_ref._obj.value = handle
+        return 0
+
+    def DAQmxCreateAOVoltageChan(self, handle, channel, name, v_min, v_max, units, scale):
+        task = self._task(handle, "DAQmxCreateAOVoltageChan")
+        task.kind = "ao"
+        task.channel = channel
+        return 0
+
+    def DAQmxCreateCOPulseChanTime(self, handle, channel, name, units, idle_state, initial_delay, low_time, high_time):
+        task = self._task(handle, "DAQmxCreateCOPulseChanTime")
+        task.kind = "co"
+        task.channel = channel
+        return 0
+
+    def DAQmxCfgSampClkTiming(self, handle, source, rate, active_edge, sample_mode, n_samples):
+        task = self._task(handle, "DAQmxCfgSampClkTiming")
+        task.rate = float(rate)
+        task.sample_mode = sample_mode
+        task.n_samples = n_samples
+        return 0
+
+    def DAQmxCfgImplicitTiming(self, handle, sample_mode, n_samples):
+        task = self._task(handle, "DAQmxCfgImplicitTiming")
+        task.sample_mode = sample_mode
+        task.n_samples = n_samples
+        return 0
+
+    def DAQmxRegisterDoneEvent(self, handle, options, callback, callback_data):
+        task = self._task(handle, "DAQmxRegisterDoneEvent")
+        task.done_callback = callback
+        task.callback_data = callback_data
+        return 0
+
+    def DAQmxWriteAnalogF64(self, handle, n_samples, auto_start, timeout, layout, data, written, reserved):
+        task = self._task(handle, "DAQmxWriteAnalogF64")
+        # the library copies the buffer into the task
+        task.data = numpy.array(data[:n_samples])
+        self.output = task.data
+        self.writes += 1
+        return 0
+
+    def DAQmxWriteCtrTime(self, handle, n_samples, auto_start, timeout, layout, high_times, low_times, written, reserved):
+        task = self._task(handle, "DAQmxWriteCtrTime")
+        task.high_times = numpy.array(high_times[:n_samples])
+        task.low_times = numpy.array(low_times[:n_samples])
+        self.writes += 1
+        return 0
+
+    def DAQmxStartTask(self, handle):
+        task = self._task(handle, "DAQmxStartTask")
+        task.running = True
+        task.done.clear()
+        self.starts += 1
+        if task.sample_mode != DAQmx_Val_FiniteSamps:
+            return 0
+        if task.kind == "co":
+            duration = float(numpy.sum(task.high_times) + numpy.sum(task.low_times))
+            self.pulses_sent += len(task.high_times)
+            self.pulse_time += duration
+        else:
+            duration = task.n_samples / task.rate
+        task.timer = Timer(duration, self._finish, [getattr(handle, "value", handle), task])
+        task.timer.daemon = True
+        task.timer.start()
+        return 0
+
+    def DAQmxWaitUntilTaskDone(self, handle, timeout):
+        task = self._task(handle, "DAQmxWaitUntilTaskDone")
+        if task.running and not task.done.wait(None if timeout < 0 else timeout):
+            raise StandInDAQmxError(ERR_WAIT_TIMEOUT, "Wait Until Done did not indicate that the task was done within the specified timeout", "DAQmxWaitUntilTaskDone")
+        return 0
+
+    def DAQmxStopTask(self, handle):
+        task = self._task(handle, "DAQmxStopTask")
+        with self.lock:
+            if task.timer is not None:
+                task.timer.cancel()
+                task.timer = None
+            task.running = False
+            task.done.set()
+        return 0
+
+    def DAQmxClearTask(self, handle):
+        self.DAQmxStopTask(handle)
+        with self.lock:
+            del self.tasks[getattr(handle, "value", handle)]
+        return 0
@@ -1,4 +1,5 @@
-from sepia import dll, string_buffer, raise_on_error_code
+from sepia import dll, out_params, STRING_BUFFER, raise_on_error_code, check_channel
+from decode_cache import memoize_decode
 import ctypes
 
 """
@@ -23,14 +24,16 @@ def get_module_type(dev_id, slot_id, get_primary):
     :type module type: int
     """
     check_channel(dev_id, "get_module_type")
-    module_type = ctypes.c_int32()
-    dll.SEPIA2_COM_GetModuleType(dev_id, slot_id, iGetPrimary, module_type)
-    return module_type
+    with out_params(ctypes.c_int32) as (module_type,):
+        dll.SEPIA2_COM_GetModuleType(dev_id, slot_id, get_primary, ctypes.byref(module_type))
+        return module_type.value
 
+@memoize_decode
 @raise_on_error_code
 def decode_module_type(module_type):
     """
     Decode the module type into human-readable string
+    Each type is only decoded by the .dll once (see :mod:`decode_cache`).
 
     :param module_type: module type
     :type module_type: int
@@ -38,9 +41,9 @@ def decode_module_type(module_type):
     :returns: module
     :type module: string    
     """
-    buff = string_buffer()
-    dll.SEPIA2_COM_DecodeModuleType(module_type, buff)
-    return buff
+    with out_params(STRING_BUFFER) as (buff,):
+        dll.SEPIA2_COM_DecodeModuleType(module_type, buff)
+        return buff.value
 
 @raise_on_error_code
 def get_serial_number(dev_id, slot_id, iGetPrimary):
@@ -59,9 +62,9 @@ def get_serial_number(dev_id, slot_id, iGetPrimary):
     :returns: serial number
     :type serial number: string
     """
-    buff = string_buffer()
-    dll.SEPIA2_COM_GetSerialNumber(dev_id, slot_id, iGetPrimary, buff)
-    return buff
+    with out_params(STRING_BUFFER) as (buff,):
+        dll.SEPIA2_COM_GetSerialNumber(dev_id, slot_id, iGetPrimary, buff)
+        return buff.value
 
 @raise_on_error_code
 def has_secondary_module(dev_id, slot_id):
@@ -77,6 +80,6 @@ def has_secondary_module(dev_id, slot_id):
     :returns: has secondary
     :type has secondary: bool
     """
-    has_secondary = ctypes.c_int32()
-    dll.SEPIA2_COM_HasSecondaryModule(dev_id, slot_id, has_secondary)
-    return bool(has_secondary)
+    with out_params(ctypes.c_int32) as (has_secondary,):
+        dll.SEPIA2_COM_HasSecondaryModule(dev_id, slot_id, ctypes.byref(has_secondary))
+        return bool(has_secondary.value)
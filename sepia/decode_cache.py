@@ -0,0 +1,74 @@
+from functools import wraps
+
+"""
+Memoized decode tables for the SEPIA enumeration lookups (frequency modes, head types, module types and error codes).
+These map small fixed sets of integers to constant strings, so each code is only decoded by the .dll once; later lookups are dictionary hits.
+The tables are tied to the .dll version they were filled with, and are cleared by :func:`validate` if it changes.
+"""
+
+# decode function name -> {code : string}
+_tables = {}
+
+# the .dll version the tables were filled with
+_dll_version = None
+
+def memoize_decode(in_function):
+    """
+    Decorator to remember the result of a decode function for each code.  Calls that raise are not remembered.
+
+    :param in_function: decode function taking a single integer code
+
+    :returns: a logically equivalent function that only calls in_function the first time each code is seen
+    """
+    table = _tables.setdefault(in_function.__name__, {})
+    @wraps(in_function)
+    def modified(code):
+        try:
+            return table[code]
+        except KeyError:
+            value = in_function(code)
+            table[code] = value
+            return value
+    return modified
+
+def clear():
+    """
+    Empty every decode table
+    """
+    for table in _tables.itervalues():
+        table.clear()
+
+def validate(dll_version = None):
+    """
+    Clear the decode tables if the .dll version has changed since they were filled
+
+    :param dll_version: the current .dll version, polled with :func:`sepia.usb.get_dll_version` if not given
+    """
+    global _dll_version
+    if dll_version is None:
+        from usb import get_dll_version
+        dll_version = get_dll_version()
+    if dll_version != _dll_version:
+        clear()
+        _dll_version = dll_version
+
+def fill(dll_version = None):
+    """
+    Validate the tables, then decode every frequency mode and head type up front, so no decode during operation calls into the .dll.
+    Module types and error codes have no fixed range and are filled as they are seen.
+
+    :param dll_version: the current .dll version, polled if not given
+    """
+    from slm import decode_freq_trig_mode, decode_head_type
+    validate(dll_version)
+    for freq_mode in xrange(8):
+        decode_freq_trig_mode(freq_mode)
+    for head_type_code in xrange(4):
+        decode_head_type(head_type_code)
+
+def table_sizes():
+    """
+    :returns: number of codes remembered by each decode function
+    :type sizes: dict
+    """
+    return dict((name, len(table)) for (name, table) in _tables.iteritems())
@@ -1,4 +1,4 @@
-from sepia import dll, string_buffer, raise_on_error_code
+from sepia import dll, out_params, STRING_BUFFER, raise_on_error_code, check_channel
 import ctypes
 
 """
@@ -19,9 +19,9 @@ def get_fwr_version(dev_id):
     :returns: current version
     :type current version: string
     """
-    vers = string_buffer()
-    dll.SEPIA2_FWR_GetVersion(dev_id, vers)
-    return vers
+    with out_params(STRING_BUFFER) as (vers,):
+        dll.SEPIA2_FWR_GetVersion(dev_id, vers)
+        return vers.value
 
 @raise_on_error_code
 def get_module_map(dev_id, do_soft_restart = True):
@@ -39,9 +39,9 @@ def get_module_map(dev_id, do_soft_restart = True):
     :type module count: int
     """
     check_channel(dev_id, "get_module_map")
-    module_count = ctypes.c_int32()
-    dll.SEPIA2_FWR_GetVersion(dev_id, bool(do_soft_restart), module_count)
-    return module_count
+    with out_params(ctypes.c_int32) as (module_count,):
+        dll.SEPIA2_FWR_GetModuleMap(dev_id, int(bool(do_soft_restart)), ctypes.byref(module_count))
+        return module_count.value
 
 @raise_on_error_code
 def free_module_map(dev_id):
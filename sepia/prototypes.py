@@ -0,0 +1,70 @@
+from ctypes import c_int32, c_ubyte, c_ushort, c_char_p, POINTER
+
+"""
+Prototypes of every SEPIA2 .dll function used by this package: the argument types of each, declared once and applied when the .dll is loaded (see :func:`sepia.sepia.load_dll`).
+Every function returns an int error code (0 on success, negative on failure).
+Out-parameters are declared with :func:`out`, so they can be checked when the .dll is bound and the right objects borrowed from :class:`sepia.sepia.OutParameterPool`.
+"""
+
+# Marks a string out-parameter: a char buffer of SEPIA_STR_BUFFER_SIZE bytes
+STRING_OUT = "string_out"
+
+class out(object):
+    """
+    Declares an out-parameter: the .dll writes a value of ctype through a pointer
+    """
+    def __init__(self, ctype):
+        self.ctype = ctype
+
+    def argtype(self):
+        """
+        :returns: the ctypes argument type, POINTER(ctype)
+        """
+        return POINTER(self.ctype)
+
+def argtype(declaration):
+    """
+    Convert an argument declaration to its ctypes argument type
+
+    :param declaration: a ctypes type (input), an :class:`out` instance, or STRING_OUT
+    """
+    if declaration is STRING_OUT:
+        return c_char_p
+    if isinstance(declaration, out):
+        return declaration.argtype()
+    return declaration
+
+PROTOTYPES = {
+    # LIB
+    "SEPIA2_LIB_GetVersion"           : [STRING_OUT],
+    "SEPIA2_LIB_DecodeError"          : [c_int32, STRING_OUT],
+    # USB
+    "SEPIA2_USB_OpenDevice"           : [c_int32, STRING_OUT, STRING_OUT],
+    "SEPIA2_USB_CloseDevice"          : [c_int32],
+    "SEPIA2_USB_GetStrDescriptor"     : [c_int32, STRING_OUT],
+    # FWR
+    "SEPIA2_FWR_GetVersion"           : [c_int32, STRING_OUT],
+    "SEPIA2_FWR_GetModuleMap"         : [c_int32, c_int32, out(c_int32)],
+    "SEPIA2_FWR_FreeModuleMap"        : [c_int32],
+    # COM
+    "SEPIA2_COM_GetModuleType"        : [c_int32, c_int32, c_int32, out(c_int32)],
+    "SEPIA2_COM_DecodeModuleType"     : [c_int32, STRING_OUT],
+    "SEPIA2_COM_GetSerialNumber"      : [c_int32, c_int32, c_int32, STRING_OUT],
+    "SEPIA2_COM_HasSecondaryModule"   : [c_int32, c_int32, out(c_int32)],
+    # SCM
+    "SEPIA2_SCM_GetLaserSoftLock"     : [c_int32, c_int32, out(c_ubyte)],
+    "SEPIA2_SCM_SetLaserSoftLock"     : [c_int32, c_int32, c_ubyte],
+    "SEPIA2_SCM_GetLaserLocked"       : [c_int32, c_int32, out(c_ubyte)],
+    # SLM
+    "SEPIA2_SLM_GetPulseParameters"   : [c_int32, c_int32, out(c_int32), out(c_ubyte), out(c_int32)],
+    "SEPIA2_SLM_SetPulseParameters"   : [c_int32, c_int32, c_int32, c_ubyte],
+    "SEPIA2_SLM_DecodeFreqTrigMode"   : [c_int32, STRING_OUT],
+    "SEPIA2_SLM_GetIntensityFineStep" : [c_int32, c_int32, out(c_ushort)],
+    "SEPIA2_SLM_SetIntensityFineStep" : [c_int32, c_int32, c_ushort],
+    "SEPIA2_SLM_DecodeHeadType"       : [c_int32, STRING_OUT],
+    # SOM
+    "SEPIA2_SOM_GetFreqTrigMode"      : [c_int32, c_int32, out(c_int32)],
+}
+
+# Functions whose return code must not be turned into an exception - decoding an error must not itself raise
+NO_ERRCHECK = ("SEPIA2_LIB_DecodeError",)
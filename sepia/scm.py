@@ -1,4 +1,5 @@
-from sepia import dll, raise_on_error_code
+from sepia import dll, out_params, raise_on_error_code
+import ctypes
 
 """
 Device Operational Safety Controller Functions (SCM)
@@ -20,9 +21,9 @@ def get_laser_soft_lock(dev_id, slot_id):
     :returns: is_locked
     :type is_locked: bool
     """
-    contents = ctypes.c_ubyte()
-    dll.SEPIA2_SCM_GetLaserSoftLock(dev_id, slot_id, contents)
-    return bool(contents)
+    with out_params(ctypes.c_ubyte) as (contents,):
+        dll.SEPIA2_SCM_GetLaserSoftLock(dev_id, slot_id, ctypes.byref(contents))
+        return bool(contents.value)
 
 @raise_on_error_code
 def set_laser_soft_lock(dev_id, slot_id, contents):
@@ -56,6 +57,6 @@ def get_laser_locked(dev_id, slot_id):
     :returns: power_state
     :type power_state: bool    
     """
-    state = ctypes.c_ubyte()
-    dll.SEPIA2_SCM_GetLaserLocked(dev_id, slot_id, state)
-    return bool(state)
+    with out_params(ctypes.c_ubyte) as (state,):
+        dll.SEPIA2_SCM_GetLaserLocked(dev_id, slot_id, ctypes.byref(state))
+        return bool(state.value)
@@ -1,8 +1,21 @@
-from smellie_config import SEPIA_DLL_PATH, SEPIA_STR_BUFFER_SIZE
+from smellie_config import SEPIA_DLL_PATH, SEPIA_STR_BUFFER_SIZE, SEPIA_DLL_STAND_IN
+from decode_cache import memoize_decode
+from tracing import traced
+from prototypes import PROTOTYPES, NO_ERRCHECK, STRING_OUT, out, argtype
 from functools import wraps
+from contextlib import contextmanager
+from inspect import getargspec
+import threading
 import ctypes
+import sys
 import os
 
+# ctypes raises WindowsError for failed calls through an OleDLL; it does not exist off Windows
+try:
+    WindowsError
+except NameError:
+    WindowsError = OSError
+
 """
 Core functions for use in the SEPIA package - not intended for use outside.
 """
@@ -13,6 +26,73 @@ def string_buffer():
     """
     return ctypes.create_string_buffer(SEPIA_STR_BUFFER_SIZE)
 
+# Stands for a :func:`string_buffer` in :func:`out_params`
+STRING_BUFFER = "string_buffer"
+
+class OutParameterPool(object):
+    """
+    Per-thread free lists of preallocated ctypes out-parameters (c_int32(), c_ubyte(), string buffers, ...), so that wrappers polled at a high rate do not allocate new ones on every call.
+    Wrappers must convert the results to python values before returning the objects to the pool.
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    def _free_lists(self):
+        """
+        This thread's free lists, {type : [object]}
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        try:
+            return self.local.free
+        except AttributeError:
+            self.local.free = {}
+            return self.local.free
+
+    def borrow(self, ctype):
+        """
+        :param ctype: a ctypes type, or STRING_BUFFER
+
+        :returns: an object of that type, from this thread's pool if one is free
+        """
+        free = self._free_lists().get(ctype)
+        if free:
+            return free.pop()
+        return string_buffer() if ctype is STRING_BUFFER else ctype()
+
+    def give_back(self, ctype, obj):
+        """
+        Return a borrowed object to this thread's pool
+
+        :param ctype: the type it was borrowed as
+        :param obj: the object
+        """
+        self._free_lists().setdefault(ctype, []).append(obj)
+
+    def size(self):
+        """
+        :returns: number of free objects of each type in this thread's pool
+        :type size: dict
+        """
+        return dict((ctype if ctype is STRING_BUFFER else ctype.__name__, len(free)) for (ctype, free) in self._free_lists().iteritems())
+
+pool = OutParameterPool()
+
+@contextmanager
+def out_params(*ctypes_):
+    """
+    Borrow out-parameters from the pool for the duration of a with block, e.g. `with out_params(ctypes.c_int32, STRING_BUFFER) as (count, name):`
+
+    :param ctypes_: the ctypes types (or STRING_BUFFER) wanted
+
+    :returns: tuple of objects, one of each type
+    """
+    borrowed = [pool.borrow(ctype) for ctype in ctypes_]
+    try:
+        yield tuple(borrowed)
+    finally:
+        for ctype, obj in zip(ctypes_, borrowed):
+            pool.give_back(ctype, obj)
+
 class SepiaDLLError(Exception):
     """
     Raised if an exception is flagged up *during* a call to the .dll
@@ -25,19 +105,153 @@ class SepiaLogicError(Exception):
     """
     pass
 
-# Open the .dll on import
-#if not os.path.exists(SEPIA_DLL_PATH):
-#  raise SepiaLogicError("Cannot open dll on path {0}".format(SEPIA_DLL_PATH))
-#try:
-#  dll = ctypes.OleDLL(dll_path)
-#except:
-#  raise SepiaLogicError("Opening dll failed!")
+class SepiaLibrary(object):
+    """
+    The SEPIA2 .dll: one bound, typed callable per function in :data:`prototypes.PROTOTYPES`, set as attributes by :func:`load_dll`.
+    Each callable raises :class:`.SepiaDLLError` itself if the .dll returns an error code.
+    """
+    def __init__(self):
+        self.path = None
+        self.library = None
 
-dll = None
+    def is_loaded(self):
+        """
+        :returns: True once :func:`load_dll` has bound the functions
+        """
+        return self.path is not None
+
+    def __getattr__(self, name):
+        # only reached for functions that have not been bound
+        if name.startswith("SEPIA2_"):
+            if self.is_loaded():
+                raise SepiaLogicError("{0} has no prototype in sepia.prototypes".format(name))
+            raise SepiaLogicError("Cannot call {0}: the SEPIA .dll has not been loaded".format(name))
+        raise AttributeError(name)
 
 """
-The ..dll itself
+The ..dll itself - its functions are bound by :func:`load_dll`
 """
+dll = SepiaLibrary()
+
+def check_prototype(name, declarations):
+    """
+    Check a prototype before binding it: every input must be a simple ctypes type, and every out-parameter a simple ctypes type or a string buffer
+
+    :param name: the function name
+    :param declarations: its argument declarations
+
+    :raises: :class:`.SepiaLogicError` if a declaration is invalid
+    """
+    for i, declaration in enumerate(declarations):
+        ctype = declaration.ctype if isinstance(declaration, out) else declaration
+        if declaration is STRING_OUT:
+            continue
+        if not (isinstance(ctype, type) and issubclass(ctype, ctypes._SimpleCData)):
+            raise SepiaLogicError("Invalid prototype for {0}: argument {1} is declared as {2}".format(name, i, declaration))
+
+def _check_error_code(result, func, args):
+    """
+    ctypes errcheck: raise a decoded :class:`.SepiaDLLError` for a negative return code
+    This is a private function, indicated by the underscore before the name - do not change that!
+    """
+    if result < 0:
+        raise SepiaDLLError("{0} (error {1})".format(decode_error(result), result))
+    return result
+
+def _bind_ctypes(library, name, declarations):
+    """
+    Apply a prototype to a function of a real .dll
+    This is a private function, indicated by the underscore before the name - do not change that!
+    """
+    func = getattr(library, name)
+    func.argtypes = [argtype(declaration) for declaration in declarations]
+    func.restype = ctypes.c_int
+    if name not in NO_ERRCHECK:
+        func.errcheck = _check_error_code
+    return func
+
+def _stand_in_arg(name, i, declaration, arg):
+    """
+    Check one argument against its declaration, as ctypes would, and convert it for the stand-in .dll
+    This is a private function, indicated by the underscore before the name - do not change that!
+    """
+    if declaration is STRING_OUT:
+        if isinstance(arg, ctypes.Array) and arg._type_ is ctypes.c_char:
+            return arg
+        raise ctypes.ArgumentError("{0} argument {1}: expected a string buffer, got {2}".format(name, i, type(arg).__name__))
+    if isinstance(declaration, out):
+        target = getattr(arg, "_obj", None)
+        if isinstance(arg, ctypes._Pointer):
+            target = arg.contents
+        if isinstance(target, declaration.ctype):
+            return target
+        raise ctypes.ArgumentError("{0} argument {1}: expected a pointer to {2}, got {3}".format(name, i, declaration.ctype.__name__, type(arg).__name__))
+    if isinstance(arg, ctypes._SimpleCData):
+        arg = arg.value
+    declaration.from_param(arg)
+    return declaration(arg).value
+
+def _bind_stand_in(library, name, declarations):
+    """
+    Wrap a method of the stand-in .dll so that it is called like a prototyped ctypes function
+    This is a private function, indicated by the underscore before the name - do not change that!
+    """
+    implementation = getattr(library, name)
+    if len(getargspec(implementation).args) - 1 != len(declarations):
+        raise SepiaLogicError("Stand-in {0} does not match its prototype".format(name))
+    def bound(*args):
+        if len(args) != len(declarations):
+            raise TypeError("{0} takes {1} arguments ({2} given)".format(name, len(declarations), len(args)))
+        if library.latency is not None:
+            library.latency.wait()
+        result = implementation(*[_stand_in_arg(name, i, declaration, arg) for (i, (declaration, arg)) in enumerate(zip(declarations, args))])
+        if name not in NO_ERRCHECK:
+            _check_error_code(result, bound, args)
+        return result
+    bound.__name__ = name
+    return bound
+
+def load_dll(path = SEPIA_DLL_PATH, stand_in = SEPIA_DLL_STAND_IN):
+    """
+    Load the SEPIA2 library and bind every function in :data:`prototypes.PROTOTYPES` onto :data:`dll`.
+    The library is loaded with WinDLL on Windows and CDLL elsewhere; with stand_in the pure-python :class:`stand_in.StandInSepiaDLL` is used instead.
+
+    :param path: path of the .dll (or .so), set by SEPIA_DLL_PATH in config.py
+    :param stand_in: use the stand-in .dll, set by SEPIA_DLL_STAND_IN in config.py
+
+    :returns: :data:`dll`
+
+    :raises: :class:`.SepiaLogicError` if the library cannot be found, or a prototype is invalid
+    """
+    if stand_in:
+        from stand_in import StandInSepiaDLL
+        library = StandInSepiaDLL()
+        path = "stand-in"
+        bind = _bind_stand_in
+    else:
+        if not os.path.exists(path):
+            raise SepiaLogicError("Cannot open dll on path {0}".format(path))
+        try:
+            library = ctypes.WinDLL(path) if sys.platform.startswith("win") else ctypes.CDLL(path)
+        except OSError as e:
+            raise SepiaLogicError("Opening dll {0} failed: {1}".format(path, e))
+        bind = _bind_ctypes
+    for name, declarations in PROTOTYPES.iteritems():
+        check_prototype(name, declarations)
+        setattr(dll, name, bind(library, name, declarations))
+    dll.library = library
+    dll.path = path
+    return dll
+
+def ensure_dll_loaded():
+    """
+    Load the SEPIA2 library with the config.py settings, unless it is already loaded
+
+    :returns: :data:`dll`
+    """
+    if not dll.is_loaded():
+        load_dll()
+    return dll
 
 def check_channel(chan, name):
     """
@@ -55,27 +269,41 @@ def check_channel(chan, name):
         raise SepiaLogicError("Cannot call {0} with channel {1}, must be between 0 and 7".format(name, chan))
 
 # Error Handling and Decoding
+@memoize_decode
+def _decode_error_dll(iErr):
+    """
+    Decode an error code with the .dll, remembering each successful translation (see :mod:`decode_cache`)
+    This is a private function, indicated by the underscore before the name - do not change that!
+
+    :raises: :class:`.SepiaDLLError` if the .dll cannot translate the code - failures are not remembered
+    """
+    with out_params(STRING_BUFFER) as (str_buff,):
+        result = dll.SEPIA2_LIB_DecodeError(iErr, str_buff)
+        if result != 0:
+            raise SepiaDLLError("Cannot decode SEPIA error code {0} (error {1})".format(iErr, result))
+        return str_buff.value
+
 def decode_error(iErr):
     """
     Decodes an error code thrown by the hardware. 
     If the translation fails, this returns SEPIA Library: unknown error code.
+    Each code is only decoded by the .dll once it has been translated (see :mod:`decode_cache`); the fallback is not remembered, so a code that failed to decode, e.g. while the .dll was loading, is tried again next time.
 
     :param iErr: .dll generated error code
 
     :returns: error message
     :type error message: string
     """
-    str_buff = string_buffer()
     try:
-        dll.SEPIA2_LIB_DecodeError(iErr, str_buff)
-        return str_buff
-    except WindowsError:
+        return _decode_error_dll(iErr)
+    except (SepiaDLLError, WindowsError):
         return "SEPIA Library: unknown error code {0}".format(iErr)
 
 def raise_on_error_code(in_function):
     """
-    OleDll automatically detects a non-zero exit code and throws a WindowsException.
+    Functions bound by :func:`load_dll` raise SepiaDLLError themselves; an OleDll instead automatically detects a non-zero exit code and throws a WindowsException.
     This decorator produces a modified function that catches this, extracts and translates the error code, and throws a SepiaDLLError.
+    Each call is also traced as a span named after the function, e.g. `sepia.slm.get_pulse_parameters` (see :mod:`tracing`).
 
     :param in_function: the function to wrap
 
@@ -84,7 +312,7 @@ def raise_on_error_code(in_function):
     @wraps(in_function)
     def modified(*args, **kwargs):
         try:
-            return in_function(args, kwargs)
+            return in_function(*args, **kwargs)
         except WindowsError as e:
-            raise SepiaDLLError(decode_error(e.winerr))
-    return modified
+            raise SepiaDLLError(decode_error(e.winerror))
+    return traced("{0}.{1}".format(in_function.__module__, in_function.__name__))(modified)
@@ -1,4 +1,5 @@
-from sepia import string_buffer, dll, raise_on_error_code, SepiaLogicError
+from sepia import out_params, STRING_BUFFER, dll, raise_on_error_code, SepiaLogicError
+from decode_cache import memoize_decode
 import ctypes
 
 """
@@ -26,11 +27,9 @@ def get_pulse_parameters(dev_id, slot_id):
     :returns: head_type
     :type head_type: int
     """
-    freq = ctypes.c_int32()
-    pulse_mode = ctypes.c_ubyte()
-    head_type = ctypes.c_int32()
-    dll.SEPIA2_SLM_GetPulseParameters(dev_id, slot_id, freq, pulse_mode, head_type)
-    return freq, pulse_mode, head_type
+    with out_params(ctypes.c_int32, ctypes.c_ubyte, ctypes.c_int32) as (freq, pulse_mode, head_type):
+        dll.SEPIA2_SLM_GetPulseParameters(dev_id, slot_id, ctypes.byref(freq), ctypes.byref(pulse_mode), ctypes.byref(head_type))
+        return freq.value, bool(pulse_mode.value), head_type.value
 
 @raise_on_error_code
 def set_pulse_parameters(dev_id, slot_id):
@@ -47,12 +46,14 @@ def set_pulse_parameters(dev_id, slot_id):
     """
 
     # The last two parameters are the pulse and frequency modes - DO NOT CHANGE  (see above and __init__.py)!
-    dll.SetPulseParameters(dev_id, slot_id, ctypes.c_int32(6), c_ubyte(1))
+    dll.SEPIA2_SLM_SetPulseParameters(dev_id, slot_id, ctypes.c_int32(6), ctypes.c_ubyte(1))
 
+@memoize_decode
 @raise_on_error_code
 def decode_freq_trig_mode(freq_mode):
     """
     Translate the frequency mode to a string for any SLM module
+    Each mode is only decoded by the .dll once (see :mod:`decode_cache`).
 
     :param freq_mode: the frequency mode - 0 (80MHz), 1 (40MHz), 2 (20MHz), 3 (10MHz), 4 (5MHz), 5 (2.5MHz), 6 (external pulse, rising edge), 7 (external pulse, falling edge)
     :type freq_mode: int
@@ -64,9 +65,9 @@ def decode_freq_trig_mode(freq_mode):
     """
     if not freq_mode in xrange(8):
         raise SepiaLogicError("Cannot decode the frequency mode - must be an integer between 0 and 7 inclusive")
-    buff = string_buffer()
-    dll.SEPIA2_SLM_DecodeFreqTrigMode(freq_mode, buff)
-    return buff
+    with out_params(STRING_BUFFER) as (buff,):
+        dll.SEPIA2_SLM_DecodeFreqTrigMode(freq_mode, buff)
+        return buff.value
 
 @raise_on_error_code
 def get_intensity_fine_step(dev_id, slot_id):
@@ -82,9 +83,9 @@ def get_intensity_fine_step(dev_id, slot_id):
     :returns: intensity
     :type intensity: int
     """
-    intensity = ctypes.c_ushort()
-    dll.SEPIA2_SLM_GetIntensityFineStep(dev_id, slot_id, intensity)
-    return intensity
+    with out_params(ctypes.c_ushort) as (intensity,):
+        dll.SEPIA2_SLM_GetIntensityFineStep(dev_id, slot_id, ctypes.byref(intensity))
+        return intensity.value
 
 @raise_on_error_code
 def set_intensity_fine_step(dev_id, slot_id, intensity):
@@ -104,10 +105,12 @@ def set_intensity_fine_step(dev_id, slot_id, intensity):
         raise SepiaLogicError("Cannot set the intensity fine step - must be an integer between 0 and 1000")
     dll.SEPIA2_SLM_SetIntensityFineStep(dev_id, slot_id, intensity)
 
+@memoize_decode
 @raise_on_error_code
 def decode_head_type(head_type_code):
     """
     Returns the head_type string at list position `head_type_code` for a given SLM module
+    Each code is only decoded by the .dll once (see :mod:`decode_cache`).
 
     :param head_type_code: must be between 0 and 3 inclusive
     :type head_type_code: int
@@ -119,6 +122,6 @@ def decode_head_type(head_type_code):
     """
     if not head_type_code in xrange(4):
         raise SepiaLogicError("Cannot decode head type code - must be between 0 and 3")
-    head_type = string_buffer()
-    dll.SEPIA2_SLM_DecodeHeadType(head_type_code, head_type)
-    return head_type
+    with out_params(STRING_BUFFER) as (head_type,):
+        dll.SEPIA2_SLM_DecodeHeadType(head_type_code, head_type)
+        return head_type.value
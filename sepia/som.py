@@ -1,4 +1,4 @@
-from sepia import dll, raise_on_error_code
+from sepia import dll, out_params, raise_on_error_code
 import ctypes
 
 """
@@ -20,6 +20,6 @@ def get_freq_trig_mode(dev_id, slot_id):
     :returns: freq_trig_mode
     :type freq_trig_mode: int
     """
-    mode = ctypes.c_int32()
-    dll.SEPIA2_SOM_GetTrigMode(dev_id, slot_id, mode)
-    return mode
+    with out_params(ctypes.c_int32) as (mode,):
+        dll.SEPIA2_SOM_GetFreqTrigMode(dev_id, slot_id, ctypes.byref(mode))
+        return mode.value
@@ -0,0 +1,192 @@
+"""
+A pure-python stand-in for the SEPIA2 .dll, so the sepia package (and the SMELLIE laser driver) can be exercised on a machine without the hardware.
+It keeps the state of one SLM laser driver module and implements every function in :data:`sepia.prototypes.PROTOTYPES`.
+Arguments arrive already checked against the prototypes (see :func:`sepia.sepia.load_dll`): out-parameters as the ctypes objects to write to, inputs as python values.
+"""
+
+DLL_VERSION = "stand-in 1.0"
+FIRMWARE_VERSION = "stand-in firmware 1.0"
+PRODUCT_MODEL = "SEPIA II (stand-in)"
+SERIAL_NUMBER = "0000000"
+
+# Error codes returned by the stand-in
+ERR_INVALID_DEVICE = -9001
+ERR_DEVICE_NOT_OPEN = -9002
+ERR_INVALID_PARAMETER = -9003
+
+ERRORS = {ERR_INVALID_DEVICE : "stand-in: invalid device index",
+          ERR_DEVICE_NOT_OPEN : "stand-in: device not open",
+          ERR_INVALID_PARAMETER : "stand-in: parameter out of range"}
+
+FREQ_TRIG_MODES = ["80MHz", "40MHz", "20MHz", "10MHz", "5MHz", "2.5MHz", "ext. rising", "ext. falling"]
+HEAD_TYPES = ["Pulsed Laser Diode", "LED", "Pulsed Laser Diode (bypass)", "Unknown"]
+MODULE_TYPES = {0 : "SLM 828", 1 : "SOM 828", 2 : "SCM 828"}
+
+class StandInSepiaDLL(object):
+    """
+    Stand-in for the SEPIA2 .dll.  Each SEPIA2_* method returns 0 on success or a negative error code, like the real library.
+    """
+    def __init__(self):
+        # optional object whose wait() is called before every function, to model the USB round trip (see smellie.simulator)
+        self.latency = None
+        self.open_devices = set()
+        self.module_map = set()
+        self.freq_mode = 0
+        self.pulse_mode = 0
+        self.head_type = 0
+        self.intensity = 0
+        self.soft_lock = 1
+        self.hard_lock = 0
+        self.trig_mode = 0
+
+    def _check_open(self, dev_id):
+        if not 0 <= dev_id < 8:
+            return ERR_INVALID_DEVICE
+        if dev_id not in self.open_devices:
+            return ERR_DEVICE_NOT_OPEN
+        return 0
+
+    def _decode(self, table, code, buff):
+        try:
+            buff.value = table[code]
+        except (IndexError, KeyError):
+            return ERR_INVALID_PARAMETER
+        return 0
+
+    # LIB
+    def SEPIA2_LIB_GetVersion(self, buff):
+        buff.value = DLL_VERSION
+        return 0
+
+    def SEPIA2_LIB_DecodeError(self, code, buff):
+        if code not in ERRORS:
+            return ERR_INVALID_PARAMETER
+        buff.value = ERRORS[code]
+        return 0
+
+    # USB
+    def SEPIA2_USB_OpenDevice(self, dev_id, product_model, serial_number):
+        if not 0 <= dev_id < 8:
+            return ERR_INVALID_DEVICE
+        self.open_devices.add(dev_id)
+        product_model.value = PRODUCT_MODEL
+        serial_number.value = SERIAL_NUMBER
+        return 0
+
+    def SEPIA2_USB_CloseDevice(self, dev_id):
+        error = self._check_open(dev_id)
+        self.open_devices.discard(dev_id)
+        return error
+
+    def SEPIA2_USB_GetStrDescriptor(self, dev_id, buff):
+        error = self._check_open(dev_id)
+        if not error:
+            buff.value = "{0} {1}".format(PRODUCT_MODEL, SERIAL_NUMBER)
+        return error
+
+    # FWR
+    def SEPIA2_FWR_GetVersion(self, dev_id, buff):
+        error = self._check_open(dev_id)
+        if not error:
+            buff.value = FIRMWARE_VERSION
+        return error
+
+    def SEPIA2_FWR_GetModuleMap(self, dev_id, perform_restart, module_count):
+        error = self._check_open(dev_id)
+        if not error:
+            self.module_map.add(dev_id)
+            module_count.value = len(MODULE_TYPES)
+        return error
+
+    def SEPIA2_FWR_FreeModuleMap(self, dev_id):
+        error = self._check_open(dev_id)
+        self.module_map.discard(dev_id)
+        return error
+
+    # COM
+    def SEPIA2_COM_GetModuleType(self, dev_id, slot_id, get_primary, module_type):
+        error = self._check_open(dev_id)
+        if not error:
+            module_type.value = 0
+        return error
+
+    def SEPIA2_COM_DecodeModuleType(self, module_type, buff):
+        return self._decode(MODULE_TYPES, module_type, buff)
+
+    def SEPIA2_COM_GetSerialNumber(self, dev_id, slot_id, get_primary, buff):
+        error = self._check_open(dev_id)
+        if not error:
+            buff.value = SERIAL_NUMBER
+        return error
+
+    def SEPIA2_COM_HasSecondaryModule(self, dev_id, slot_id, has_secondary):
+        error = self._check_open(dev_id)
+        if not error:
+            has_secondary.value = 1
+        return error
+
+    # SCM
+    def SEPIA2_SCM_GetLaserSoftLock(self, dev_id, slot_id, soft_lock):
+        error = self._check_open(dev_id)
+        if not error:
+            soft_lock.value = self.soft_lock
+        return error
+
+    def SEPIA2_SCM_SetLaserSoftLock(self, dev_id, slot_id, soft_lock):
+        error = self._check_open(dev_id)
+        if not error:
+            self.soft_lock = 1 if soft_lock else 0
+        return error
+
+    def SEPIA2_SCM_GetLaserLocked(self, dev_id, slot_id, locked):
+        error = self._check_open(dev_id)
+        if not error:
+            locked.value = 1 if (self.soft_lock or self.hard_lock) else 0
+        return error
+
+    # SLM
+    def SEPIA2_SLM_GetPulseParameters(self, dev_id, slot_id, freq_mode, pulse_mode, head_type):
+        error = self._check_open(dev_id)
+        if not error:
+            freq_mode.value = self.freq_mode
+            pulse_mode.value = self.pulse_mode
+            head_type.value = self.head_type
+        return error
+
+    def SEPIA2_SLM_SetPulseParameters(self, dev_id, slot_id, freq_mode, pulse_mode):
+        error = self._check_open(dev_id)
+        if error:
+            return error
+        if not 0 <= freq_mode < len(FREQ_TRIG_MODES):
+            return ERR_INVALID_PARAMETER
+        self.freq_mode = freq_mode
+        self.pulse_mode = 1 if pulse_mode else 0
+        return 0
+
+    def SEPIA2_SLM_DecodeFreqTrigMode(self, freq_mode, buff):
+        return self._decode(FREQ_TRIG_MODES, freq_mode, buff)
+
+    def SEPIA2_SLM_GetIntensityFineStep(self, dev_id, slot_id, intensity):
+        error = self._check_open(dev_id)
+        if not error:
+            intensity.value = self.intensity
+        return error
+
+    def SEPIA2_SLM_SetIntensityFineStep(self, dev_id, slot_id, intensity):
+        error = self._check_open(dev_id)
+        if error:
+            return error
+        if not 0 <= intensity <= 1000:
+            return ERR_INVALID_PARAMETER
+        self.intensity = intensity
+        return 0
+
+    def SEPIA2_SLM_DecodeHeadType(self, head_type, buff):
+        return self._decode(HEAD_TYPES, head_type, buff)
+
+    # SOM
+    def SEPIA2_SOM_GetFreqTrigMode(self, dev_id, slot_id, trig_mode):
+        error = self._check_open(dev_id)
+        if not error:
+            trig_mode.value = self.trig_mode
+        return error
@@ -1,4 +1,4 @@
-from sepia import string_buffer, dll, raise_on_error_code
+from sepia import out_params, STRING_BUFFER, dll, raise_on_error_code, check_channel
 import ctypes
 
 """
@@ -13,9 +13,9 @@ def get_dll_version():
 
     :returns: .dll version
     """
-    str_buff = string_buffer()
-    dll.SEPIA2_LIB_GetVersion(str_buff)
-    return str_buff
+    with out_params(STRING_BUFFER) as (str_buff,):
+        dll.SEPIA2_LIB_GetVersion(str_buff)
+        return str_buff.value
 
 @raise_on_error_code    
 def open_usb_device(dev_id):
@@ -28,10 +28,9 @@ def open_usb_device(dev_id):
     :returns: the product model and serial number
     """
     check_channel(dev_id, "open_device")
-    product_model = string_buffer()
-    serial_number = string_buffer()
-    dll.SEPIA2_USB_OpenDevice(dev_id, product_model, serial_number)
-    return product_model, serial_number
+    with out_params(STRING_BUFFER, STRING_BUFFER) as (product_model, serial_number):
+        dll.SEPIA2_USB_OpenDevice(dev_id, product_model, serial_number)
+        return product_model.value, serial_number.value
 
 @raise_on_error_code    
 def close_usb_device(dev_id):
@@ -55,6 +54,6 @@ def get_state_descriptor(dev_id):
     :returns: concatenated string descriptors of the USB device
     """
     check_channel(dev_id, "get_state_descriptor")
-    desc = string_buffer()
-    dll.SEPIA2_USB_GetStrDescriptor(dev_id, desc)
-    return desc
+    with out_params(STRING_BUFFER) as (desc,):
+        dll.SEPIA2_USB_GetStrDescriptor(dev_id, desc)
+        return desc.value
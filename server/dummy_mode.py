@@ -1,4 +1,5 @@
 from functools import wraps
+import smellie_config
 
 def signature(func, args, kwargs):
     """
@@ -5,6 +5,9 @@ from functools import wraps
 
 HANDLED_EXCEPTIONS = []
 
+# Every error string starts with this
+ERROR_PREFIX = "SNODROP ERROR: "
+
 def process_exception(exception):
     """
     Translates exceptions to error strings.
@@ -16,8 +19,14 @@ def process_exception(exception):
     """
     thrown_type = exception.__class__
     if thrown_type in HANDLED_EXCEPTIONS:
-        return "SNODROP ERROR: {0}".format(repr(exception))
-    return "SNODROP ERROR: Unhandled exception!! {0}".format(repr(exception))
+        return "{0}{1}".format(ERROR_PREFIX, repr(exception))
+    return "{0}Unhandled exception!! {1}".format(ERROR_PREFIX, repr(exception))
+
+def is_error(result):
+    """
+    :returns: True if result is an error string from :func:`process_exception`
+    """
+    return isinstance(result, basestring) and result.startswith(ERROR_PREFIX)
 
 def str_wrap_exceptions(orig_function):
     """
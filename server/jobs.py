@@ -0,0 +1,217 @@
+"""
+Background jobs for long-running SMELLIE sequences.
+A client submits a controller method and its arguments, gets back a job id straight away and then polls, cancels or lists jobs,
+rather than holding an XML-RPC connection open for the whole run.
+"""
+from dummy_mode import has_dummy_mode
+from exception_handler import process_exception
+from lock_manager import with_device_locks
+from smellie_config import JOB_WORKERS, JOB_HISTORY
+from inspect import getmembers, isroutine, getargspec
+from threading import Thread, Lock, Event
+from functools import wraps
+from Queue import Queue
+from itertools import count
+from time import time
+
+QUEUED    = "queued"
+RUNNING   = "running"
+DONE      = "done"
+FAILED    = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+class JobLogicError(Exception):
+    """
+    Thrown if a job is submitted for an unknown method, or an unknown job id is requested
+    """
+    pass
+
+class Job(object):
+    """
+    A single call to a controller method, and its progress
+    """
+    def __init__(self, job_id, method, args):
+        self.job_id = job_id
+        self.method = method
+        self.args = list(args)
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.cancel_requested = False
+        # passed to controller methods that take a stop_event, so cancelling the job ends its run - and only its run
+        self.stop = Event()
+        self.submitted = time()
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        '''
+        The job as a dictionary that can be sent over XML-RPC (which cannot send None, so missing values are empty strings)
+        '''
+        def value(x):
+            return "" if x is None else x
+        return {"id" : self.job_id,
+                "method" : self.method,
+                "args" : self.args,
+                "state" : self.state,
+                "result" : value(self.result),
+                "error" : value(self.error),
+                "submitted" : self.submitted,
+                "started" : value(self.started),
+                "finished" : value(self.finished)}
+
+class JobManager(object):
+    '''
+    Runs submitted controller calls on JOB_WORKERS background threads (set in config.py).
+    Jobs use the controller's own methods, wrapped to hold the device locks and to respect dummy mode;
+    a job only counts as running once it holds its device locks, and if it fails or is cancelled while running, the controller's `go_safe` is called afterwards.
+    '''
+    def __init__(self, instance, lock_manager, n_workers = JOB_WORKERS):
+        '''
+        :param instance: the controller
+        
+        :param lock_manager: the server's :class:`lock_manager.DeviceLockManager`
+
+        :param n_workers: number of jobs that may run at once
+        '''
+        self.controller = instance
+        self.with_locks = with_device_locks(lock_manager)
+        self.controller_methods = dict((name, method) for (name, method) in getmembers(instance, isroutine) if not name.startswith("_"))
+        self.methods = dict((name, has_dummy_mode(self.with_locks(method))) for (name, method) in self.controller_methods.iteritems())
+        self.jobs = {}
+        self.lock = Lock()
+        self.queue = Queue()
+        self.ids = count(1)
+        self.workers = [Thread(target = self._work, name = "smellie-job-worker-{0}".format(i)) for i in xrange(n_workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, method, args = ()):
+        '''
+        Queue a call to a controller method
+
+        :param method: name of the controller method, e.g. `laserheads_slave_mode`
+
+        :param args: the method's positional arguments
+        :type args: list
+
+        :returns: job id
+        :type job id: int
+
+        :raises: :class:`.JobLogicError` if the controller has no such method
+        '''
+        if not method in self.methods:
+            raise JobLogicError("Cannot submit job: controller has no method {0}".format(method))
+        with self.lock:
+            job = Job(next(self.ids), method, args)
+            self.jobs[job.job_id] = job
+            self._prune()
+        self.queue.put(job)
+        return job.job_id
+
+    def poll(self, job_id):
+        '''
+        :param job_id: job id
+
+        :returns: the job's summary, see :func:`Job.summary`
+        '''
+        return self._get(job_id).summary()
+
+    def cancel(self, job_id):
+        '''
+        Cancel a job.  A queued job, or one still waiting for its device locks, will not be started; a running job has its stop event set, which ends a run early
+        (the stop_event of e.g. :func:`smellie.smellie_controller.SmellieController.laserheads_master_mode`), and the system is sent safe when it returns.
+
+        :param job_id: job id
+
+        :returns: the job's state after the request
+        :type state: string
+        '''
+        job = self._get(job_id)
+        with self.lock:
+            if job.state in FINISHED_STATES:
+                return job.state
+            job.cancel_requested = True
+            job.stop.set()
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished = time()
+            return job.state
+
+    def list_jobs(self):
+        '''
+        :returns: summaries of all known jobs, oldest first
+        :type summaries: list
+        '''
+        with self.lock:
+            return [self.jobs[job_id].summary() for job_id in sorted(self.jobs)]
+
+    def _get(self, job_id):
+        '''
+        This is a private function, indicated by the underscore before the name - do not change that!
+        '''
+        try:
+            return self.jobs[job_id]
+        except KeyError:
+            raise JobLogicError("No job with id {0}".format(job_id))
+
+    def _prune(self):
+        '''
+        Forget the oldest finished jobs, keeping at most JOB_HISTORY jobs.  Must be called holding self.lock
+        This is a private function, indicated by the underscore before the name - do not change that!
+        '''
+        for job_id in sorted(self.jobs):
+            if len(self.jobs) <= JOB_HISTORY:
+                break
+            if self.jobs[job_id].state in FINISHED_STATES:
+                del self.jobs[job_id]
+
+    def _job_call(self, job):
+        '''
+        The controller method a job calls, to be wrapped to hold the device locks: once they are held it marks the job running, and passes the job's stop event if the method takes one.
+        If the job was cancelled while it waited for the locks the method is not called.
+        This is a private function, indicated by the underscore before the name - do not change that!
+        '''
+        method = self.controller_methods[job.method]
+        stoppable = "stop_event" in getargspec(method).args
+        @wraps(method)
+        def call(*args):
+            with self.lock:
+                if job.cancel_requested:
+                    return None
+                job.state = RUNNING
+                job.started = time()
+            if stoppable:
+                return method(*args, stop_event = job.stop)
+            return method(*args)
+        return call
+
+    def _work(self):
+        '''
+        Worker thread: run queued jobs one after another
+        This is a private function, indicated by the underscore before the name - do not change that!
+        '''
+        while True:
+            job = self.queue.get()
+            with self.lock:
+                if job.cancel_requested:
+                    continue
+            try:
+                job.result = has_dummy_mode(self.with_locks(self._job_call(job)))(*job.args)
+            except Exception as e:
+                job.error = process_exception(e)
+                state = FAILED
+            else:
+                state = CANCELLED if job.cancel_requested else DONE
+            # a job cancelled before it got its device locks never touched the hardware
+            if state != DONE and job.started is not None:
+                try:
+                    self.methods["go_safe"]()
+                except Exception as e:
+                    job.error = "{0}\ngo_safe failed: {1}".format(job.error or "", process_exception(e))
+            with self.lock:
+                job.state = state
+                job.finished = time()
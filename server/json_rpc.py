@@ -0,0 +1,134 @@
+"""
+A compact RPC transport alongside XML-RPC, for frequent calls such as status polling: JSON over HTTP/1.1, with the connection kept open between requests.
+A request is a POST of {"method" : name, "params" : [arguments], "id" : any}, answered by {"id" : id, "result" : return value} or {"id" : id, "error" : error string}.
+Calls are dispatched exactly as XML-RPC calls are, so the same wrapped controller methods and server functions are available on both transports.
+"""
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from exception_handler import process_exception
+from smellie_config import JSON_RPC_PATH
+import httplib
+import socket
+import json
+
+class JsonRpcLogicError(Exception):
+    """
+    Thrown if a request is malformed
+    """
+    pass
+
+class JsonRpcRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers POSTs of JSON calls to JSON_RPC_PATH, keeping the connection open for the client's next request
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # buffer each response, so its headers and body go out together when it is flushed
+    wbufsize = -1
+
+    def do_POST(self):
+        if self.path != JSON_RPC_PATH:
+            self.send_error(404)
+            return
+        call_id = None
+        try:
+            call = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            call_id = call.get("id")
+            if not isinstance(call.get("params", []), list):
+                raise JsonRpcLogicError("params must be a list, not {0}".format(call["params"]))
+            response = {"id" : call_id, "result" : self.server.dispatch(call["method"], call.get("params", []))}
+        except Exception as e:
+            response = {"id" : call_id, "error" : process_exception(e)}
+        body = json.dumps(response, separators = (",", ":"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_request(self, code = "-", size = "-"):
+        """
+        Successful requests are not logged - at polling rates that would swamp the log
+        """
+        pass
+
+class JsonRpcServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server for JSON calls, each connection handled in its own thread
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, dispatch):
+        """
+        :param address: (host, port) to listen on
+
+        :param dispatch: function of (method name, params) that makes a call, e.g. the XML-RPC server's _dispatch
+        """
+        HTTPServer.__init__(self, address, JsonRpcRequestHandler)
+        self.dispatch = dispatch
+
+class JsonRpcClient(object):
+    """
+    Client for a :class:`JsonRpcServer`, making every call over one kept-open connection.
+    Calls are made as client.call(method, *args), or as methods of the client, as with xmlrpclib.ServerProxy.
+    Error strings are returned, not raised, just as over XML-RPC.
+    """
+    def __init__(self, host, port, timeout = None):
+        """
+        :param timeout: socket timeout in seconds, or None to wait as long as it takes
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+        self.next_id = 0
+
+    def _connect(self):
+        """
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.connection = httplib.HTTPConnection(self.host, self.port, timeout = self.timeout)
+        self.connection.connect()
+        self.connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _request(self, body):
+        """
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        if self.connection is None:
+            self._connect()
+        self.connection.request("POST", JSON_RPC_PATH, body, {"Content-Type" : "application/json"})
+        response = self.connection.getresponse()
+        return json.loads(response.read())
+
+    def call(self, method, *params):
+        """
+        Make a call, reconnecting once if a kept-open connection turns out to have been closed by the server
+
+        :returns: the call's return value
+        """
+        self.next_id += 1
+        body = json.dumps({"method" : method, "params" : params, "id" : self.next_id}, separators = (",", ":"))
+        reused = self.connection is not None
+        try:
+            response = self._request(body)
+        except (httplib.HTTPException, socket.error):
+            self.close()
+            if not reused:
+                raise
+            response = self._request(body)
+        return response["error"] if "error" in response else response["result"]
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda *params: self.call(method, *params)
+
+    def close(self):
+        """
+        Close the connection - the next call opens a new one
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
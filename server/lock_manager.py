@@ -0,0 +1,60 @@
+"""
+Per-device locking for the threaded SMELLIE server.
+Methods that change the state of a device hold that device's lock for the whole call, so calls driving the same device run one at a time,
+while calls on independent devices, and status queries (which hold no locks), run concurrently.
+"""
+from threading import RLock
+from contextlib import contextmanager
+from functools import wraps
+
+class DeviceLockManager(object):
+    """
+    One re-entrant lock per device, so a locked method can call other locked methods on the same devices
+    """
+    def __init__(self, devices):
+        '''
+        :param devices: names of the devices to lock
+        '''
+        self.locks = dict((device, RLock()) for device in devices)
+
+    @contextmanager
+    def hold(self, devices):
+        '''
+        Hold the locks of several devices.  They are always taken in the same (sorted) order, so two calls needing overlapping devices cannot deadlock.
+
+        :param devices: names of the devices to lock
+        '''
+        held = []
+        try:
+            for device in sorted(set(devices)):
+                self.locks[device].acquire()
+                held.append(device)
+            yield
+        finally:
+            for device in reversed(held):
+                self.locks[device].release()
+
+def with_device_locks(lock_manager, stop_runs = None):
+    '''
+    Make a function wrapper that holds the locks of the devices listed in a method's `devices` attribute (see :func:`smellie.devices.uses_devices`) for the duration of the call.
+    Methods without the attribute are returned unchanged.
+
+    :param lock_manager: the :class:`DeviceLockManager`
+
+    :param stop_runs: optional function called before waiting for the locks of methods marked by :func:`smellie.devices.stops_runs`, e.g. the controller's `stop_run`
+
+    :returns: the wrapper, for use with :func:`smellie_server.wrap_all_methods`
+    '''
+    def wrapper(orig_function):
+        devices = getattr(orig_function, "devices", ())
+        if not devices:
+            return orig_function
+        stops = stop_runs is not None and getattr(orig_function, "stops_runs", False)
+        @wraps(orig_function)
+        def locked_function(*args, **kwargs):
+            if stops:
+                stop_runs()
+            with lock_manager.hold(devices):
+                return orig_function(*args, **kwargs)
+        return locked_function
+    return wrapper
@@ -0,0 +1,157 @@
+"""
+Per-method call metrics for the SMELLIE server: call counts, error counts and latency histograms, kept in a fixed-size in-memory store.
+They are served by the `metrics()` RPC and, optionally, as plain text on an HTTP GET of METRICS_SCRAPE_PATH (set in config.py) in the Prometheus text format.
+"""
+from smellie_config import METRICS_BUCKETS, METRICS_MAX_METHODS, METRICS_SCRAPE_PATH
+from SimpleXMLRPCServer import SimpleXMLRPCRequestHandler
+from bisect import bisect_left
+from threading import Lock
+from functools import wraps
+from time import time
+
+# Calls to methods beyond the first METRICS_MAX_METHODS seen are recorded under this name
+OTHER_METHODS = "other"
+
+class MethodMetrics(object):
+    """
+    Call count, error count, total and maximum latency, and a latency histogram for one method
+    """
+    def __init__(self, n_buckets):
+        '''
+        :param n_buckets: number of histogram buckets, including the overflow bucket
+        '''
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * n_buckets
+
+class MetricsStore(object):
+    """
+    Thread-safe store of :class:`MethodMetrics`, of fixed size: one histogram of len(bounds) + 1 buckets for each of at most max_methods methods
+    """
+    def __init__(self, bounds = METRICS_BUCKETS, max_methods = METRICS_MAX_METHODS):
+        '''
+        :param bounds: upper bounds of the latency histogram buckets, in seconds - calls slower than the last go in an overflow bucket
+
+        :param max_methods: number of methods recorded separately; further methods are recorded together under :data:`OTHER_METHODS`
+        '''
+        self.bounds = sorted(bounds)
+        self.max_methods = max_methods
+        self.methods = {}
+        self.started = time()
+        self.lock = Lock()
+
+    def record(self, name, seconds, error = False):
+        '''
+        Record one call
+
+        :param name: method name
+
+        :param seconds: how long the call took
+
+        :param error: True if the call raised an exception
+        '''
+        with self.lock:
+            metrics = self.methods.get(name)
+            if metrics is None:
+                if len(self.methods) >= self.max_methods:
+                    name = OTHER_METHODS
+                metrics = self.methods.setdefault(name, MethodMetrics(len(self.bounds) + 1))
+            metrics.count += 1
+            metrics.errors += 1 if error else 0
+            metrics.total += seconds
+            metrics.max = max(metrics.max, seconds)
+            metrics.buckets[bisect_left(self.bounds, seconds)] += 1
+
+    def reset(self):
+        '''
+        Forget all recorded calls
+        '''
+        with self.lock:
+            self.methods = {}
+            self.started = time()
+
+    def snapshot(self):
+        '''
+        The metrics of every method, in a form that can be sent over XML-RPC.
+        Each histogram is a list of [upper bound, count] pairs, not cumulative; the overflow bucket's bound is "+Inf".
+
+        :returns: {"since" : time recording started, "methods" : {name : {"count", "errors", "total", "max", "mean", "histogram"}}}
+        :type returns: dict
+        '''
+        with self.lock:
+            methods = {}
+            for name, metrics in self.methods.iteritems():
+                methods[name] = {"count" : metrics.count,
+                                 "errors" : metrics.errors,
+                                 "total" : metrics.total,
+                                 "max" : metrics.max,
+                                 "mean" : metrics.total / metrics.count,
+                                 "histogram" : [[bound, count] for (bound, count) in zip(self.bounds + ["+Inf"], metrics.buckets)]}
+            return {"since" : self.started, "methods" : methods}
+
+    def scrape_text(self):
+        '''
+        The metrics in the Prometheus text exposition format, with cumulative histograms
+
+        :returns: text
+        :type returns: string
+        '''
+        lines = ["# TYPE smellie_rpc_calls_total counter",
+                 "# TYPE smellie_rpc_errors_total counter",
+                 "# TYPE smellie_rpc_latency_seconds histogram"]
+        with self.lock:
+            for name, metrics in sorted(self.methods.iteritems()):
+                label = 'method="{0}"'.format(name)
+                lines.append("smellie_rpc_calls_total{{{0}}} {1}".format(label, metrics.count))
+                lines.append("smellie_rpc_errors_total{{{0}}} {1}".format(label, metrics.errors))
+                cumulative = 0
+                for bound, count in zip(self.bounds + ["+Inf"], metrics.buckets):
+                    cumulative += count
+                    lines.append('smellie_rpc_latency_seconds_bucket{{{0},le="{1}"}} {2}'.format(label, bound, cumulative))
+                lines.append("smellie_rpc_latency_seconds_sum{{{0}}} {1!r}".format(label, metrics.total))
+                lines.append("smellie_rpc_latency_seconds_count{{{0}}} {1}".format(label, metrics.count))
+        return "\n".join(lines) + "\n"
+
+def with_call_metrics(store, name = None):
+    '''
+    Make a function wrapper that records the latency of every call, and whether it raised, in store.
+    Exceptions are re-raised, so the wrapper must be applied inside :func:`exception_handler.str_wrap_exceptions` to see them.
+
+    :param store: the :class:`MetricsStore`
+
+    :param name: the name to record calls under - by default the wrapped function's name
+
+    :returns: the wrapper, for use with :func:`smellie_server.wrap_all_methods`
+    '''
+    def wrapper(orig_function):
+        method_name = orig_function.__name__ if name is None else name
+        @wraps(orig_function)
+        def timed_function(*args, **kwargs):
+            start = time()
+            error = True
+            try:
+                result = orig_function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                store.record(method_name, time() - start, error)
+        return timed_function
+    return wrapper
+
+class MetricsRequestHandler(SimpleXMLRPCRequestHandler):
+    '''
+    XML-RPC request handler that also answers an HTTP GET of METRICS_SCRAPE_PATH with the server's metrics (the server's `metrics` attribute) as plain text
+    '''
+    def do_GET(self):
+        store = getattr(self.server, "metrics", None)
+        if store is None or self.path != METRICS_SCRAPE_PATH:
+            self.report_404()
+            return
+        body = store.scrape_text()
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; version=0.0.4")
+        self.send_header("Content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
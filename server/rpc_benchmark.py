@@ -0,0 +1,87 @@
+"""
+Benchmark of the server's two transports - XML-RPC, and JSON over kept-open HTTP/1.1 connections (see :mod:`json_rpc`) - making the same status call many times in a row, as monitoring does.
+The server runs in this process on simulated hardware with no simulated latency, so what is measured is the transport: connecting, encoding, decoding and dispatch.
+Results are appended to RPC_BENCHMARK_RESULTS_FILE (set in config.py), one JSON record per run.
+"""
+from smellie.benchmark import BenchmarkController, load_profile, git_revision, write_results
+from smellie_server import SmellieServer
+from json_rpc import JsonRpcClient
+from smellie_config import RPC_BENCHMARK_RESULTS_FILE
+from threading import Thread
+from datetime import datetime
+from time import time
+import xmlrpclib
+import platform
+import math
+
+def time_calls(call, n_calls):
+    """
+    :param call: function of no arguments making one call
+
+    :returns: the latency of each of n_calls calls, in seconds
+    :type returns: list
+    """
+    latencies = []
+    for i in xrange(n_calls):
+        start = time()
+        call()
+        latencies.append(time() - start)
+    return latencies
+
+def summarise(latencies):
+    """
+    :returns: {"calls", "requests_per_second", "mean", "p50", "p99", "max"}, latencies in seconds
+    :type returns: dict
+    """
+    ordered = sorted(latencies)
+    percentile = lambda p: ordered[int(math.ceil(p * len(ordered))) - 1]
+    total = sum(ordered)
+    return {"calls" : len(ordered),
+            "requests_per_second" : len(ordered) / total,
+            "mean" : total / len(ordered),
+            "p50" : percentile(0.5),
+            "p99" : percentile(0.99),
+            "max" : ordered[-1]}
+
+def run_transport_benchmark(method = "state_cache_stats", n_calls = 1000, warmup = 50):
+    """
+    Time n_calls calls of method over each transport, after warmup untimed calls
+
+    :param method: a controller or server method taking no arguments
+
+    :returns: the benchmark record: when and on what it was run, and a :func:`summarise` of each transport
+    :type returns: dict
+    """
+    with BenchmarkController(load_profile("zero")) as controller:
+        server = SmellieServer(0, controller, json_port = 0)
+        # the JSON transport does not log each request, so neither should XML-RPC here, or the log is what gets measured
+        server.server.logRequests = False
+        thread = Thread(target = server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        clients = {"xmlrpc" : xmlrpclib.ServerProxy("http://127.0.0.1:{0}".format(server.server.server_address[1])),
+                   "json" : JsonRpcClient("127.0.0.1", server.json_server.server_address[1])}
+        transports = {}
+        try:
+            for name, client in sorted(clients.iteritems()):
+                call = getattr(client, method)
+                time_calls(call, warmup)
+                transports[name] = summarise(time_calls(call, n_calls))
+        finally:
+            clients["json"].close()
+            server.json_server.shutdown()
+            server.server.shutdown()
+    return {"timestamp" : datetime.utcnow().isoformat(),
+            "git_sha" : git_revision(),
+            "python" : platform.python_version(),
+            "method" : method,
+            "n_calls" : n_calls,
+            "transports" : transports}
+
+def write_transport_results(record, path = RPC_BENCHMARK_RESULTS_FILE):
+    """
+    Append a transport benchmark record to the results file, as one line of JSON (see :func:`smellie.benchmark.write_results`)
+
+    :returns: the full path written to
+    """
+    return write_results(record, path)
@@ -2,34 +2,80 @@
 The SMELLIE server is a python SimpleXMLRPCServer but wrapped so that each method of the exposed instance is wrapped by 
 :func:`exception_handler.str_wrap_exceptions` and :func:`dummy_mode.has_dummy_mode`, so that any exceptions thrown are translated as strings over the server, and to allow 
 running in dummy mode - where each function call just results in a signature print, and no logic.
+In threaded mode each request is handled in its own thread, and methods are also wrapped by :func:`lock_manager.with_device_locks` so that calls driving the same device run one at a time.
+Every call is timed by :func:`metrics.with_call_metrics`; the results are served by the `metrics()` RPC, and as plain text on an HTTP GET of METRICS_SCRAPE_PATH.
+When tracing is on, every call also opens a trace of the device operations it makes (see :mod:`tracing`).
+Several calls can be made in one request with `batch(calls, stop_on_error)`, or the standard `system.multicall`.
+The same calls can also be made as JSON over a kept-open HTTP/1.1 connection on JSON_RPC_PORT (see :mod:`json_rpc`), which is cheaper for frequent polling.
 """
 
-from SimpleXMLRPCServer import SimpleXMLRPCServer
-from exception_handler import str_wrap_exceptions
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
+from exception_handler import str_wrap_exceptions, process_exception, is_error
 from dummy_mode import has_dummy_mode
+from lock_manager import DeviceLockManager, with_device_locks
+from jobs import JobManager
+from metrics import MetricsStore, MetricsRequestHandler, with_call_metrics
+from json_rpc import JsonRpcServer
+from smellie.devices import ALL_DEVICES
+from smellie_config import SERVER_THREADED, METRICS_SCRAPE_PATH, TRACE_FILE, JSON_RPC_PORT
+from tracing import tracer, traced
+import smellie_config
+import os
 from inspect import getmembers, isroutine
+from threading import Thread
+
+class WrappedInstance(object):
+    '''
+    Holds the wrapped copies of an instance's public methods, as made by :func:`wrap_all_methods`
+    '''
+    def __init__(self, instance):
+        '''
+        :param instance: the object whose methods are wrapped
+        '''
+        self._instance = instance
 
 def wrap_all_methods(instance, *wrappers):
     '''
-    Wrap every member function of instance with each wrapper in turn. 
+    Wrap every public member function of instance with each wrapper in turn, on a :class:`WrappedInstance` to register with the server.
     Used to apply str_wrap_exceptions and dummy mode
-    to the smellie controller instance
+    to the smellie controller instance.
+    The instance itself is left unchanged, so that its calls to its own methods (e.g. `go_safe` at the end of a run) still see exceptions, and are not counted or traced as server calls.
+    Private methods (starting with an underscore) cannot be called over XML-RPC and are not copied.
 
     :param instance: the object to wrap
 
     :param wrappers: tuple of function wrappers
+
+    :returns: the wrapped methods
+    :type returns: :class:`WrappedInstance`
+    '''
+    wrapped = WrappedInstance(instance)
+    for name, method in getmembers(instance, isroutine):
+        if not name.startswith("_"):
+            for wrapper in wrappers:
+                method = wrapper(method)
+            setattr(wrapped, name, method)
+    return wrapped
+
+class BatchLogicError(Exception):
+    '''
+    Thrown if a call in a batch is malformed
+    '''
+    pass
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    '''
+    SimpleXMLRPCServer that handles each request in its own thread
     '''
-    for wrapper in wrappers:
-        for name, method in getmembers(instance, isroutine):
-            setattr(instance, name, wrapper(method))
-    return instance
+    daemon_threads = True
 
 class SmellieServer:
     '''
     XML-RPC Protocol server that exposes a SmellieController to external 
     calls
     '''
-    def __init__(self, port, instance):
+    def __init__(self, port, instance, threaded = SERVER_THREADED, json_port = JSON_RPC_PORT):
         '''
         Initialise the server on port and register functions
         Calls: :func:`register <smellie_server.SmellieServer.register>
@@ -37,26 +83,140 @@ class SmellieServer:
         :param port: port
         
         :param instance: controller object to expose to the server
+
+        :param threaded: handle each request in its own thread, with calls that drive the same device serialised by a :class:`lock_manager.DeviceLockManager`
+
+        :param json_port: port to also serve the calls on as JSON (see :mod:`json_rpc`), or None not to
         '''
-        
-        self.server = SimpleXMLRPCServer(("0.0.0.0", port))
+        handler = MetricsRequestHandler if METRICS_SCRAPE_PATH else SimpleXMLRPCRequestHandler
+        if threaded:
+            self.server = ThreadedXMLRPCServer(("0.0.0.0", port), requestHandler = handler)
+        else:
+            self.server = SimpleXMLRPCServer(("0.0.0.0", port), requestHandler = handler)
+        self.locks = DeviceLockManager(ALL_DEVICES)
+        self.metrics = MetricsStore()
+        # read by MetricsRequestHandler
+        self.server.metrics = self.metrics
         self.register(instance)
+        self.json_server = None if json_port is None else JsonRpcServer(("0.0.0.0", json_port), self.server._dispatch)
 
     def serve_forever(self):
         '''
-        Listen indefinitely for function calls to exectute
+        Listen indefinitely for function calls to exectute, on the JSON transport too if it is enabled
         '''
+        if self.json_server is not None:
+            json_thread = Thread(target = self.json_server.serve_forever)
+            json_thread.daemon = True
+            json_thread.start()
         self.server.serve_forever()
 
 
     def register(self, instance):
         '''
-        Register methods of instance with internal server, after wrapping with
-        :func:`exception_handler.str_wrap_exceptions` and :func:`dummy_mode.has_dummy_mode`
+        Register wrapped copies of the methods of instance with internal server (see :func:`wrap_all_methods`), wrapped with
+        :func:`lock_manager.with_device_locks`, :func:`tracing.traced`, :func:`metrics.with_call_metrics`, :func:`exception_handler.str_wrap_exceptions` and :func:`dummy_mode.has_dummy_mode`.
+        Call metrics and traces are timed outside the device locks, so they include any wait for a device.
+        Safety calls (`go_safe`, `deactivate`) stop any run in progress before waiting for their device locks (see :func:`smellie.devices.stops_runs`).
         
         :param instance: controller object to expose to the server
         '''
         self.controller = instance
-        self.server.register_instance(wrap_all_methods(self.controller, str_wrap_exceptions, has_dummy_mode))
+        self.jobs = JobManager(self.controller, self.locks)
+        self.server.register_instance(wrap_all_methods(self.controller, with_device_locks(self.locks, self.controller.stop_run), traced(root = True), with_call_metrics(self.metrics), str_wrap_exceptions, has_dummy_mode))
+        self.register_jobs()
+        self.register_metrics()
+        self.register_tracing()
+        self.register_batch()
         self.server.register_introspection_functions()
-        
+
+    def register_jobs(self):
+        '''
+        Expose the background job API (see :mod:`jobs`): `submit_job(method, args)`, `poll_job(id)`, `cancel_job(id)` and `list_jobs()`,
+        each wrapped with :func:`metrics.with_call_metrics` and :func:`exception_handler.str_wrap_exceptions`
+        '''
+        for (function, name) in ((self.jobs.submit, "submit_job"), (self.jobs.poll, "poll_job"),
+                                 (self.jobs.cancel, "cancel_job"), (self.jobs.list_jobs, "list_jobs")):
+            self.server.register_function(str_wrap_exceptions(with_call_metrics(self.metrics, name)(function)), name)
+
+    def register_metrics(self):
+        '''
+        Expose the call metrics (see :mod:`metrics`): `metrics()`, returning :func:`metrics.MetricsStore.snapshot`, and `reset_metrics()`
+        '''
+        self.server.register_function(str_wrap_exceptions(self.metrics.snapshot), "metrics")
+        self.server.register_function(str_wrap_exceptions(self.reset_metrics), "reset_metrics")
+
+    def reset_metrics(self):
+        '''
+        Forget all recorded call metrics
+        '''
+        self.metrics.reset()
+        return 0
+
+    def register_tracing(self):
+        '''
+        Expose the trace buffer (see :mod:`tracing`): `set_tracing(enabled)`, `traces()`, `write_traces(path)` and `clear_traces()`
+        '''
+        self.server.register_function(str_wrap_exceptions(self.set_tracing), "set_tracing")
+        self.server.register_function(str_wrap_exceptions(tracer.dump), "traces")
+        self.server.register_function(str_wrap_exceptions(self.write_traces), "write_traces")
+        self.server.register_function(str_wrap_exceptions(self.clear_traces), "clear_traces")
+
+    def set_tracing(self, enabled = True):
+        '''
+        Switch tracing of controller calls on or off
+        '''
+        tracer.enable(enabled)
+        return 0
+
+    def write_traces(self, path = TRACE_FILE):
+        '''
+        Append the buffered traces to a file on SNODROP, one JSON trace per line
+
+        :param path: the file, relative to the directory of smellie_config.py if it is not absolute
+
+        :returns: the number of traces written
+        '''
+        return tracer.write(os.path.join(os.path.dirname(os.path.abspath(smellie_config.__file__)), path))
+
+    def clear_traces(self):
+        '''
+        Empty the trace buffer
+        '''
+        tracer.clear()
+        return 0
+
+    def register_batch(self):
+        '''
+        Expose batched calls, so that a client can make several calls in one round trip: `batch(calls, stop_on_error)` (see :func:`batch`), and the standard `system.multicall`
+        '''
+        self.server.register_function(str_wrap_exceptions(with_call_metrics(self.metrics, "batch")(self.batch)), "batch")
+        self.server.register_multicall_functions()
+
+    def batch(self, calls, stop_on_error = False):
+        '''
+        Run several calls in order, in one request.
+        Each call is dispatched just as if it had been made on its own, with its own device locks, metrics and trace - so the batch is not atomic, and other clients' calls may run between its calls.
+
+        :param calls: list of [method name, [arguments]]
+
+        :param stop_on_error: do not run the calls after the first that fails
+
+        :returns: for each call run, {"result" : return value} or {"error" : error string}
+        :type returns: list
+        '''
+        results = []
+        for call in calls:
+            try:
+                method, params = call
+                if method in ("batch", "system.multicall"):
+                    raise BatchLogicError("Cannot call {0} inside a batch".format(method))
+                result = self.server._dispatch(method, params)
+            except Exception as e:
+                result = process_exception(e)
+            if is_error(result):
+                results.append({"error" : result})
+                if stop_on_error:
+                    break
+            else:
+                results.append({"result" : result})
+        return results
@@ -9,7 +9,7 @@ setup(name = "smellie",
       author_email = "jack.dunger@physics.ox.ac.uk",
       packages = ["smellie", "sepia", 
                   "server", "daqmx"], 
-      py_modules = ["config"],
+      py_modules = ["config", "tracing"],
       install_requires = ["pyserial==2.7", "hiredis", "LabJackPython", "numpy"], 
       scripts=glob("bin/*")
       )
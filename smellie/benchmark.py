@@ -0,0 +1,209 @@
+from smellie_config import SIMULATOR_LATENCY, BENCHMARK_RESULTS_FILE
+from smellie_controller import SmellieController
+from simulator import simulated_devices, simulator_stats
+from devices import LASER_DRIVER, LASER_SWITCH, FIBRE_SWITCH, GAIN_VOLTAGE, TRIGGER
+from subprocess import CalledProcessError
+from datetime import datetime
+from time import time
+import smellie_config
+import system_state
+import platform
+import json
+import os
+
+"""
+End-to-end benchmarks of standard SMELLIE sequences, run through a :class:`.SmellieController` on simulated hardware (see :mod:`simulator`).
+Each scenario reports its wall time, and the time spent in, number of calls to and number of hardware transactions made by each device.
+Results are appended to a JSON lines file (BENCHMARK_RESULTS_FILE in config.py), one record per benchmark run, so they can be compared between versions of the code.
+"""
+
+# The controller attribute holding each device
+DEVICE_ATTRIBUTES = {LASER_DRIVER : "laser_driver",
+                     LASER_SWITCH : "laser_switch",
+                     FIBRE_SWITCH : "fibre_switch",
+                     GAIN_VOLTAGE : "gain_voltage",
+                     TRIGGER : "trig_signals"}
+
+# Built in latency profiles: {name : {latency name : (mean, jitter)}} overriding SIMULATOR_LATENCY in config.py
+LATENCY_PROFILES = {"config" : {},
+                    "zero" : dict((name, (0, 0)) for name in SIMULATOR_LATENCY)}
+
+def single_master_run(controller):
+    """
+    One Master Mode run of 1000 pulses
+    """
+    return controller.laserheads_master_mode(1, 500, 1, 1, 1000)
+
+def fibre_scan(controller):
+    """
+    One laser head through every Fibre Switch channel, 100 pulses each
+    """
+    return controller.run_calibration_plan([1], [500], [[fs_in, fs_out] for fs_in in xrange(1, 6) for fs_out in xrange(1, 15)], [100])
+
+def laser_intensity_grid(controller):
+    """
+    Every laser head at five intensities on one fibre, 100 pulses each
+    """
+    return controller.run_calibration_plan(range(1, 6), [100, 300, 500, 700, 900], [[1, 1]], [100])
+
+def gain_sweep(controller):
+    """
+    The Gain Voltage stepped from 0.5V to 1.0V in 0.05V steps, holding each for 0.1s
+    """
+    return controller.step_gain_control([round(0.5 + 0.05 * i, 2) for i in xrange(11)], 0.1)
+
+# The standard scenarios, in the order they are run
+SCENARIOS = [("single_master_run", single_master_run),
+             ("fibre_scan", fibre_scan),
+             ("laser_intensity_grid", laser_intensity_grid),
+             ("gain_sweep", gain_sweep)]
+
+class TimedDevice(object):
+    """
+    Stands in for a device on the controller, timing and counting every method call made on it by the controller.
+    Calls the device makes on itself are not seen, so they are not counted twice.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.time = 0.0
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.device, name)
+        if not callable(attribute):
+            return attribute
+        def timed(*args, **kwargs):
+            start = time()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                self.time += time() - start
+                self.calls += 1
+        return timed
+
+class BenchmarkController(SmellieController):
+    """
+    :class:`.SmellieController` on simulated hardware with a given latency profile and seed
+    """
+    def __init__(self, latency = None, seed = 0):
+        super(BenchmarkController, self).__init__(simulate = True)
+        self.latency = latency
+        self.seed = seed
+
+    def _make_devices(self):
+        """
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.devices = simulated_devices(self.latency, self.seed)
+        return self.devices
+
+def load_profile(profile):
+    """
+    The latency settings of a profile: the name of one of :data:`LATENCY_PROFILES`, or the path of a JSON file recorded from the hardware, of the form {"serial_rtt" : [mean, jitter], ...}.
+    Latencies the profile does not set are taken from SIMULATOR_LATENCY in config.py.
+
+    :returns: {latency name : (mean, jitter)}
+    """
+    settings = dict(SIMULATOR_LATENCY)
+    if profile in LATENCY_PROFILES:
+        settings.update(LATENCY_PROFILES[profile])
+    else:
+        with open(profile) as profile_file:
+            settings.update((name, tuple(value)) for (name, value) in json.load(profile_file).iteritems())
+    return settings
+
+def run_scenario(name, scenario, latency = None, seed = 0):
+    """
+    Run one scenario on freshly opened (and so deactivated) simulated hardware.  Only the scenario itself is timed, not opening and closing the controller.
+
+    :param name: scenario name
+    :param scenario: function of the controller
+
+    :param latency: {latency name : (mean, jitter)} for the simulated hardware
+
+    :param seed: seed for the simulated delays
+
+    :returns: wall time, per device time, calls and transactions, and what the scenario returned
+    :type returns: dict
+    """
+    with BenchmarkController(latency, seed) as controller:
+        timed_devices = {}
+        for (device, attribute) in DEVICE_ATTRIBUTES.iteritems():
+            timed_devices[device] = TimedDevice(getattr(controller, attribute))
+            setattr(controller, attribute, timed_devices[device])
+        before = simulator_stats(controller.devices)
+        start = time()
+        result = scenario(controller)
+        wall_time = time() - start
+        after = simulator_stats(controller.devices)
+        for (device, attribute) in DEVICE_ATTRIBUTES.iteritems():
+            setattr(controller, attribute, timed_devices[device].device)
+    devices = {}
+    for device, timed in timed_devices.iteritems():
+        devices[device] = {"time" : timed.time,
+                           "calls" : timed.calls,
+                           "transactions" : after[device]["transactions"] - before[device]["transactions"],
+                           "simulated_time" : after[device]["simulated_time"] - before[device]["simulated_time"]}
+    return {"scenario" : name, "wall_time" : wall_time, "devices" : devices, "result" : result}
+
+def git_revision():
+    """
+    :returns: the git SHA of this code, or None if it cannot be found
+    """
+    try:
+        return system_state.get_SHA()
+    except (CalledProcessError, OSError):
+        return None
+
+def run_benchmarks(names = None, profile = "config", seed = 0, repeat = 1):
+    """
+    Run the standard scenarios
+
+    :param names: names of the scenarios to run, from :data:`SCENARIOS` - by default all of them
+
+    :param profile: latency profile, see :func:`load_profile`
+
+    :param seed: seed for the simulated delays, so runs of the same code are comparable
+
+    :param repeat: number of times to run each scenario
+
+    :returns: the benchmark record: when and on what it was run, the latencies used and each scenario run
+    :type returns: dict
+
+    :raises: KeyError if a scenario name is unknown
+    """
+    scenarios = dict(SCENARIOS)
+    names = [name for (name, scenario) in SCENARIOS] if names is None else names
+    latency = load_profile(profile)
+    runs = []
+    for name in names:
+        for i in xrange(repeat):
+            runs.append(run_scenario(name, scenarios[name], latency, seed + i))
+    return {"timestamp" : datetime.utcnow().isoformat(),
+            "git_sha" : git_revision(),
+            "python" : platform.python_version(),
+            "profile" : profile,
+            "latency" : latency,
+            "seed" : seed,
+            "runs" : runs}
+
+def results_path(path = BENCHMARK_RESULTS_FILE):
+    """
+    :returns: path, taken as relative to the directory of config.py if it is not absolute
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(smellie_config.__file__)), path)
+
+def write_results(record, path = BENCHMARK_RESULTS_FILE):
+    """
+    Append a benchmark record to the results file, as one line of JSON
+
+    :param record: as returned by :func:`run_benchmarks`
+
+    :param path: results file, relative to the directory of config.py if it is not absolute
+
+    :returns: the full path written to
+    """
+    path = results_path(path)
+    with open(path, "a") as results_file:
+        results_file.write(json.dumps(record, sort_keys = True) + "\n")
+    return path
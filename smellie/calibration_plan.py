@@ -0,0 +1,172 @@
+from smellie_config import RELAY_SLEEP, FIBRE_SWITCH_WAIT_TIME, TRIG_GEN_FREQUENCY
+from laser_switch import pulses_to_channel
+from fibre_switch import find_global_channel_number
+from state_cache import LASER_SWITCH_CHANNEL, FIBRE_SWITCH_CHANNEL, LASER_INTENSITY
+from collections import namedtuple
+from itertools import groupby
+from threading import Event
+from time import time
+
+"""
+Calibration plans: a grid of laser channel x intensity x fibre channel x pulse count, reordered to minimise costly hardware transitions and executed with redundant hardware writes skipped
+"""
+
+# Estimated cost of each hardware transition, in seconds
+LASER_SWITCH_COST = RELAY_SLEEP
+FIBRE_SWITCH_COST = FIBRE_SWITCH_WAIT_TIME
+INTENSITY_COST    = 0.01
+
+CalibrationPoint = namedtuple("CalibrationPoint", ["ls_chan", "intensity", "fs_input_chan", "fs_output_chan", "n_pulses"])
+
+class CalibrationPlanLogicError(Exception):
+    """
+    Thrown if a plan is malformed
+    """
+    pass
+
+def build_grid(ls_chans, intensities, fs_chans, n_pulses):
+    """
+    Every combination of the requested settings, in the order given
+
+    :param ls_chans: laser switch channels
+    :param intensities: laser intensities, in per mil
+    :param fs_chans: fibre switch (input channel, output channel) pairs
+    :param n_pulses: pulse counts
+
+    :returns: the plan
+    :type plan: list of :class:`CalibrationPoint`
+
+    :raises: :class:`.CalibrationPlanLogicError` if a fibre switch channel is not an (input, output) pair
+    """
+    for fs_chan in fs_chans:
+        if len(fs_chan) != 2:
+            raise CalibrationPlanLogicError("Fibre switch channels must be (input, output) pairs, not {0}".format(fs_chan))
+    return [CalibrationPoint(ls_chan, intensity, fs_in, fs_out, n)
+            for ls_chan in ls_chans
+            for intensity in intensities
+            for (fs_in, fs_out) in fs_chans
+            for n in n_pulses]
+
+def fibre_channel(point):
+    """
+    :returns: the global fibre switch channel of a point
+    """
+    return find_global_channel_number(point.fs_input_chan, point.fs_output_chan)
+
+def order_plan(points, active_ls_chan = 0, fibre_chan = None):
+    """
+    Reorder a plan to minimise hardware transition cost.
+    Points are grouped by laser switch channel (the costliest change), visited upwards from the active channel so the selector never wraps more than once;
+    within each laser group points are grouped by fibre channel, and within each fibre group by intensity.
+    Fibre and intensity groups alternate between ascending and descending order, so the last setting of one group is the first of the next.
+
+    :param points: the plan
+    :param active_ls_chan: the currently active laser switch channel
+    :param fibre_chan: the current global fibre switch channel, if known
+
+    :returns: the reordered plan
+    :type plan: list of :class:`CalibrationPoint`
+    """
+    ordered = []
+    by_laser = sorted(points, key = lambda p: pulses_to_channel(active_ls_chan, p.ls_chan))
+    # start on the current fibre channel if it is the plan's highest, otherwise ascending
+    fibre_ascending = not (points and fibre_chan == max(fibre_channel(p) for p in points))
+    intensity_ascending = True
+    for ls_chan, laser_group in groupby(by_laser, key = lambda p: p.ls_chan):
+        by_fibre = sorted(laser_group, key = fibre_channel, reverse = not fibre_ascending)
+        for fs_chan, fibre_group in groupby(by_fibre, key = fibre_channel):
+            ordered.extend(sorted(fibre_group, key = lambda p: p.intensity, reverse = not intensity_ascending))
+            intensity_ascending = not intensity_ascending
+        fibre_ascending = not fibre_ascending
+    return ordered
+
+def count_transitions(points, active_ls_chan = None, intensity = None, fibre_chan = None):
+    """
+    Count the hardware changes needed to run a plan in the order given
+
+    :param points: the plan
+    :param active_ls_chan: the currently active laser switch channel, if known
+    :param intensity: the current laser intensity, if known
+    :param fibre_chan: the current global fibre switch channel, if known
+
+    :returns: number of laser switch, intensity and fibre switch changes
+    :type changes: (int, int, int) tuple
+    """
+    n_laser = n_intensity = n_fibre = 0
+    for point in points:
+        if point.ls_chan != active_ls_chan:
+            n_laser += 1
+            active_ls_chan = point.ls_chan
+        if point.intensity != intensity:
+            n_intensity += 1
+            intensity = point.intensity
+        if fibre_channel(point) != fibre_chan:
+            n_fibre += 1
+            fibre_chan = fibre_channel(point)
+    return n_laser, n_intensity, n_fibre
+
+def estimate_duration(points, active_ls_chan = None, intensity = None, fibre_chan = None):
+    """
+    Estimate how long a plan takes to run in the order given, from the transition costs above and the trigger rate TRIG_GEN_FREQUENCY (set in config.py)
+
+    :returns: estimated duration in seconds
+    :type duration: float
+    """
+    n_laser, n_intensity, n_fibre = count_transitions(points, active_ls_chan, intensity, fibre_chan)
+    pulse_time = sum(p.n_pulses for p in points) / float(TRIG_GEN_FREQUENCY)
+    return n_laser * LASER_SWITCH_COST + n_intensity * INTENSITY_COST + n_fibre * FIBRE_SWITCH_COST + pulse_time
+
+class CalibrationPlanExecutor(object):
+    """
+    Runs a calibration plan in master mode on a :class:`.SmellieController`'s devices, only writing to a device when its setting changes (through the controller's state cache)
+    """
+    def __init__(self, controller):
+        self.controller = controller
+
+    def run(self, points, reorder = True, stop = None):
+        """
+        Run a plan, then send the system safe (also if any point fails, or the plan is stopped)
+
+        :param points: the plan
+        :param reorder: reorder the plan with :func:`order_plan` before running it
+        :param stop: Event which cuts the current pulse train short and ends the plan when set, e.g. by :func:`.SmellieController.stop_run`
+
+        :returns: report with the number of points, the estimated duration of the plan as given and as run, the actual duration, the number of laser switch, intensity and fibre switch changes and of pulse trains sent, and whether the plan was stopped early
+        :type report: dict
+        """
+        if stop is None:
+            stop = Event()
+        active_ls_chan = self.controller.state.known_value(LASER_SWITCH_CHANNEL, self.controller.laser_switch.get_active_channel)
+        fibre_chan = self.controller.state.known_value(FIBRE_SWITCH_CHANNEL, self.controller.fibre_switch.get_global_channel_number)
+        intensity = self.controller.state.lookup(LASER_INTENSITY)
+        original_estimate = estimate_duration(points, active_ls_chan, intensity, fibre_chan)
+        if reorder:
+            points = order_plan(points, active_ls_chan, fibre_chan)
+        estimate = estimate_duration(points, active_ls_chan, intensity, fibre_chan)
+        changes = {"laser_switch_changes" : 0, "intensity_changes" : 0, "fibre_switch_changes" : 0}
+        start = time()
+        trigger_sequences = 0
+        try:
+            # consecutive points with the same settings are sent as one multi-burst pulse train
+            for settings, group in groupby(points, key = lambda p: p[:4]):
+                group = list(group)
+                point = group[0]
+                if self.controller._set_laser_switch_channel(point.ls_chan):
+                    changes["laser_switch_changes"] += 1
+                if self.controller._set_intensity(point.intensity):
+                    changes["intensity_changes"] += 1
+                if self.controller._set_fibre_switch_channels(point.fs_input_chan, point.fs_output_chan):
+                    changes["fibre_switch_changes"] += 1
+                trigger_sequences += 1
+                if not self.controller._fire_triggers([p.n_pulses for p in group], stop):
+                    break
+        finally:
+            self.controller.go_safe()
+        report = {"n_points" : len(points),
+                  "original_estimated_duration" : original_estimate,
+                  "estimated_duration" : estimate,
+                  "actual_duration" : time() - start,
+                  "trigger_sequences" : trigger_sequences,
+                  "stopped" : stop.is_set()}
+        report.update(changes)
+        return report
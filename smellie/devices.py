@@ -0,0 +1,32 @@
+"""
+Names of the SMELLIE hardware devices, and a decorator recording which of them a :class:`.SmellieController` method drives.
+The server uses this to serialise calls per device (see :mod:`server.lock_manager`).
+"""
+
+LASER_DRIVER = "laser_driver"
+LASER_SWITCH = "laser_switch"
+FIBRE_SWITCH = "fibre_switch"
+GAIN_VOLTAGE = "ni_gain"
+TRIGGER      = "ni_trigger"
+
+ALL_DEVICES = (LASER_DRIVER, LASER_SWITCH, FIBRE_SWITCH, GAIN_VOLTAGE, TRIGGER)
+
+def uses_devices(*devices):
+    """
+    Decorator to record the devices a method changes the state of, as the attribute `devices`.
+    Methods without it are treated as not changing any hardware state, e.g. status queries.
+
+    :param devices: device names, from :data:`ALL_DEVICES`
+    """
+    def decorate(func):
+        func.devices = devices
+        return func
+    return decorate
+
+def stops_runs(func):
+    """
+    Decorator to mark a safety method, as the attribute `stops_runs`: the server stops any run in progress (see :func:`.SmellieController.stop_run`) before waiting for the method's device locks,
+    so that the call is never queued behind a long run holding them.
+    """
+    func.stops_runs = True
+    return func
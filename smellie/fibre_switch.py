@@ -1,6 +1,7 @@
-from smellie_config import FIBRE_SWITCH_SERIAL_PORT, FIBRE_SWITCH_BAUD_RATE, FIBRE_SWITCH_WAIT_TIME
-from serial import Serial
-from time import sleep
+from smellie_config import FIBRE_SWITCH_SERIAL_PORT, FIBRE_SWITCH_BAUD_RATE, FIBRE_SWITCH_WAIT_TIME, FIBRE_SWITCH_RECONNECT_ATTEMPTS
+from serial import Serial, SerialException
+from threading import Lock
+from tracing import traced
 
 """
 Control of the Fibre Switch hardware
@@ -35,21 +36,140 @@ def check_global_channel_number(channel_num):
 
     :raises: :class:`.FibreSwitchLogicError` if the channel is unphysical, i.e. not between 1 and 70
     """
-    if not channel_num in xrange(70):
-        raise FibreSwitchLogicError("Invalid Fibre Switch channel {0} requested ... must be 1 - 70, or input = 1 - 5 and output = 1 - 14")
+    if not channel_num in xrange(1, 71):
+        raise FibreSwitchLogicError("Invalid Fibre Switch channel {0} requested ... must be 1 - 70, or input = 1 - 5 and output = 1 - 14".format(channel_num))
+
+def parse_channel_reply(reply):
+    """
+    Read the global channel number from the Fibre Switch's reply to `ch?`
+
+    :returns: channel
+    :type channel: int
+
+    :raises: :class:`.FibreSwitchHWError` if the reply is not a channel number
+    """
+    try:
+        return int(reply)
+    except ValueError:
+        raise FibreSwitchHWError("Fibre Switch returned an invalid channel number: '{0}'".format(reply))
+
+class FibreSwitchConnection(object):
+    """
+    Long-lived serial connection to the Fibre Switch.
+    The port is opened once and kept open until :func:`close` is called; if the port raises an error mid-transaction it is closed, re-opened and the transaction retried up to FIBRE_SWITCH_RECONNECT_ATTEMPTS times (set in config.py).
+    Replies are read with a timeout-driven readline (timeout = FIBRE_SWITCH_WAIT_TIME), so a transaction returns as soon as the hardware answers.
+    """
+    def __init__(self, port = FIBRE_SWITCH_SERIAL_PORT, baudrate = FIBRE_SWITCH_BAUD_RATE, timeout = FIBRE_SWITCH_WAIT_TIME, serial = None):
+        """
+        :param serial: an unopened pyserial Serial object to use - by default a new one; :mod:`simulator` passes a simulated port
+        """
+        self.serial = Serial() if serial is None else serial
+        self.serial.port = port
+        self.serial.baudrate = baudrate
+        self.serial.timeout = timeout
+        self.reconnect_attempts = FIBRE_SWITCH_RECONNECT_ATTEMPTS
+        # a status query from one server thread must not interleave with a command from another
+        self.lock = Lock()
+
+    def is_open(self):
+        """
+        :returns: True if the serial port is currently open
+        """
+        return self.serial.isOpen()
+
+    def open(self):
+        """
+        Open the serial port, if it is not open already
+        """
+        if not self.serial.isOpen():
+            self.serial.open()
+
+    def close(self):
+        """
+        Close the serial port, if it is open
+        """
+        if self.serial.isOpen():
+            self.serial.close()
+
+    def reconnect(self):
+        """
+        Close and re-open the serial port
+        """
+        self.close()
+        self.open()
+
+    def transaction(self, msg, read_back = True):
+        r"""
+        Send a command message and, optionally, read back a single line reply as one transaction.  The message is automatically followed by \\r\\n , so you do not need to add this.
+        Several commands can be sent in one write, e.g. a setting followed by the query that checks it; the reply read back is then the reply to the last.
+
+        :param msg: the command, or a list of commands
+        :type msg: string or list
+
+        :param read_back: wait for (and return) a one line reply
+        :type read_back: bool
+
+        :returns: the stripped reply, or None if read_back is False
+        :type reply: string
+
+        :raises: :class:`.FibreSwitchHWError` if the port cannot be (re)opened, or the hardware does not reply within the timeout
+        """
+        with self.lock:
+            return self._transaction(msg, read_back)
+
+    def _transaction(self, msg, read_back):
+        """
+        :func:`transaction`, without taking the lock
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        commands = [msg] if isinstance(msg, basestring) else msg
+        data = "".join("{0}\r\n".format(command) for command in commands)
+        for attempt in xrange(self.reconnect_attempts + 1):
+            try:
+                self.open()
+                if read_back:
+                    self.serial.flushInput()
+                self.serial.write(data)
+                if not read_back:
+                    return None
+                reply = self.serial.readline()
+                break
+            except SerialException as e:
+                self.close()
+                error = e
+        else:
+            raise FibreSwitchHWError("Fibre Switch serial connection failed after {0} attempts: {1}".format(self.reconnect_attempts + 1, error))
+        if not reply.endswith("\n"):
+            raise FibreSwitchHWError("Fibre Switch did not reply to '{0}' within {1}s".format(msg, self.serial.timeout))
+        return reply.strip()
 
 
 class FibreSwitch(object):
     """
     Controls the Fibre Switch via commands sent down a serial port.
     The port number and baud rate are set in config.py .
+    The serial port is held open by a :class:`.FibreSwitchConnection` between :func:`open_connection` and :func:`close_connection`.
     """
-    def __init__(self):
+    def __init__(self, connection = None):
+        """
+        :param connection: the :class:`.FibreSwitchConnection` to use - by default one on the port set in config.py
+        """
         self.channel_num = None
-        self.serial = Serial()
-        self.serial.port = FIBRE_SWITCH_SERIAL_PORT
-        self.serial.baudrate = FIBRE_SWITCH_BAUD_RATE
+        self.connection = FibreSwitchConnection() if connection is None else connection
+
+    def open_connection(self):
+        """
+        Open the serial connection to the Fibre Switch
+        """
+        self.connection.open()
 
+    def close_connection(self):
+        """
+        Close the serial connection to the Fibre Switch
+        """
+        self.connection.close()
+
+    @traced("fibre_switch.execute_message")
     def execute_message(self, msg):
         r"""
         Send a command message over the serial port for the Fibre Switch to execute.  The message is automatically followed by \\r\\n , so you do not need to add this.
@@ -57,14 +177,25 @@ class FibreSwitch(object):
         :param msg:
         :type msg: string
         """
-        self.serial.open()
-        self.serial.write(msg)
-        self.serial.write("\r\n")
-        self.serial.close()
+        self.connection.transaction(msg, read_back = False)
+
+    @traced("fibre_switch.query")
+    def query(self, msg):
+        """
+        Send a command message, or a list of them, and read back the Fibre Switch's one line reply, in a single transaction
+
+        :param msg:
+        :type msg: string or list
+
+        :returns: reply
+        :type reply: string
+        """
+        return self.connection.transaction(msg)
 
     def set_global_channel_number(self, channel_num):
         """
-        Set the global Fibre Switch channel, and check that it succeeded
+        Set the global Fibre Switch channel, and check that it succeeded.
+        The setting and the `ch?` check go down the port in one write, so the change costs a single round trip.
 
         :param channel_num: requested new global channel number
 
@@ -74,19 +205,8 @@ class FibreSwitch(object):
         """
         check_global_channel_number(channel_num)
         self.channel_num = channel_num
-        self.execute_message("ch{0}".format(channel_num))
-        if(get_global_channel_number() != channel_num):
-            raise FiberSwitchHWError("Failed to set Fibre Switch to {0}".format(channel_num))
-
-    def read_back(self):
-        """
-        Wait for a configuration-determined time, and read back a line from the hardware
-
-        :returns: message
-        :type message: string
-        """
-        sleep(FIBRE_SWITCH_WAIT_TIME)
-        return self.serial.readline()
+        if parse_channel_reply(self.query(["ch{0}".format(channel_num), "ch?"])) != channel_num:
+            raise FibreSwitchHWError("Failed to set Fibre Switch to {0}".format(channel_num))
 
     def get_global_channel_number(self):
         """
@@ -94,9 +214,10 @@ class FibreSwitch(object):
 
         :returns: current channel
         :type current channel: int
+
+        :raises: :class:`.FibreSwitchHWError` if the reply is not a channel number
         """
-        self.execute_message("ch?")
-        return self.read_back()
+        return parse_channel_reply(self.query("ch?"))
 
     def set_io_channel_numbers(self, in_channel, out_channel):
         """
@@ -109,14 +230,13 @@ class FibreSwitch(object):
 
         :raises: :class:`.FibreSwitchHWError` if the command is unsuccessful
         """
-        set_global_channel_number(find_global_channel_number(in_channel, out_channel))
+        self.set_global_channel_number(find_global_channel_number(in_channel, out_channel))
         
     def get_fwr_version(self):
         """
         Get the current Fibre Switch firmware version as a string
         """
-        self.execute_message("firmware?")
-        return self.read_back()    
+        return self.query("firmware?")
 
     def current_state(self):
         """
@@ -124,4 +244,4 @@ class FibreSwitch(object):
         """
         return """Firmware version : {0}
 Fibre Switch channel : {1}
-""".format(get_global_channel_number(), get_fwr_version())
+""".format(self.get_fwr_version(), self.get_global_channel_number())
@@ -0,0 +1,104 @@
+from smellie_config import GAIN_CONTROL_N_SAMPLES
+import numpy
+
+"""
+Preallocated output buffers for the NI Unit's Gain Voltage tasks
+"""
+
+# Byte alignment of the output buffers - one cache line
+ALIGNMENT = 64
+
+def aligned_zeros(n_samples, dtype = numpy.float64, alignment = ALIGNMENT):
+    """
+    Allocate a zeroed, contiguous numpy array whose data pointer is aligned to `alignment` bytes
+
+    :param n_samples: length of the array
+    :param dtype: numpy data type of the array
+    :param alignment: alignment in bytes
+
+    :returns: the array
+    :type the array: numpy.ndarray
+    """
+    n_bytes = n_samples * numpy.dtype(dtype).itemsize
+    raw = numpy.zeros(n_bytes + alignment, dtype = numpy.uint8)
+    offset = (-raw.ctypes.data) % alignment
+    return raw[offset:offset + n_bytes].view(dtype)
+
+class GainBufferLogicError(Exception):
+    """
+    Thrown if a waveform is requested that cannot fit the buffer
+    """
+    pass
+
+class GainBuffer(object):
+    """
+    A single aligned float64 output buffer of GAIN_CONTROL_N_SAMPLES samples (set in config.py), allocated once per task and filled in place.
+    Each fill method returns the buffer itself, ready to pass to DAQmxWriteAnalogF64 - no allocation happens on the voltage-change path.
+    The buffer can be resized for waveforms of different lengths (see :func:`resize`); it is only reallocated when it has to grow.
+    """
+    def __init__(self, n_samples = GAIN_CONTROL_N_SAMPLES):
+        self.capacity = 0
+        self.resize(n_samples)
+
+    def resize(self, n_samples):
+        """
+        Set the number of samples the fill methods fill and return, reallocating the buffer only if it is longer than any asked for before
+
+        :param n_samples: the new length of the buffer
+        """
+        if n_samples > self.capacity:
+            self._storage = aligned_zeros(n_samples)
+            # position of each sample along the buffer, used to build ramps
+            self._index = numpy.arange(n_samples, dtype = numpy.float64)
+            self.capacity = n_samples
+        self.n_samples = n_samples
+        self.data = self._storage[:n_samples]
+
+    def constant(self, voltage):
+        """
+        Fill the buffer with a constant voltage
+
+        :param voltage: output voltage
+
+        :returns: the buffer
+        """
+        self.data.fill(voltage)
+        return self.data
+
+    def ramp(self, v_start, v_stop):
+        """
+        Fill the buffer with a linear ramp from v_start (first sample) to v_stop (last sample)
+
+        :param v_start: voltage of the first sample
+        :param v_stop: voltage of the last sample
+
+        :returns: the buffer
+        """
+        step = (v_stop - v_start) / float(self.n_samples - 1) if self.n_samples > 1 else 0.0
+        numpy.multiply(self._index[:self.n_samples], step, out = self.data)
+        self.data += v_start
+        if self.n_samples > 1:
+            # exactly, whatever the rounding along the way
+            self.data[-1] = v_stop
+        return self.data
+
+    def staircase(self, voltages):
+        """
+        Fill the buffer with a staircase: each voltage is held for an equal number of samples, in order.
+        Any samples left over when n_samples is not a multiple of len(voltages) hold the last voltage.
+
+        :param voltages: the voltage of each step
+        :type voltages: list
+
+        :returns: the buffer
+
+        :raises: :class:`.GainBufferLogicError` if there are more steps than samples
+        """
+        n_steps = len(voltages)
+        if n_steps == 0 or n_steps > self.n_samples:
+            raise GainBufferLogicError("Cannot fit a {0} step staircase into a {1} sample buffer".format(n_steps, self.n_samples))
+        step_length = self.n_samples // n_steps
+        steps = self.data[:n_steps * step_length].reshape(n_steps, step_length)
+        steps[:] = numpy.asarray(voltages, dtype = self.data.dtype)[:, numpy.newaxis]
+        self.data[n_steps * step_length:] = voltages[-1]
+        return self.data
@@ -1,6 +1,6 @@
-import daqmx.functions
-import daqmx.constants
+from daqmx import functions, constants
 from smellie_config import GAIN_CONTROL_N_SAMPLES, GAIN_CONTROL_SAMP_FREQ
+from gain_buffer import GainBuffer
 class GainContolLogicError(Exception):
     pass
 
@@ -8,7 +8,8 @@ class GainVoltageGenerator(object):
     def __init__(self):
         self.number_of_samples  = GAIN_CONTROL_N_SAMPLES
         self.sampling_frequency = GAIN_CONTROL_SAMP_FREQ
-        set_voltage(0)
+        self.buffer = GainBuffer(self.number_of_samples)
+        self.set_voltage(0)
 
     def set_voltage(self, voltage):
         self._set_up()
@@ -43,26 +44,22 @@ class GainVoltageGenerator(object):
         if(voltage > 1.0 or voltage < 0.0124):
             raise  GainControlLogicError("Gain voltage must be set between 0.1V and 1.0V to avoid damage to MPU")
 
-        #Creating and shaping the data buffer:
-        data = np.zeros(3000, dtype = numpy.float64)
-
-        for i in range(len(data)):
-            data[i]= voltage - self.vRes
+        #Filling the preallocated data buffer:
+        data = self.buffer.constant(voltage - self.vRes)
 
         functions.DAQmxWriteAnalogF64(self.taskHandle, 
-                                      3000, 0, 10.0,
-                                      constants,
-                                      DAQmx_Val_GroupByChannel, 
+                                      len(data), 0, 10.0,
+                                      constants.DAQmx_Val_GroupByChannel, 
                                       data, None, None)
 
         functions.DAQmxStartTask(self.taskHandle)
 
     def _clear_up(self):
         functions.DAQmxStopTask(self.taskHandle)
-        data = np.zeros(3000, dtype = numpy.float64)
+        data = self.buffer.constant(0)
         functions.DAQmxWriteAnalogF64(self.taskHandle,
-                                      3000, 0, 10.0,
-                                      DAQmx_Val_GroupByChannel, 
+                                      len(data), 0, 10.0,
+                                      constants.DAQmx_Val_GroupByChannel, 
                                       data, None, None)
 
         functions.DAQmxClearTask(self.taskHandle)
@@ -0,0 +1,321 @@
+from smellie_config import INTERLOCK_PULSE_PERIOD, INTERLOCK_JITTER_BUDGET, INTERLOCK_HEARTBEAT_PORT, INTERLOCK_HEARTBEAT_PERIOD, INTERLOCK_HEARTBEAT_TIMEOUT
+from SocketServer import ThreadingMixIn, TCPServer, StreamRequestHandler
+from threading import Event, Lock
+from time import sleep
+import socket
+import ctypes
+import ctypes.util
+import os
+
+"""
+Paced keep-alive pulses for the SMELLIE interlock.
+The interlock only lets the lasers fire while it keeps receiving pulses along its serial port, so a pulse is sent every INTERLOCK_PULSE_PERIOD seconds (set in config.py) on a monotonic-clock schedule,
+sleeping in between - rather than writing as fast as the port allows.  Stopping the pulses locks the lasers.
+
+A remote host keeps the interlock open by holding a TCP heartbeat stream to the interlock server (:class:`HeartbeatServer`, fed by a :class:`HeartbeatClient`).
+Each heartbeat is a line "<sequence number> <round trip time of the previous heartbeat>", which the server echoes back with the sequence number.
+The server only sends pulses while some stream has had a heartbeat within INTERLOCK_HEARTBEAT_TIMEOUT seconds, so a dropped or stalled stream locks the lasers.
+"""
+
+# The keep alive pulse understood by the interlock
+KEEP_ALIVE_PULSE = "a\r\n"
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def _make_monotonic():
+    """
+    Python 2 has no monotonic clock, so find the platform's: QueryPerformanceCounter on Windows, clock_gettime(CLOCK_MONOTONIC) elsewhere
+    This is a private function, indicated by the underscore before the name - do not change that!
+
+    :returns: a function returning seconds from an arbitrary start, which never goes backwards
+    """
+    if os.name == "nt":
+        counter = ctypes.c_int64()
+        frequency = ctypes.c_int64()
+        ctypes.windll.kernel32.QueryPerformanceFrequency(ctypes.byref(frequency))
+        def monotonic():
+            ctypes.windll.kernel32.QueryPerformanceCounter(ctypes.byref(counter))
+            return counter.value / float(frequency.value)
+        return monotonic
+    CLOCK_MONOTONIC = 1
+    libc = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno = True)
+    def monotonic():
+        now = _timespec()
+        if libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(now)) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return now.tv_sec + now.tv_nsec * 1e-9
+    return monotonic
+
+try:
+    from time import monotonic
+except ImportError:
+    monotonic = _make_monotonic()
+
+class InterlockKeepAlive(object):
+    """
+    Sends keep alive pulses down a serial port on a fixed schedule, until stopped.
+    A pulse sent more than jitter_budget seconds after its deadline counts as missed; if a whole period is lost the schedule restarts from now, rather than sending the lost pulses in a burst.
+    """
+    def __init__(self, serial, period = INTERLOCK_PULSE_PERIOD, jitter_budget = INTERLOCK_JITTER_BUDGET, gate = None):
+        """
+        :param serial: the open serial port of the interlock
+
+        :param period: time between pulses, in seconds - it must be well inside the interlock's timeout
+
+        :param jitter_budget: how late a pulse may be before it counts as a missed deadline, in seconds
+
+        :param gate: function returning whether to send the pulse now, e.g. :func:`HeartbeatMonitor.alive` - by default every pulse is sent
+        """
+        self.serial = serial
+        self.period = period
+        self.jitter_budget = jitter_budget
+        self.gate = gate
+        self.stop_requested = Event()
+        self.lock = Lock()
+        self.started = None
+        self.pulses = 0
+        self.held = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+
+    def run(self):
+        """
+        Send pulses until :func:`stop` is called (from another thread or a signal handler), then return with the lasers locked
+        """
+        self.stop_requested.clear()
+        self.started = monotonic()
+        deadline = self.started
+        while not self.stop_requested.is_set():
+            wait = deadline - monotonic()
+            if wait > 0:
+                sleep(wait)
+                if self.stop_requested.is_set():
+                    break
+            if self.gate is None or self.gate():
+                self.serial.write(KEEP_ALIVE_PULSE)
+                lateness = monotonic() - deadline
+                with self.lock:
+                    self.pulses += 1
+                    self.max_lateness = max(self.max_lateness, lateness)
+                    if lateness > self.jitter_budget:
+                        self.missed += 1
+            else:
+                lateness = monotonic() - deadline
+                with self.lock:
+                    self.held += 1
+            deadline += self.period
+            if lateness > self.period:
+                deadline = monotonic() + self.period
+
+    def stop(self):
+        """
+        Stop sending pulses, which locks the lasers.  :func:`run` returns within one period.
+        """
+        self.stop_requested.set()
+
+    def stats(self):
+        """
+        :returns: {"pulses" : number sent, "held" : number not sent because the gate was shut, "missed" : number later than the jitter budget, "max_lateness" : seconds, "rate" : pulses per second achieved, "target_rate" : pulses per second asked for}
+        :type returns: dict
+        """
+        with self.lock:
+            elapsed = monotonic() - self.started if self.started is not None else 0.0
+            return {"pulses" : self.pulses,
+                    "held" : self.held,
+                    "missed" : self.missed,
+                    "max_lateness" : self.max_lateness,
+                    "rate" : self.pulses / elapsed if elapsed > 0 else 0.0,
+                    "target_rate" : 1.0 / self.period}
+
+class ClientHeartbeats(object):
+    """
+    Heartbeat statistics of one client host, over all its connections
+    """
+    def __init__(self):
+        self.connections = 0
+        self.open = 0
+        self.beats = 0
+        self.last_beat = None
+        self.total_gap = 0.0
+        self.max_gap = 0.0
+        self.late_gaps = 0
+        self.rtts = 0
+        self.total_rtt = 0.0
+        self.max_rtt = 0.0
+        self.last_rtt = 0.0
+
+class HeartbeatMonitor(object):
+    """
+    Keeps the heartbeat statistics of every client, and decides whether the interlock may be kept open
+    """
+    def __init__(self, timeout = INTERLOCK_HEARTBEAT_TIMEOUT):
+        """
+        :param timeout: the interlock is held shut if no open stream has had a heartbeat for this long, in seconds
+        """
+        self.timeout = timeout
+        self.clients = {}
+        self.lock = Lock()
+
+    def connected(self, name):
+        """
+        A client has opened a stream
+        """
+        with self.lock:
+            client = self.clients.setdefault(name, ClientHeartbeats())
+            client.connections += 1
+            client.open += 1
+
+    def disconnected(self, name):
+        """
+        A client's stream has closed or been dropped
+        """
+        with self.lock:
+            self.clients[name].open -= 1
+
+    def beat(self, name, rtt = None):
+        """
+        Record a heartbeat from a client
+
+        :param rtt: the round trip time the client measured for its previous heartbeat, in seconds, if known
+        """
+        now = monotonic()
+        with self.lock:
+            client = self.clients[name]
+            if client.last_beat is not None:
+                gap = now - client.last_beat
+                client.total_gap += gap
+                client.max_gap = max(client.max_gap, gap)
+                if gap > self.timeout:
+                    client.late_gaps += 1
+            client.last_beat = now
+            client.beats += 1
+            if rtt is not None:
+                client.rtts += 1
+                client.total_rtt += rtt
+                client.max_rtt = max(client.max_rtt, rtt)
+                client.last_rtt = rtt
+
+    def alive(self):
+        """
+        :returns: True if some client has an open stream with a heartbeat in the last timeout seconds
+        """
+        now = monotonic()
+        with self.lock:
+            return any(client.open > 0 and client.last_beat is not None and now - client.last_beat <= self.timeout
+                       for client in self.clients.itervalues())
+
+    def stats(self):
+        """
+        :returns: {client host : {"connections", "open", "beats", "last_beat_age", "mean_gap", "max_gap", "late_gaps", "last_rtt", "mean_rtt", "max_rtt"}}, times in seconds; late gaps are those longer than the timeout
+        :type returns: dict
+        """
+        now = monotonic()
+        stats = {}
+        with self.lock:
+            for name, client in self.clients.iteritems():
+                stats[name] = {"connections" : client.connections,
+                               "open" : client.open,
+                               "beats" : client.beats,
+                               "last_beat_age" : now - client.last_beat if client.last_beat is not None else -1.0,
+                               "mean_gap" : client.total_gap / (client.beats - 1) if client.beats > 1 else 0.0,
+                               "max_gap" : client.max_gap,
+                               "late_gaps" : client.late_gaps,
+                               "last_rtt" : client.last_rtt,
+                               "mean_rtt" : client.total_rtt / client.rtts if client.rtts else 0.0,
+                               "max_rtt" : client.max_rtt}
+        return stats
+
+class HeartbeatRequestHandler(StreamRequestHandler):
+    """
+    Reads one client's heartbeat stream, recording each heartbeat with the server's :class:`HeartbeatMonitor` and echoing its sequence number.
+    A stream that is silent for longer than the monitor's timeout, or sends a malformed heartbeat, is dropped.
+    """
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        monitor = self.server.monitor
+        name = self.client_address[0]
+        self.connection.settimeout(monitor.timeout)
+        monitor.connected(name)
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                fields = line.split()
+                monitor.beat(name, float(fields[1]) if len(fields) > 1 else None)
+                self.wfile.write(fields[0] + "\n")
+        except (socket.error, ValueError, IndexError):
+            pass
+        finally:
+            monitor.disconnected(name)
+
+class HeartbeatServer(ThreadingMixIn, TCPServer):
+    """
+    TCP server for heartbeat streams, each handled in its own thread
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, monitor):
+        """
+        :param address: (host, port) to listen on
+
+        :param monitor: the :class:`HeartbeatMonitor` to record heartbeats with
+        """
+        TCPServer.__init__(self, address, HeartbeatRequestHandler)
+        self.monitor = monitor
+
+class HeartbeatClient(object):
+    """
+    Holds a heartbeat stream open to the interlock server, sending a heartbeat every period seconds until stopped
+    """
+    def __init__(self, host, port = INTERLOCK_HEARTBEAT_PORT, period = INTERLOCK_HEARTBEAT_PERIOD, timeout = INTERLOCK_HEARTBEAT_TIMEOUT):
+        """
+        :param host: the interlock server
+
+        :param period: time between heartbeats, in seconds - it must be well inside the server's timeout
+
+        :param timeout: how long to wait for each echo, in seconds
+        """
+        self.address = (host, port)
+        self.period = period
+        self.timeout = timeout
+        self.stop_requested = Event()
+        self.beats = 0
+        self.last_rtt = None
+
+    def run(self):
+        """
+        Connect, and send heartbeats until :func:`stop` is called
+
+        :raises: socket.error if the stream cannot be opened, or is dropped
+        """
+        self.stop_requested.clear()
+        connection = socket.create_connection(self.address, self.timeout)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        echoes = connection.makefile("r")
+        try:
+            deadline = monotonic()
+            while not self.stop_requested.is_set():
+                sent = monotonic()
+                if self.last_rtt is None:
+                    connection.sendall("{0}\n".format(self.beats))
+                else:
+                    connection.sendall("{0} {1!r}\n".format(self.beats, self.last_rtt))
+                if echoes.readline().strip() != str(self.beats):
+                    raise socket.error("Heartbeat {0} was not echoed by the interlock server".format(self.beats))
+                self.last_rtt = monotonic() - sent
+                self.beats += 1
+                deadline = max(deadline + self.period, monotonic())
+                sleep(max(deadline - monotonic(), 0))
+        finally:
+            echoes.close()
+            connection.close()
+
+    def stop(self):
+        """
+        Stop sending heartbeats and close the stream, which locks the interlock
+        """
+        self.stop_requested.set()
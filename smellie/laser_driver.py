@@ -1,8 +1,13 @@
 from sepia.usb import close_usb_device, open_usb_device
 from sepia.fwr import free_module_map, get_module_map, get_fwr_version
-from sepia.slm import set_intensity_fine_step, get_pulse_parameters, set_pulse_parameters, decode_freq_trig_mode
+from sepia.slm import set_intensity_fine_step, get_intensity_fine_step, get_pulse_parameters, set_pulse_parameters, decode_freq_trig_mode
+from sepia.scm import get_laser_locked, get_laser_soft_lock, set_laser_soft_lock
 from sepia.com import get_module_type, decode_module_type
-from smellie_config import LASER_DRIVER_DEV_ID, LASER_DRIVER_SLOT_ID
+from sepia import decode_cache
+from sepia.sepia import ensure_dll_loaded
+from smellie_config import LASER_DRIVER_DEV_ID, LASER_DRIVER_SLOT_ID, LASER_DRIVER_STATUS_MAX_AGE, SEPIA_PREFILL_DECODE_TABLES
+from threading import RLock
+from time import time
 
 """
 Control of the SEPIA II Laser Driver hardware
@@ -20,32 +25,132 @@ class LaserDriverHWError(Exception):
     """
     pass
 
+class LaserDriverStatus(object):
+    """
+    Snapshot of the SEPIA state, filled by a single poll of the hardware (see :func:`LaserDriver.poll_status`)
+    """
+    def __init__(self, freq_mode, pulse_mode, head_type, intensity, laser_locked, soft_lock, firmware_version):
+        self.freq_mode = freq_mode
+        self.pulse_mode = pulse_mode
+        self.head_type = head_type
+        self.intensity = intensity
+        self.laser_locked = laser_locked
+        self.soft_lock = soft_lock
+        self.firmware_version = firmware_version
+        self.timestamp = time()
+
+    def age(self):
+        """
+        :returns: seconds since the snapshot was taken
+        """
+        return time() - self.timestamp
+
+    def pulse_params(self):
+        """
+        :returns: frequency_mode, pulse_mode, head_type
+        :rtype: (int, bool, int) tuple
+        """
+        return self.freq_mode, self.pulse_mode, self.head_type
+
 class LaserDriver(object):
     """
     Controls the Laser Driver via commands sent down a USB port.
+    Status and check methods read from a :class:`LaserDriverStatus` snapshot, re-polled when older than LASER_DRIVER_STATUS_MAX_AGE (set in config.py) or after any setting is changed.
+    The firmware version and head type cannot change while the connection is open, so they are only read once per connection.
+    Every SEPIA call and snapshot update holds the driver's lock, so status reads from other threads never interleave with a command.
     """
     def __init__(self):
         self.dev_id  = LASER_DRIVER_DEV_ID
         self.slot_id = LASER_DRIVER_SLOT_ID
+        self.status_max_age = LASER_DRIVER_STATUS_MAX_AGE
+        # the SEPIA .dll is not safe to call from several threads at once, and a status poll must not see a half-made setting; re-entrant, as settings poll the status too
+        self.lock = RLock()
+        self._forget_session()
         
     def open_connection(self):
         """
         Open the USB connection to SEPIA
         """
-        open_usb_device(self.dev_id)
-        get_module_map(self.dev_id)
-        # Sets the laser into pulse mode, with the frequency mode = rising edge of the external trigger pulse.
-        # Do not change this for Detector Safety reasons!
-        self.set_pulse_parameters(self.dev_id, self.slot_id)
-        self.check_pulse_mode()
-        self.check_trig_mode()
+        with self.lock:
+            self._forget_session()
+            ensure_dll_loaded()
+            open_usb_device(self.dev_id)
+            get_module_map(self.dev_id)
+            # decoded strings are only valid for the .dll version they came from
+            if SEPIA_PREFILL_DECODE_TABLES:
+                decode_cache.fill()
+            else:
+                decode_cache.validate()
+            # Sets the laser into pulse mode, with the frequency mode = rising edge of the external trigger pulse.
+            # Do not change this for Detector Safety reasons!
+            self.set_pulse_parameters()
+            self.check_pulse_mode()
+            self.check_trig_mode()
 
     def close_connection(self):
         """
         (Cleanly!) close the USB connection to SEPIA
         """
-        free_module_map(self.dev_id)
-        close_device(self.dev_id)
+        with self.lock:
+            free_module_map(self.dev_id)
+            close_usb_device(self.dev_id)
+            self._forget_session()
+
+    def _forget_session(self):
+        """
+        Drop the status snapshot and the facts memoized for this connection
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.snapshot = None
+        self.firmware_version = None
+        self.head_type = None
+
+    def invalidate_status(self):
+        """
+        Drop the status snapshot, so the next status request polls the hardware
+        """
+        self.snapshot = None
+
+    def poll_status(self):
+        """
+        Poll SEPIA once for the pulse parameters, intensity, lock and soft-lock state, and take a new status snapshot.
+        The firmware version is only read on the first poll of a connection.
+
+        :returns: the snapshot
+        :rtype: :class:`LaserDriverStatus`
+        """
+        with self.lock:
+            freq_mode, pulse_mode, head_type = get_pulse_parameters(self.dev_id, self.slot_id)
+            if self.head_type is None:
+                self.head_type = head_type
+            if self.firmware_version is None:
+                self.firmware_version = get_fwr_version(self.dev_id)
+            self.snapshot = LaserDriverStatus(freq_mode, pulse_mode, head_type,
+                                              get_intensity_fine_step(self.dev_id, self.slot_id),
+                                              get_laser_locked(self.dev_id, self.slot_id),
+                                              get_laser_soft_lock(self.dev_id, self.slot_id),
+                                              self.firmware_version)
+            return self.snapshot
+
+    def status(self):
+        """
+        The current status snapshot, re-polled if there is none or it is older than status_max_age seconds
+
+        :returns: the snapshot
+        :rtype: :class:`LaserDriverStatus`
+        """
+        with self.lock:
+            if self.snapshot is None or self.snapshot.age() > self.status_max_age:
+                return self.poll_status()
+            return self.snapshot
+
+    def set_pulse_parameters(self):
+        """
+        Set SEPIA to pulsed mode, triggered from the rising edge of the external trigger (see :func:`sepia.slm.set_pulse_parameters`)
+        """
+        with self.lock:
+            self.invalidate_status()
+            set_pulse_parameters(self.dev_id, self.slot_id)
 
     def get_pulse_params(self):
         """
@@ -56,7 +161,7 @@ class LaserDriver(object):
         :returns: head_type
         :rtype: (int, bool, int) tuple
         """
-        return get_pulse_parameters(self.dev_id, self.slot_id)
+        return self.status().pulse_params()
 
     def get_frequency_mode(self):
         """
@@ -65,7 +170,7 @@ class LaserDriver(object):
         :returns: frequency_mode
         :rtype:
         """
-        return decode_freq_trig_mode(self.get_pulse_params()[0])
+        return decode_freq_trig_mode(self.status().freq_mode)
 
     def get_pulse_mode(self):
         """
@@ -74,16 +179,19 @@ class LaserDriver(object):
         :returns: pulse_mode
         :rtype: int
         """
-        return self.get_pulse_params()[1]
+        return self.status().pulse_mode
 
     def get_head_type(self):
         """
-        Poll SEPIA for the currently set head type
+        The head type of the connected laser head - read once per connection
 
         :returns: head_type
         :rtype: int
         """
-        return self.get_pulse_params()[2]
+        with self.lock:
+            if self.head_type is None:
+                self.poll_status()
+            return self.head_type
         
     def check_pulse_mode(self):
         """
@@ -91,11 +199,16 @@ class LaserDriver(object):
 
         :raises: :class:`.LaserDriverHWError` if pulsed mode is not set
         """
-        if not self.get_pulse_parameters()[1] == 1:
+        if not self.status().pulse_mode == 1:
             raise LaserDriverHWError("Laser Driver is not in pulsed mode!!")
 
     def check_trig_mode(self):
-        if not self.get_pulse_parameters()[0] == 6:
+        """
+        Check which frequency mode is set in SEPIA - it must *always* be triggered from the rising edge of the external trigger (6)
+
+        :raises: :class:`.LaserDriverHWError` if external rising edge triggering is not set
+        """
+        if not self.status().freq_mode == 6:
             raise LaserDriverHWError("Laser Driver is not in external trigger  (rising edge) mode!")
 
     def get_intensity(self):
@@ -105,7 +218,7 @@ class LaserDriver(object):
         :returns: intensity
         :rtype: int
         """
-        return get_intensity_fine_step(self.dev_id, self.slot_id, intensity)
+        return self.status().intensity
 
     def set_intensity(self, intensity):
         """
@@ -116,9 +229,17 @@ class LaserDriver(object):
 
         :raises: :class:`.LaserDriverHWError` if the command is unsuccessful
         """
-        set_intensity_fine_step(self.dev_id, self.slot_id, intensity)
-        if not self.get_intensity() == intensity:
-            raise LaserDriverHWError("Cannot set Laser head intensity!")
+        with self.lock:
+            snapshot = self.snapshot
+            self.invalidate_status()
+            set_intensity_fine_step(self.dev_id, self.slot_id, intensity)
+            # read back just the intensity - the rest of a fresh snapshot is unchanged by this command
+            read_back = get_intensity_fine_step(self.dev_id, self.slot_id)
+            if not read_back == intensity:
+                raise LaserDriverHWError("Cannot set Laser head intensity!")
+            if snapshot is not None and snapshot.age() <= self.status_max_age:
+                snapshot.intensity = read_back
+                self.snapshot = snapshot
 
     def is_laser_locked(self):
         """
@@ -126,7 +247,7 @@ class LaserDriver(object):
         
         :returns: False if the power is off, the soft-lock is on or the sepia key is locked
         """
-        return get_laser_locked(self.dev_id, self.slot_id)
+        return self.status().laser_locked
 
     def is_soft_lock_on(self):
         """
@@ -134,32 +255,39 @@ class LaserDriver(object):
         
         :returns: True if the soft lock is on
         """
-        return get_laser_soft_lock(self.dev_id, self.slot_id)
+        return self.status().soft_lock
 
     def set_soft_lock(self, is_locked = True):
         """
         Set the SEPIA soft-lock to on
         """
-        set_laser_soft_lock(self.dev_id, self.slot_id, is_locked)
+        with self.lock:
+            self.invalidate_status()
+            set_laser_soft_lock(self.dev_id, self.slot_id, is_locked)
 
     def go_safe(self):
         """
         Set SEPIA into its safe state: soft-lock = on, intensity = 0%
         """
-        self.set_soft_lock(is_locked = True)
-        self.set_intensity(0)
-        self.set_pulse_parameters()
+        with self.lock:
+            self.set_soft_lock(is_locked = True)
+            self.set_intensity(0)
+            self.set_pulse_parameters()
 
     def get_firmware_version(self):
         """
-        Get the current SEPIA firmware version as a string
+        Get the current SEPIA firmware version as a string - read once per connection
         """
-        return get_fwr_version(self.dev_id)
+        with self.lock:
+            if self.firmware_version is None:
+                self.poll_status()
+            return self.firmware_version
 
     def current_state(self):
         """
-        Returns a formatted string with the current hardware settings
+        Returns a formatted string with the current hardware settings, from a single status snapshot
         """
+        snapshot = self.status()
         return """Laser Locked : {0}
 Soft Lock : {1}
 Intensity : {2}/1000
@@ -167,10 +295,10 @@ Pulse Mode : {3}
 Pulse Parameters : {4}
 Frequency Mode : {5}
 Firmware Version : {6}
-""".format("On " if self.is_laser_locked() else "Off", 
-           "On " if self.is_soft_lock_on() else "Off", 
-           self.get_intensity(), 
-           self.get_pulse_mode(), 
-           ", ".join(srt(x) for x in self.get_pulse_params()),
-           self.get_frequency_mode(), 
-           self.get_firmware_version())
+""".format("On " if snapshot.laser_locked else "Off", 
+           "On " if snapshot.soft_lock else "Off", 
+           snapshot.intensity, 
+           snapshot.pulse_mode, 
+           ", ".join(str(x) for x in snapshot.pulse_params()),
+           decode_freq_trig_mode(snapshot.freq_mode), 
+           snapshot.firmware_version)
@@ -1,10 +1,21 @@
-from smellie_config import RELAY_COM_CHANNEL, RELAY_SLEEP
-from time import sleep
+from smellie_config import RELAY_COM_CHANNEL, RELAY_SLEEP, RELAY_ADAPTIVE_SETTLE, RELAY_POLL_PERIOD, RELAY_SETTLE_DWELL, RELAY_SETTLE_HISTORY
+try:
+    from u12 import U12
+except ImportError:
+    # LabJackPython is only needed to drive the real Laser Switch, see :mod:`simulator`
+    U12 = None
+from tracing import traced
+from collections import deque
+from threading import RLock
+from time import sleep, time
 
 """
 Control of the Laser Switch hardware
 """
 
+# Number of physical Laser Switch channels. The selector only steps upwards, wrapping from N_CHANNELS - 1 back to 0
+N_CHANNELS = 6
+
 def invert(bit):
     """
     Invert the input bit, i.e. convert 0 to 1, or 1 to 0
@@ -25,6 +36,18 @@ def translate_bits(b0, b1, b2):
     """
     return int("{2}{1}{0}".format(b0, b1, b2), 2)
 
+def pulses_to_channel(current, target):
+    """
+    The minimum number of single-step increments needed to move the selector from one channel to another, given that it wraps from N_CHANNELS - 1 back to 0
+
+    :param current: the currently selected channel
+    :param target: the requested selected channel
+
+    :returns: number of pulses
+    :type number of pulses: int
+    """
+    return (target - current) % N_CHANNELS
+
 class LaserSwitchLogicError(Exception):
     """
     Thrown if an inconsistency is noticed *before* any instructions are sent to the hardware (i.e. a problem with code logic)
@@ -41,10 +64,38 @@ class LaserSwitch(object):
     """
     Controls the Laser Switch via commands sent down a USB port.
     The port number is set in config.py .
+    Every U12 read and write holds the switch's lock, so a status read from another thread never interleaves with a channel change's I/O; the relay wait after an execute runs without it, and :func:`current_state` reports the relay as moving meanwhile.
     """
-    def __init__(self):
+    def __init__(self, connection = None):
+        """
+        :param connection: the LabJack U12 the Laser Switch is wired to - by default the first one found; :mod:`simulator` passes a simulated one
+
+        :raises: :class:`.LaserSwitchHWError` if no connection is given and LabJackPython is not installed
+        """
+        if connection is None:
+            if U12 is None:
+                raise LaserSwitchHWError("Cannot open the Laser Switch - LabJackPython (u12) is not installed")
+            connection = U12()
         self.com_channel = RELAY_COM_CHANNEL
-        self.connection = U12()
+        self.connection = connection
+        self.adaptive_settle = RELAY_ADAPTIVE_SETTLE
+        self.settle_timeout = RELAY_SLEEP
+        self.poll_period = RELAY_POLL_PERIOD
+        self.settle_dwell = RELAY_SETTLE_DWELL
+        self.settle_times = deque(maxlen = RELAY_SETTLE_HISTORY)
+        # a status read from one server thread must not interleave with the I/O of a channel change from another; re-entrant, as channel changes read the channels too
+        self.lock = RLock()
+        # the channel the relay is moving to while execute waits for it, otherwise None
+        self.moving_to = None
+
+    def _pulse_selector(self):
+        """
+        Send a single increment pulse to the selector, without any read back
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.connection.eDigitalOut(self.com_channel, 1, writeD = 1) 
+        self.connection.eDigitalOut(self.com_channel, 0, writeD = 1) 
+        self.connection.eDigitalOut(self.com_channel, 1, writeD = 1) 
 
     def selected_channel_up(self):
         """
@@ -52,21 +103,91 @@ class LaserSwitch(object):
 
         :raises: :class:`.LaserSwitchHWError` if the command is unsuccessful
         """
-        original_channel = get_selected_channel()
-        self.connection.eDigitalOut(self.com_channel, 1, writeD = 1) 
-        self.connection.eDigitalOut(self.com_channel, 0, writeD = 1) 
-        self.connection.eDigitalOut(self.com_channel, 1, writeD = 1) 
-        if (1 + original_channel) != get_selected_channel():
-            raise LaserSwitchHWError("Failed to increment the selected Laser Switch channel number!")
+        with self.lock:
+            original_channel = self.get_selected_channel()
+            self._pulse_selector()
+            if (1 + original_channel) % N_CHANNELS != self.get_selected_channel():
+                raise LaserSwitchHWError("Failed to increment the selected Laser Switch channel number!")
+
+    @traced("laser_switch.select_channel")
+    def select_channel(self, channel):
+        """
+        Move the selected Laser Switch channel to channel, sending the minimum number of increment pulses as one burst and verifying the selected channel once at the end
+
+        :param channel: requested selected channel
+
+        :raises: :class:`.LaserSwitchHWError` if the selector does not end up on the requested channel
+        """
+        with self.lock:
+            for i in xrange(pulses_to_channel(self.get_selected_channel(), channel)):
+                self._pulse_selector()
+            if self.get_selected_channel() != channel:
+                raise LaserSwitchHWError("Failed to select Laser Switch channel {0}!".format(channel))
 
+    @traced("laser_switch.execute")
     def execute(self):
         """
         Change the active Laser Switch channel from the currently active one to the currently selected one
+        In adaptive settle mode (RELAY_ADAPTIVE_SETTLE in config.py) this returns as soon as the relay has settled, see :func:`wait_for_settle`; otherwise it waits a fixed RELAY_SLEEP seconds.
+
+        :raises: :class:`.LaserSwitchHWError` if the relay has not settled within RELAY_SLEEP seconds
+        """
+        with self.lock:
+            channel = self.get_selected_channel()
+            self.moving_to = channel
+            self.connection.eDigitalOut(0, 1, writeD = 1) 
+            self.connection.eDigitalOut(0, 0, writeD = 1) 
+            self.connection.eDigitalOut(0, 1, writeD = 1)
+        # the lock is not held while the relay moves, so status reads are not held up by it
+        try:
+            if self.adaptive_settle:
+                self.wait_for_settle(channel)
+            else:
+                sleep(RELAY_SLEEP)
+        finally:
+            self.moving_to = None
+
+    def wait_for_settle(self, channel):
+        """
+        Poll the active channel every poll_period seconds until it has matched channel continuously for settle_dwell seconds.
+        The time taken to reach the stable state is recorded in settle_times.
+
+        :param channel: the channel the relay is expected to settle on
+
+        :returns: settle time in seconds
+        :type settle time: float
+
+        :raises: :class:`.LaserSwitchHWError` if the relay has not settled within settle_timeout seconds
+        """
+        start = time()
+        stable_since = None
+        while True:
+            now = time()
+            try:
+                active = self.get_active_channel()
+            except LaserSwitchHWError:
+                # bits 5-7 can read unphysical values while the relay is moving
+                active = None
+            if active == channel:
+                if stable_since is None:
+                    stable_since = now
+                if now - stable_since >= self.settle_dwell:
+                    self.settle_times.append(stable_since - start)
+                    return stable_since - start
+            else:
+                stable_since = None
+            if now - start >= self.settle_timeout:
+                raise LaserSwitchHWError("Laser Switch relay did not settle on channel {0} within {1}s".format(channel, self.settle_timeout))
+            sleep(self.poll_period)
+
+    def get_settle_times(self):
         """
-        self.connection.eDigitalOut(0, 1, writeD = 1) 
-        self.connection.eDigitalOut(0, 0, writeD = 1) 
-        self.connection.eDigitalOut(0, 1, writeD = 1)
-        sleep(RELAY_SLEEP)
+        The most recent observed relay settle times, oldest first
+
+        :returns: settle times in seconds
+        :type settle times: list
+        """
+        return list(self.settle_times)
         
     def get_selected_channel(self):
         """
@@ -75,9 +196,10 @@ class LaserSwitch(object):
         :returns: selected channel
         :type selected channel: int
         """
-        return translate_bits(self.connection.eDigitalIn(2, readD = 1),
-                              self.connection.eDigitalIn(3, readD = 1),
-                              self.connection.eDigitalIn(4, readD = 1))
+        with self.lock:
+            return translate_bits(self.connection.eDigitalIn(2, readD = 1),
+                                  self.connection.eDigitalIn(3, readD = 1),
+                                  self.connection.eDigitalIn(4, readD = 1))
 
     def get_active_channel(self):
         """
@@ -88,31 +210,39 @@ class LaserSwitch(object):
 
         :raises: :class:`.LaserSwitchHWError` if the command is unsuccessful
         """
-        channel = translate_bits(self.connection.eDigitalIn(5, readD = 1),
-                                 self.connection.eDigitalIn(6, readD = 1),
-                                 self.connection.eDigitalIn(7, readD = 1))
-        if not channel in xrange(6):
-            raise LaserSwitchHWError("Laser Switch returned unphysical active channel number!  It should be between 0 and 5 inclusive.")
-        return channel
+        with self.lock:
+            channel = translate_bits(self.connection.eDigitalIn(5, readD = 1),
+                                     self.connection.eDigitalIn(6, readD = 1),
+                                     self.connection.eDigitalIn(7, readD = 1))
+            if not channel in xrange(N_CHANNELS):
+                raise LaserSwitchHWError("Laser Switch returned unphysical active channel number!  It should be between 0 and 5 inclusive.")
+            return channel
 
     def set_active_channel(self, channel):
         """
         Set the active Laser Switch channel - must be between 0 and 5 inclusive
+        If the requested channel is already active nothing is sent to the hardware, and the relay wait in :func:`execute` is skipped.
         
         :param channel: requested active channel
 
         :raises: :class:`.LaserSwitchLogicError` if the requested active channel number is unphysical
+
+        :raises: :class:`.LaserSwitchHWError` if the command is unsuccessful
         """
-        if not channel in xrange(6):
+        if not channel in xrange(N_CHANNELS):
             raise LaserSwitchLogicError("Cannot set selected Laser Switch channel to {0} - must be between 0 and 5 inclusive.".format(channel))
-        while(channel != self.get_selected_channel()):
-            self.selected_channel_up()
+        if self.get_active_channel() == channel:
+            return
+        self.select_channel(channel)
         self.execute()
     
     def current_state(self):
         """
-        Return a formatted string with the current hardware settings
+        Return a formatted string with the current hardware settings.  While the relay is moving the active channel is not read - it can read unphysical values - and is shown as moving instead.
         """
-        return """Active channel : {0}
+        with self.lock:
+            moving_to = self.moving_to
+            active = self.get_active_channel() if moving_to is None else "moving to {0}".format(moving_to)
+            return """Active channel : {0}
 Selected channel : {1}
-""".format(get_active_channel(), get_selected_channel())
+""".format(active, self.get_selected_channel())
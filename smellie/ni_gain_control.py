@@ -1,6 +1,12 @@
-import daqmx.functions
-import daqmx.constants
-from smellie_config import NI_DEV_NAME, GAIN_CONTROL_N_SAMPLES, GAIN_CONTROL_SAMP_FREQ, GAIN_CONTROL_PIN_OUT
+try:
+    from daqmx import functions, constants
+except (ImportError, OSError, IOError):
+    # the NI-DAQmx library is only needed to drive the real NI Unit, see :mod:`simulator`
+    functions = constants = None
+from smellie_config import NI_DEV_NAME, GAIN_CONTROL_N_SAMPLES, GAIN_CONTROL_SAMP_FREQ, GAIN_CONTROL_PIN_OUT, GAIN_CONTROL_PERSISTENT_TASK
+from gain_buffer import GainBuffer
+from ctypes import byref
+from time import sleep
 
 """
 Generation of the MPU Gain Voltage using the National Instruments (NI) Unit
@@ -16,72 +22,219 @@ class GainVoltageGenerator(object):
     """
     Controls the Gain Voltage of the MPU's PMT, as produced by the NI Unit via commands sent down a USB port.
     """
-    def __init__(self):
+    def __init__(self, library = None):
         """
         There is a residual voltage of 0.0044V always present in the MPU's PMT.
         The NI Unit should be initialised with a zero voltage output ... note that this means that the total Gain Voltage at the PMT will be equal to the residual voltage, but there's nothing we can do about that (we would need the NI Unit to output a negative voltage in order for the Gain Voltage at PMT to be truly zero!).
+
+        :param library: object providing the DAQmx functions and constants - by default :mod:`daqmx.functions` and :mod:`daqmx.constants`; :mod:`simulator` passes a :class:`daqmx.stand_in.StandInDAQmx`
         """    
+        self.functions = functions if library is None else library
+        self.constants = constants if library is None else library
         self.dev_name = NI_DEV_NAME
         self.out_pin = GAIN_CONTROL_PIN_OUT
         self.number_of_samples = GAIN_CONTROL_N_SAMPLES
         self.sampling_frequency = GAIN_CONTROL_SAMP_FREQ
         self.vResidual = 0.0044
+        self.persistent_task = GAIN_CONTROL_PERSISTENT_TASK
+        self.taskHandle = None
+        self.buffer = GainBuffer(self.number_of_samples)
+        # ramps and staircases are built here, kept between sweeps and only grown for a longer one
+        self.sweep_buffer = GainBuffer(self.number_of_samples)
         self._set_up()
         self._start_output(0)
+        self.voltage = 0
+
+    def check_voltage(self, vGain):
+        """
+        Check that a requested Gain Voltage is inside the safe range for the MPU's PMT
+
+        :param vGain: requested Gain Voltage
+
+        :raises: :class:`.GainControlLogicError` if the requested Gain Voltage is outside the safe range for the MPU's PMT
+        """
+        if(vGain < 0.5 or vGain > 1.0):
+            raise GainControlLogicError("Cannot set Gain Voltage - must be between 0.5 and 1.0V to avoid damage to the MPU's PMT")
 
     def generate_voltage(self, vGain):
         """
         Generate the Gain Voltage as exactly requested by the user, and which would be found on measuring the gain voltage *at the MPU's PMT itself*.
         This voltage (vGain) = the residual voltage on the PMT (vResidual) + some required voltage output from the NI Unit (vOutput).
-        First, set up the output task (_set_up) and then output vOutput (_start_output) through one of the NI Unit's analogue output (ao) pins.
+        In persistent task mode (GAIN_CONTROL_PERSISTENT_TASK in config.py) the output task is created once and only its buffer is rewritten (_update_output); the task is torn down by :func:`go_safe`.
+        Otherwise, first set up the output task (_set_up) and then output vOutput (_start_output) through one of the NI Unit's analogue output (ao) pins.
 
         :param vGain: requested Gain Voltage
 
         :raises: :class:`.GainControlLogicError` if the requested Gain Voltage is outside the safe range for the MPU's PMT
         """
-        if(vGain < 0.5 or vGain > 1.0):
-            raise GainControlLogicError("Cannot set Gain Voltage - must be between 0.5 and 1.0V to avoid damage to the MPU's PMT")
-        self._set_up()
+        self.check_voltage(vGain)
         vOutput = vGain - self.vResidual
+        if self.persistent_task:
+            self._update_output(self.buffer.constant(vOutput))
+            self.voltage = vOutput
+            return
+        self._set_up()
         try:
             self._start_output(vOutput)
             self.voltage = vOutput
         finally:
             self._stop_output()
 
+    def step_voltages(self, vGains, dwell_time = 0):
+        """
+        Step the Gain Voltage through a list of values, holding each one for dwell_time seconds.
+        Every value is checked before any is sent to the hardware.
+
+        :param vGains: requested Gain Voltages, in order
+        :type vGains: list
+
+        :param dwell_time: time to hold each voltage, in seconds
+
+        :raises: :class:`.GainControlLogicError` if any requested Gain Voltage is outside the safe range for the MPU's PMT
+        """
+        for vGain in vGains:
+            self.check_voltage(vGain)
+        for vGain in vGains:
+            self.generate_voltage(vGain)
+            sleep(dwell_time)
+
+    def generate_ramp(self, vGainStart, vGainStop, duration):
+        """
+        Sweep the Gain Voltage once along a linear ramp from vGainStart to vGainStop over duration seconds, returning when the sweep has finished; the Gain Voltage is then held at vGainStop.
+        The ramp is one finite buffer of duration * sampling_frequency samples, output once on the NI Unit's sample clock (see :func:`_sweep`).
+
+        :param vGainStart: Gain Voltage at the start of the ramp
+        :param vGainStop: Gain Voltage at the end of the ramp
+
+        :param duration: length of the ramp, in seconds
+
+        :raises: :class:`.GainControlLogicError` if either end of the ramp is outside the safe range for the MPU's PMT, or the ramp is shorter than two samples
+        """
+        self.check_voltage(vGainStart)
+        self.check_voltage(vGainStop)
+        self.sweep_buffer.resize(self._sweep_samples(duration, 2))
+        self._sweep(self.sweep_buffer.ramp(vGainStart - self.vResidual, vGainStop - self.vResidual))
+
+    def generate_staircase(self, vGains, dwell_time):
+        """
+        Step the Gain Voltage once through a list of values, holding each for dwell_time seconds, returning when the last step has finished; the Gain Voltage is then held at the last value.
+        Unlike :func:`step_voltages`, the steps are one finite buffer output on the NI Unit's sample clock (see :func:`_sweep`), so every dwell is timed by the hardware.
+
+        :param vGains: the Gain Voltage of each step, in order
+        :type vGains: list
+
+        :param dwell_time: time to hold each step, in seconds
+
+        :raises: :class:`.GainControlLogicError` if there are no steps, any step is outside the safe range for the MPU's PMT, or the dwell time is shorter than one sample
+        """
+        if not vGains:
+            raise GainControlLogicError("Cannot step the Gain Voltage through an empty list of voltages")
+        for vGain in vGains:
+            self.check_voltage(vGain)
+        self.sweep_buffer.resize(self._sweep_samples(dwell_time) * len(vGains))
+        self._sweep(self.sweep_buffer.staircase([vGain - self.vResidual for vGain in vGains]))
+
+    def _sweep_samples(self, duration, minimum = 1):
+        """
+        The number of samples output in duration seconds
+        This is a private function, indicated by the underscore before the name - do not change that!
+
+        :param minimum: the fewest samples the sweep needs
+
+        :raises: :class:`.GainControlLogicError` if duration is shorter than minimum samples
+        """
+        n_samples = int(round(duration * self.sampling_frequency))
+        if n_samples < minimum:
+            raise GainControlLogicError("Cannot sweep the Gain Voltage for {0}s - shorter than {1} sample(s) at {2}Hz".format(duration, minimum, self.sampling_frequency))
+        return n_samples
+
+    def _sweep(self, data):
+        """
+        Output a filled sweep buffer once and wait for it to finish, on the Gain Voltage task switched to finite output - an existing task is stopped and reused, not re-created.
+        The output holds the last sample; in persistent task mode the task then goes back to continuous output at that voltage, otherwise it is cleared.
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        if self.taskHandle is None:
+            self._set_up()
+        else:
+            self.functions.DAQmxStopTask(self.taskHandle)
+        try:
+            self._set_timing(len(data))
+            self._start_waveform(data)
+            self.functions.DAQmxWaitUntilTaskDone(self.taskHandle, len(data) / float(self.sampling_frequency) + 10.0)
+            self.functions.DAQmxStopTask(self.taskHandle)
+            self._set_timing()
+        except:
+            self._stop_output()
+            raise
+        self.voltage = float(data[-1])
+        if self.persistent_task:
+            self._start_waveform(self.buffer.constant(self.voltage))
+        else:
+            self._stop_output()
+
     def _set_up(self):
         """
         Create the Gain Voltage task, and set up a generic voltage with a minimum and maximum value, and the analogue output channel X to be used.
         The channel string must be of the form `deviceName/analogueOutputPin`, i.e. `Dev1/ao0`.  /ao0 is used by default, but can be changed in config.py if required.
         This is a private function, indicated by the underscore before the name - do not change that!
         """
-        self.taskHandle = functions.TaskHandle(0)
-        functions.DAQmxCreateTask("",byref(self.taskHandle))
+        self.taskHandle = self.functions.TaskHandle(0)
+        self.functions.DAQmxCreateTask("",byref(self.taskHandle))
         self.vMin = 0.0
         self.vMax = 1.0
-        functions.DAQmxCreateAOVoltageChan(self.taskHandle, self.dev_name + self.out_pin, "", self.vMin, self.vMax, constants.DAQmx_Val_Volts, None)
-        functions.DAQmxCfgSampClkTiming(self.taskHandle, "", self.sampling_frequency, constants.DAQmx_Val_Rising, constants.DAQmx_Val_ContSamps, self.number_of_samples)
+        self.functions.DAQmxCreateAOVoltageChan(self.taskHandle, self.dev_name + self.out_pin, "", self.vMin, self.vMax, self.constants.DAQmx_Val_Volts, None)
+        self._set_timing()
+
+    def _set_timing(self, finite_samples = None):
+        """
+        Set the sample clock timing of the (stopped) Gain Voltage task
+        This is a private function, indicated by the underscore before the name - do not change that!
+
+        :param finite_samples: output this many samples once, rather than regenerating a number_of_samples buffer continuously
+        """
+        if finite_samples is None:
+            self.functions.DAQmxCfgSampClkTiming(self.taskHandle, "", self.sampling_frequency, self.constants.DAQmx_Val_Rising, self.constants.DAQmx_Val_ContSamps, self.number_of_samples)
+        else:
+            self.functions.DAQmxCfgSampClkTiming(self.taskHandle, "", self.sampling_frequency, self.constants.DAQmx_Val_Rising, self.constants.DAQmx_Val_FiniteSamps, finite_samples)
 
     def _start_output(self, voltage):
         """
         Start the Gain Voltage task using the parameters previously set up in the _set_up function, and a given output voltage
         This is a private function, indicated by the underscore before the name - do not change that!
         """
-        data = np.zeros(3000, dtype = numpy.float64)
-        for i in range(len(data)):
-            data[i] = voltage
-        functions.DAQmxWriteAnalogF64(self.taskHandle, 3000, 0, 10.0, constants, DAQmx_Val_GroupByChannel, data, None, None)
-        functions.DAQmxStartTask(self.taskHandle)
+        self._start_waveform(self.buffer.constant(voltage))
+
+    def _start_waveform(self, data):
+        """
+        Write a filled output buffer to the Gain Voltage task and start it
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.functions.DAQmxWriteAnalogF64(self.taskHandle, len(data), 0, 10.0, self.constants.DAQmx_Val_GroupByChannel, data, None, None)
+        self.functions.DAQmxStartTask(self.taskHandle)
+
+    def _update_output(self, data):
+        """
+        Output a new filled buffer on the persistent Gain Voltage task, creating the task first if it does not exist yet.
+        An existing task is only stopped, given the new output buffer and restarted - it is not re-created.
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        if self.taskHandle is None:
+            self._set_up()
+        else:
+            self.functions.DAQmxStopTask(self.taskHandle)
+        self._start_waveform(data)
 
     def _stop_output(self):
         """
         Stop the Gain Voltage task and clear the NI Unit's task memory
         This is a private function, indicated by the underscore before the name - do not change that!
         """
-        functions.DAQmxStopTask(self.taskHandle)
+        self.functions.DAQmxStopTask(self.taskHandle)
         #data = np.zeros(3000, dtype = numpy.float64)
-        #functions.DAQmxWriteAnalogF64(self.taskHandle, 3000, 0, 10.0, DAQmx_Val_GroupByChannel, data, None, None)
-        functions.DAQmxClearTask(self.taskHandle)
+        #self.functions.DAQmxWriteAnalogF64(self.taskHandle, 3000, 0, 10.0, DAQmx_Val_GroupByChannel, data, None, None)
+        self.functions.DAQmxClearTask(self.taskHandle)
+        self.taskHandle = None
     
     def current_state(self):
         """
@@ -91,6 +244,8 @@ class GainVoltageGenerator(object):
 
     def go_safe(self):
         """
-        Set the gain voltage to its safe value: 0V (i.e. the Gain Voltage at the PMT is = only the residual voltage)
+        Set the gain voltage to its safe value: 0V (i.e. the Gain Voltage at the PMT is = only the residual voltage), and tear down the output task
         """
-        self._start_output(0)
+        self._update_output(self.buffer.constant(0))
+        self.voltage = 0
+        self._stop_output()
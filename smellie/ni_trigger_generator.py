@@ -1,50 +1,239 @@
-import daqmx.functions
-import daqmx.constants
-from smellie_config import NI_DEV_NAME, TRIG_GEN_PIN_OUT, TRIG_GEN_HIGH_TIME, TRIG_GEN_FREQUENCY, TRIG_GEN_MINIMUM_LOW_TIME
+try:
+    from daqmx import functions, constants
+except (ImportError, OSError, IOError):
+    # the NI-DAQmx library is only needed to drive the real NI Unit, see :mod:`simulator`
+    functions = constants = None
+from daqmx.types import DAQmxDoneEventCallbackPtr
+from daqmx.call_back import create_callbackdata_id, get_callbackdata_from_id
+from tracing import traced
+from smellie_config import NI_DEV_NAME, TRIG_GEN_PIN_OUT, TRIG_GEN_HIGH_TIME, TRIG_GEN_FREQUENCY, TRIG_GEN_MINIMUM_LOW_TIME, TRIG_GEN_BURST_GAP
+from threading import Event, Lock
+from ctypes import byref
+import numpy
 
 """
 Generation of the SEPIA and SuperK trigger signals using the National Instruments (NI) Unit
 """
 
+class TriggerGeneratorLogicError(Exception):
+    """
+    Thrown if an inconsistency is noticed *before* any instructions are sent to the hardware (i.e. a problem with code logic)
+    """
+    pass
+
+class TriggerGeneratorHWError(Exception):
+    """
+    Thrown if an inconsistency is noticed *after* any hardware instruction is executed (i.e. a problem with the hardware itself)
+    """
+    pass
+
+def _done_event(task_handle, status, callback_data):
+    """
+    DAQmx Done event callback, called from an NI-DAQmx thread when a pulse train finishes.  callback_data identifies the :class:`TriggerGenerator` (see :mod:`daqmx.call_back`).
+    This is a private function, indicated by the underscore before the name - do not change that!
+    """
+    try:
+        generator = get_callbackdata_from_id(callback_data)
+    except KeyError:
+        # the generator has already been garbage collected
+        return 0
+    generator._burst_done(status)
+    return 0
+
+# The C function pointer registered for the Done event of every trigger task - it must live as long as the tasks do
+DONE_EVENT_CALLBACK = DAQmxDoneEventCallbackPtr(_done_event)
+
+def burst_pulse_times(pulse_counts, high_time, low_time, gap):
+    """
+    The high and low time of every pulse of a sequence of bursts sent back to back: the last low time of each burst but the last is stretched by gap
+
+    :param pulse_counts: the number of pulses in each burst
+
+    :param high_time: pulse high time, in seconds
+    :param low_time: pulse low time, in seconds
+    :param gap: extra time between bursts, in seconds
+
+    :returns: high times, low times
+    :type returns: (numpy.ndarray, numpy.ndarray) tuple
+    """
+    n_pulses = sum(pulse_counts)
+    high_times = numpy.empty(n_pulses, dtype = numpy.float64)
+    high_times.fill(high_time)
+    low_times = numpy.empty(n_pulses, dtype = numpy.float64)
+    low_times.fill(low_time)
+    low_times[numpy.cumsum(pulse_counts)[:-1] - 1] += gap
+    return high_times, low_times
+
 class TriggerGenerator(object):
     """
     Controls the SEPIA and SuperK trigger signals, as produced by the NI Unit via commands sent down a USB port.
+    The counter output task is created on first use and kept until :func:`close`; each pulse train only rewrites its pulse buffer.
+    Pulse trains start without blocking: completion is signalled by the task's Done event, which runs an optional callback - wait for it with :func:`wait_until_done`.
     """
-    def _setup(self):
+    def __init__(self, library = None):
         """
-        Set up the single-pulse parameters - the high time and the low time, and the digital output channel X to be used.
-        The channel string must be of the form `deviceName/digitalOutputPin`, i.e. `Dev1/Ctr0`.  /Ctr0 is used by default, but can be changed in config.py if required.
+        Set up the single-pulse parameters - the high time and the low time, and the counter output channel to be used.
+        The channel string must be of the form `deviceName/counterOutputPin`, i.e. `Dev1/Ctr0`.  /Ctr0 is used by default, but can be changed in config.py if required.
+
+        :param library: object providing the DAQmx functions and constants - by default :mod:`daqmx.functions` and :mod:`daqmx.constants`; :mod:`simulator` passes a :class:`daqmx.stand_in.StandInDAQmx`
         """
-        self.high_time = NI_HIGH_TIME
-        self.frequency = NI_FREQUENCY
-        self.low_time = (1.0 / self.frequency) - self.high_time
-        if self.low_time < NI_MINIMUM_LOW_TIME:
-            self.low_time = NI_MINIMUM_LOW_TIME
+        self.functions = functions if library is None else library
+        self.constants = constants if library is None else library
         self.dev_name = NI_DEV_NAME
         self.out_pin = TRIG_GEN_PIN_OUT
+        self.high_time = TRIG_GEN_HIGH_TIME
+        self.frequency = TRIG_GEN_FREQUENCY
+        self.low_time = max((1.0 / self.frequency) - self.high_time, TRIG_GEN_MINIMUM_LOW_TIME)
+        self.burst_gap = TRIG_GEN_BURST_GAP
+        self.taskHandle = None
+        self.pulse_counts = []
+        self.callback = None
+        self.status = 0
+        # set whenever no pulse train is running
+        self.done = Event()
+        self.done.set()
+        self.lock = Lock()
+        self.callback_id = create_callbackdata_id(self)
+
+    def _set_up(self):
+        """
+        Create the Trigger Generation task: a counter output pulse channel, with the Done event registered
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.taskHandle = self.functions.TaskHandle(0)
+        self.functions.DAQmxCreateTask("", byref(self.taskHandle))
+        self.functions.DAQmxCreateCOPulseChanTime(self.taskHandle, self.dev_name + self.out_pin, "", self.constants.DAQmx_Val_Seconds, self.constants.DAQmx_Val_Low, 0.0, self.low_time, self.high_time)
+        self.functions.DAQmxRegisterDoneEvent(self.taskHandle, 0, DONE_EVENT_CALLBACK, self.callback_id)
+
+    def _write_pulses(self, high_times, low_times):
+        """
+        Size the task for, and write, a buffer of pulses
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.functions.DAQmxCfgImplicitTiming(self.taskHandle, self.constants.DAQmx_Val_FiniteSamps, len(high_times))
+        self.functions.DAQmxWriteCtrTime(self.taskHandle, len(high_times), 0, 10.0, self.constants.DAQmx_Val_GroupByChannel, high_times, low_times, None, None)
 
-        self.taskHandle = functions.TaskHandle(0)
-        functions.DAQmxCreateTask("", byref(self.taskHandle))
-        functions.DAQmxCreateCOPulseChanTime(self.taskHandle, devName + self.trig_out_pin, "", constants.DAQmx_Val_seconds, constants.DAQmx_Val_Low, 0.0, self.low_time, self.high_time)
+    def _start_task(self):
+        """
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.functions.DAQmxStartTask(self.taskHandle)
 
-    def _cleanup(self):
+    def _stop_task(self):
         """
-        Wait until all n trigger pulses have been sent, and then stop the Trigger Generation task and clear the NI Unit's task memory.
+        This is a private function, indicated by the underscore before the name - do not change that!
         """
-        functions.DAQmxWaitUntillTaskDone(self.taskHandle, -1) # second argument needs checking
-        functions.DAQmxStopTask(self.taskHandle)
-        functions.DAQmxClearTask(self.taskHandle)
+        self.functions.DAQmxStopTask(self.taskHandle)
 
+    def _clear_task(self):
+        """
+        Clear the NI Unit's task memory
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.functions.DAQmxClearTask(self.taskHandle)
+        self.taskHandle = None
+
+    def _burst_done(self, status):
+        """
+        Called by the Done event: record the status, wake anyone waiting and run the callback
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        self.status = status
+        callback = self.callback
+        self.done.set()
+        if callback is not None:
+            callback(self.pulse_counts, status)
+
+    def start_bursts(self, pulse_counts, callback = None):
+        """
+        Start sending bursts of trigger pulses back to back, TRIG_GEN_BURST_GAP seconds apart (set in config.py), and return at once.
+        The whole sequence is written to the NI Unit as one buffer, so there is no task set up between bursts.
+
+        :param pulse_counts: the number of pulses in each burst
+        :type pulse_counts: list
+
+        :param callback: called as callback(pulse_counts, status) from an NI-DAQmx thread when the last pulse has been sent; status is a DAQmx error code if negative
+
+        :raises: :class:`.TriggerGeneratorLogicError` if a pulse count is not positive, or pulses are already being sent
+        """
+        if not pulse_counts or min(pulse_counts) < 1:
+            raise TriggerGeneratorLogicError("Cannot send trigger bursts of {0} pulses - each must be at least 1".format(pulse_counts))
+        with self.lock:
+            if not self.done.is_set():
+                raise TriggerGeneratorLogicError("Cannot start a trigger burst while another is running")
+            if self.taskHandle is None:
+                self._set_up()
+            else:
+                # a finished task must be stopped before it can be started again
+                self._stop_task()
+            self._write_pulses(*burst_pulse_times(pulse_counts, self.high_time, self.low_time, self.burst_gap))
+            self.pulse_counts = list(pulse_counts)
+            self.callback = callback
+            self.status = 0
+            self.done.clear()
+            try:
+                self._start_task()
+            except:
+                self.done.set()
+                raise
+
+    def start_triggers(self, n_pulses, callback = None):
+        """
+        Start sending n_pulses trigger pulses, and return at once (see :func:`start_bursts`)
+
+        :param n_pulses:
+
+        :param callback: called as callback([n_pulses], status) when the last pulse has been sent
+        """
+        self.start_bursts([n_pulses], callback)
+
+    def is_running(self):
+        """
+        :returns: True while a pulse train is being sent
+        """
+        return not self.done.is_set()
+
+    def wait_until_done(self, timeout = None):
+        """
+        Wait for the current pulse train to finish
+
+        :param timeout: maximum wait in seconds, or None to wait for as long as it takes
+
+        :returns: True if no pulse train is running, False if the timeout expired first
+
+        :raises: :class:`.TriggerGeneratorHWError` if the pulse train ended with a DAQmx error
+        """
+        if not self.done.wait(timeout):
+            return False
+        if self.status < 0:
+            raise TriggerGeneratorHWError("Trigger pulse train failed with DAQmx error {0}".format(self.status))
+        return True
+
+    def stop(self):
+        """
+        Stop sending pulses now, if any are being sent.  The callback is not run.
+        """
+        with self.lock:
+            if self.taskHandle is not None and not self.done.is_set():
+                self._stop_task()
+                self.callback = None
+                self.done.set()
+
+    @traced("trigger_generator.generate_triggers")
     def generate_triggers(self, n_pulses):
         """
-        Start the Trigger Generation task using the single-pulse parameters previously set up in the __enter__ function, and the requested number of pulses
+        Send n_pulses trigger pulses, returning when the last has been sent
 
         :param n_pulses:
         """
-        try:
-            self._setup()
-            functions.DaqmxCdfImplicitTiming(taskHandle, constants.DAQmx_Val_FiniteSamps, n_pulses)
-            functions.DAQmxStartTask(self.taskHandle)
+        self.start_triggers(n_pulses)
+        self.wait_until_done()
 
-        finally:
-            self._cleanup()
+    def close(self):
+        """
+        Stop sending pulses, and clear the Trigger Generation task
+        """
+        self.stop()
+        with self.lock:
+            if self.taskHandle is not None:
+                self._clear_task()
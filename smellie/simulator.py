@@ -0,0 +1,295 @@
+from smellie_config import SIMULATOR_LATENCY, SIMULATOR_SEED, RELAY_COM_CHANNEL, TRIG_GEN_FREQUENCY, TRIG_GEN_MINIMUM_LOW_TIME
+from laser_driver import LaserDriver
+from laser_switch import LaserSwitch, N_CHANNELS
+from fibre_switch import FibreSwitch, FibreSwitchConnection
+from ni_gain_control import GainVoltageGenerator
+from ni_trigger_generator import TriggerGenerator
+from devices import LASER_DRIVER, LASER_SWITCH, FIBRE_SWITCH, GAIN_VOLTAGE, TRIGGER
+from sepia.sepia import dll, load_dll
+from sepia.stand_in import StandInSepiaDLL
+from daqmx.stand_in import StandInDAQmx
+from serial import SerialException
+from random import Random
+from time import sleep, time
+
+"""
+Simulated SMELLIE hardware, so that a :class:`.SmellieController` can be run on a plain Linux box (SIMULATE_HARDWARE in config.py).
+The device classes themselves are the real ones - only what they talk to is simulated: the SEPIA .dll (:class:`sepia.stand_in.StandInSepiaDLL`), the Laser Switch's LabJack U12, the Fibre Switch's serial port and the NI Unit's DAQmx tasks.
+Each simulated part keeps real state and waits as the hardware would, according to a :class:`LatencyModel` set in SIMULATOR_LATENCY in config.py.
+"""
+
+class LatencyModel(object):
+    """
+    A simulated hardware delay: normally distributed about mean, with standard deviation jitter (both in seconds), and never negative.
+    Keeps the number and total of the delays it has produced.
+    """
+    def __init__(self, mean, jitter = 0, rng = None):
+        """
+        :param rng: the random.Random to draw delays from - share one seeded instance to reproduce a run
+        """
+        self.mean = mean
+        self.jitter = jitter
+        self.rng = Random() if rng is None else rng
+        self.count = 0
+        self.total = 0.0
+
+    def sample(self):
+        """
+        Draw a delay, without waiting for it
+
+        :returns: delay in seconds
+        """
+        delay = max(0.0, self.rng.gauss(self.mean, self.jitter)) if self.jitter else self.mean
+        self.count += 1
+        self.total += delay
+        return delay
+
+    def wait(self):
+        """
+        Draw a delay and sleep for it
+
+        :returns: delay in seconds
+        """
+        delay = self.sample()
+        sleep(delay)
+        return delay
+
+    def stats(self):
+        """
+        :returns: the number and total (in seconds) of delays produced so far
+        :type stats: dict
+        """
+        return {"count" : self.count, "total" : self.total}
+
+class SimulatedU12(object):
+    """
+    The LabJack U12 that :class:`.LaserSwitch` drives, with the Laser Switch on the other end.
+    A rising edge on the increment line (RELAY_COM_CHANNEL) steps the selected channel, which reads back on inputs 2 - 4.
+    A rising edge on line 0 moves the relay to the selected channel, which reads back on inputs 5 - 7 once the relay has settled; until then they read 7, an unphysical channel.
+    """
+    def __init__(self, call_latency, relay_settle, increment_line = RELAY_COM_CHANNEL):
+        """
+        :param call_latency: :class:`LatencyModel` of a single digital read or write
+
+        :param relay_settle: :class:`LatencyModel` of a relay move
+        """
+        self.call_latency = call_latency
+        self.relay_settle = relay_settle
+        self.increment_line = increment_line
+        self.levels = {}
+        self.selected = 0
+        self.active = 0
+        self.moving_to = None
+        self.settled_at = None
+        self.relay_moves = 0
+
+    def _rising_edge(self, line, state):
+        """
+        Set the level of an output line
+
+        :returns: True if this is a rising edge - lines idle high
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        rising = state == 1 and self.levels.get(line, 1) == 0
+        self.levels[line] = state
+        return rising
+
+    def _active_bits(self):
+        """
+        The active channel as read on inputs 5 - 7, finishing the relay move if it has had time to settle
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        if self.moving_to is not None:
+            if time() < self.settled_at:
+                return 7
+            self.active = self.moving_to
+            self.moving_to = None
+        return self.active
+
+    def eDigitalOut(self, channel, state, writeD = 0):
+        """
+        Set a digital output line, as LabJackPython's U12.eDigitalOut
+        """
+        self.call_latency.wait()
+        if not self._rising_edge(channel, state):
+            return
+        if channel == self.increment_line:
+            self.selected = (self.selected + 1) % N_CHANNELS
+        elif channel == 0:
+            self.moving_to = self.selected
+            self.settled_at = time() + self.relay_settle.sample()
+            self.relay_moves += 1
+
+    def eDigitalIn(self, channel, readD = 0):
+        """
+        Read a digital input line, as LabJackPython's U12.eDigitalIn
+
+        :returns: 0 or 1
+        """
+        self.call_latency.wait()
+        if 2 <= channel <= 4:
+            return (self.selected >> (channel - 2)) & 1
+        if 5 <= channel <= 7:
+            return (self._active_bits() >> (channel - 5)) & 1
+        return 0
+
+class SimulatedSerial(object):
+    """
+    The serial port that :class:`.FibreSwitchConnection` drives, with the Fibre Switch on the other end.
+    The switch understands `chN` (set the global channel to N), `ch?` and `firmware?`.  Each reply arrives one serial round trip after it is asked for, or not at all if that is longer than the port timeout.
+    """
+    FIRMWARE_VERSION = "simulated fibre switch 1.0"
+
+    def __init__(self, rtt):
+        """
+        :param rtt: :class:`LatencyModel` of a serial round trip
+        """
+        self.rtt = rtt
+        self.port = None
+        self.baudrate = None
+        self.timeout = None
+        self.is_open = False
+        self.channel = 0
+        self.replies = []
+        self.transactions = 0
+
+    def _check_open(self):
+        """
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        if not self.is_open:
+            raise SerialException("Attempting to use a port that is not open")
+
+    def isOpen(self):
+        return self.is_open
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self.replies = []
+
+    def flushInput(self):
+        self._check_open()
+        self.replies = []
+
+    def write(self, data):
+        """
+        Send one or more \\r\\n terminated commands to the simulated Fibre Switch, which acts on them at once.  One write is one transaction.
+        """
+        self._check_open()
+        self.transactions += 1
+        for command in data.split():
+            if command == "ch?":
+                self.replies.append(str(self.channel))
+            elif command == "firmware?":
+                self.replies.append(self.FIRMWARE_VERSION)
+            elif command.startswith("ch"):
+                try:
+                    self.channel = int(command[2:])
+                except ValueError:
+                    pass
+        return len(data)
+
+    def readline(self):
+        """
+        Wait for the next reply
+
+        :returns: the reply, followed by \\r\\n, or an empty string on timeout
+        """
+        self._check_open()
+        delay = self.rtt.sample()
+        if not self.replies or (self.timeout is not None and delay > self.timeout):
+            if self.timeout is not None:
+                sleep(self.timeout)
+            return ""
+        sleep(delay)
+        return self.replies.pop(0) + "\r\n"
+
+class SimulatedLaserDriver(LaserDriver):
+    """
+    :class:`.LaserDriver` running on the stand-in SEPIA .dll, with every .dll call taking one simulated USB round trip
+    """
+    def __init__(self, call_latency):
+        """
+        :param call_latency: :class:`LatencyModel` of a single .dll call
+        """
+        super(SimulatedLaserDriver, self).__init__()
+        self.call_latency = call_latency
+
+    def open_connection(self):
+        """
+        Load the stand-in .dll, unless it is already loaded, and open the USB connection to it
+        """
+        if not isinstance(dll.library, StandInSepiaDLL):
+            load_dll(stand_in = True)
+        dll.library.latency = self.call_latency
+        super(SimulatedLaserDriver, self).open_connection()
+
+class SimulatedGainVoltageGenerator(GainVoltageGenerator):
+    """
+    :class:`.GainVoltageGenerator` running its DAQmx output task on the stand-in DAQmx library: creating a task takes a simulated task setup time, and the task keeps a copy of the last output buffer written to it
+    """
+    def __init__(self, task_setup):
+        """
+        :param task_setup: :class:`LatencyModel` of creating and configuring a DAQmx task
+        """
+        self.daqmx = StandInDAQmx(task_setup)
+        super(SimulatedGainVoltageGenerator, self).__init__(self.daqmx)
+
+class SimulatedTriggerGenerator(TriggerGenerator):
+    """
+    :class:`.TriggerGenerator` running its DAQmx counter task on the stand-in DAQmx library: setting it up takes a simulated task setup time, and each pulse train lasts as long as its pulses, after which the Done event fires from a timer thread
+    """
+    def __init__(self, task_setup, frequency = TRIG_GEN_FREQUENCY):
+        """
+        :param task_setup: :class:`LatencyModel` of creating and configuring a DAQmx task
+
+        :param frequency: trigger frequency in Hz
+        """
+        self.daqmx = StandInDAQmx(task_setup)
+        super(SimulatedTriggerGenerator, self).__init__(self.daqmx)
+        self.frequency = frequency
+        self.low_time = max((1.0 / frequency) - self.high_time, TRIG_GEN_MINIMUM_LOW_TIME)
+
+def simulated_devices(latency = None, seed = SIMULATOR_SEED):
+    """
+    Build a full set of simulated SMELLIE hardware
+
+    :param latency: {name : (mean, jitter)} overriding entries of SIMULATOR_LATENCY in config.py
+
+    :param seed: seed for the simulated delays, or None for a different run each time
+
+    :returns: {device name : device}, keyed by the names in :mod:`devices`
+    """
+    settings = dict(SIMULATOR_LATENCY)
+    if latency is not None:
+        settings.update(latency)
+    rng = Random(seed)
+    # every device gets its own models, so that its delays can be totalled separately
+    model = lambda name: LatencyModel(settings[name][0], settings[name][1], rng)
+    return {LASER_DRIVER : SimulatedLaserDriver(model("usb_call")),
+            LASER_SWITCH : LaserSwitch(SimulatedU12(model("u12_call"), model("relay_settle"))),
+            FIBRE_SWITCH : FibreSwitch(FibreSwitchConnection(serial = SimulatedSerial(model("serial_rtt")))),
+            GAIN_VOLTAGE : SimulatedGainVoltageGenerator(model("daqmx_task_setup")),
+            TRIGGER : SimulatedTriggerGenerator(model("daqmx_task_setup"))}
+
+def simulator_stats(devices):
+    """
+    How much each simulated device has talked to its hardware: the number of transactions (SEPIA .dll calls, U12 reads and writes, serial commands, DAQmx buffer writes and pulse train starts) and the total simulated hardware time
+
+    :param devices: {device name : device}, as made by :func:`simulated_devices`
+
+    :returns: {device name : {"transactions" : n, "simulated_time" : seconds}}
+    """
+    laser_driver = devices[LASER_DRIVER]
+    u12 = devices[LASER_SWITCH].connection
+    serial = devices[FIBRE_SWITCH].connection.serial
+    gain_voltage = devices[GAIN_VOLTAGE].daqmx
+    trigger = devices[TRIGGER].daqmx
+    return {LASER_DRIVER : {"transactions" : laser_driver.call_latency.count, "simulated_time" : laser_driver.call_latency.total},
+            LASER_SWITCH : {"transactions" : u12.call_latency.count, "simulated_time" : u12.call_latency.total + u12.relay_settle.total},
+            FIBRE_SWITCH : {"transactions" : serial.transactions, "simulated_time" : serial.rtt.total},
+            GAIN_VOLTAGE : {"transactions" : gain_voltage.writes, "simulated_time" : gain_voltage.task_setup.total},
+            TRIGGER : {"transactions" : trigger.starts, "simulated_time" : trigger.task_setup.total + trigger.pulse_time}}
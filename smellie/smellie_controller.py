@@ -3,48 +3,167 @@ from laser_switch import LaserSwitch
 from fibre_switch import FibreSwitch
 from ni_trigger_generator import TriggerGenerator
 from ni_gain_control import GainVoltageGenerator
+from calibration_plan import build_grid, CalibrationPlanExecutor
+from state_cache import DeviceStateCache, LASER_SWITCH_CHANNEL, FIBRE_SWITCH_CHANNEL, LASER_INTENSITY
+from fibre_switch import find_global_channel_number
+from simulator import simulated_devices
+from devices import uses_devices, stops_runs, ALL_DEVICES, LASER_DRIVER, LASER_SWITCH, FIBRE_SWITCH, GAIN_VOLTAGE, TRIGGER
 import system_state
 import smellie_config
-from time import sleep
+from threading import Event, Lock
+from contextlib import contextmanager
+from datetime import datetime
 
 class SmellieController(object):    
+    def __init__(self, simulate = None):
+        """
+        :param simulate: run on simulated hardware (see :mod:`simulator`) - by default, as set by SIMULATE_HARDWARE in config.py
+        """
+        self.simulate = smellie_config.SIMULATE_HARDWARE if simulate is None else simulate
+        # the stop events of the runs in progress, all set by stop_run to end them early
+        self.run_stops = set()
+        self.run_stops_lock = Lock()
+        self.state = DeviceStateCache()
+
     def __enter__(self):
         """
         Open the SMELLIE Controller, with all hardware in deactivated mode
         """        
-        self.fibre_switch = FibreSwitch()              
-        self.laser_switch = LaserSwitch()              
-        self.gain_voltage = GainVoltageGenerator()
-        self.trig_signals = TriggerGenerator()
-        self.laser_driver = LaserDriver()
+        devices = self._make_devices()
+        self.fibre_switch = devices[FIBRE_SWITCH]
+        self.fibre_switch.open_connection()
+        self.laser_switch = devices[LASER_SWITCH]
+        self.gain_voltage = devices[GAIN_VOLTAGE]
+        self.trig_signals = devices[TRIGGER]
+        self.laser_driver = devices[LASER_DRIVER]
         self.laser_driver.open_connection()            
         self.deactivate()                              
+        return self
 
     def __exit__(self, type, value, traceback):
         """
         Clean up code goes here - it is guaranteed to get called even if an exception is thrown during one of the other functions
         """
         self.deactivate()
+        self.trig_signals.close()
         self.laser_driver.close_connection()
+        self.fibre_switch.close_connection()
+
+    def _make_devices(self):
+        """
+        Construct the hardware devices, or simulated ones if simulate is set
+        This is a private function, indicated by the underscore before the name - do not change that!
 
+        :returns: {device name : device}, keyed by the names in :mod:`devices`
+        """
+        if self.simulate:
+            return simulated_devices()
+        devices = {}
+        devices[FIBRE_SWITCH] = FibreSwitch()
+        devices[LASER_SWITCH] = LaserSwitch()
+        devices[GAIN_VOLTAGE] = GainVoltageGenerator()
+        devices[TRIGGER] = TriggerGenerator()
+        devices[LASER_DRIVER] = LaserDriver()
+        return devices
+
+    @stops_runs
+    @uses_devices(LASER_DRIVER)
     def go_safe(self):
         """
         Send the entire SMELLIE system into `safe mode` - SEPIA soft-lock = on, SEPIA intensity = 0%
+        Called over the server, this first stops any run in progress, rather than waiting for it to end.
         """		
-        self.laser_driver.go_safe()
+        try:
+            self.laser_driver.go_safe()
+        except:
+            self.state.invalidate(LASER_INTENSITY)
+            raise
+        self.state.record(LASER_INTENSITY, 0)
         return 0
 
-    def deactivate(self):
+    def stop_run(self):
+        """
+        Ask every running slave mode run, master mode run or calibration plan to finish now, rather than at the end of its time or pulses.  This holds no device locks, so it can be called while the run is in progress.
+        """
+        with self.run_stops_lock:
+            for stop in self.run_stops:
+                stop.set()
+        return 0
+
+    @contextmanager
+    def _run_stop(self, stop_event = None):
+        """
+        Register the stop event of a run for :func:`stop_run`, for the duration of the run
+        This is a private function, indicated by the underscore before the name - do not change that!
+
+        :param stop_event: the run's own stop event, e.g. a job's cancel event (see :mod:`server.jobs`) - by default a new one
+
+        :returns: the stop event, which is set when the run should finish
+        """
+        stop = Event() if stop_event is None else stop_event
+        with self.run_stops_lock:
+            self.run_stops.add(stop)
+        try:
+            yield stop
+        finally:
+            with self.run_stops_lock:
+                self.run_stops.discard(stop)
+
+    @stops_runs
+    @uses_devices(*ALL_DEVICES)
+    def deactivate(self, force = False):
         """
         Send the entire SMELLIE system into `deactivated mode` - SEPIA soft-lock = on, SEPIA intensity = 0%, NI gain voltage = 0V, active Laser Switch channel = 0 (no laser head attached to this channel), Fibre Switch input channel = 5 and output channel = 14 (no detector fibre attached to this output channel)
+        The switches are only written to if the state cache does not already show them in place.
+        Called over the server, this first stops any run in progress, rather than waiting for it to end.
+
+        :param force: write the switch settings even if the state cache shows them in place
         """
         self.go_safe()
         self.gain_voltage.go_safe()
-        self.laser_switch.set_active_channel(0)
-        self.fibre_switch.set_io_channel_numbers(5, 14)
+        self._set_laser_switch_channel(0, force)
+        self._set_fibre_switch_channels(5, 14, force)
+        return 0
+
+    def _set_laser_switch_channel(self, channel, force = False):
+        """
+        Set the active Laser Switch channel, unless the state cache shows it is already active
+
+        :returns: True if the hardware was written to
+        """
+        return self.state.write_through(LASER_SWITCH_CHANNEL, channel, lambda: self.laser_switch.set_active_channel(channel), force)
+
+    def _set_fibre_switch_channels(self, in_channel, out_channel, force = False):
+        """
+        Set the Fibre Switch channel, unless the state cache shows it is already set
+
+        :returns: True if the hardware was written to
+        """
+        return self.state.write_through(FIBRE_SWITCH_CHANNEL, find_global_channel_number(in_channel, out_channel), lambda: self.fibre_switch.set_io_channel_numbers(in_channel, out_channel), force)
+
+    def _set_intensity(self, intensity, force = False):
+        """
+        Set the laser intensity, unless the state cache shows it is already set
+
+        :returns: True if the hardware was written to
+        """
+        return self.state.write_through(LASER_INTENSITY, intensity, lambda: self.laser_driver.set_intensity(intensity), force)
+
+    def state_cache_stats(self):
+        """
+        Return the number of hardware writes skipped (hits) and made (misses) by the state cache, and the cached values
+        """
+        return self.state.stats()
+
+    def refresh_state_cache(self):
+        """
+        Forget all cached hardware state, so the next setting of every device goes to the hardware
+        """
+        self.state.invalidate()
         return 0
 
-    def laserheads_master_mode(self, ls_chan, intensity, fs_input_chan, fs_output_chan, n_pulses):
+    @uses_devices(LASER_SWITCH, LASER_DRIVER, FIBRE_SWITCH, TRIGGER)
+    def laserheads_master_mode(self, ls_chan, intensity, fs_input_chan, fs_output_chan, n_pulses, stop_event = None):
         """
         Run the SMELLIE system in Master Mode (NI Unit provides the trigger signal for both the lasers and the detector) using the PicoQuant Laser Heads
         
@@ -56,16 +175,42 @@ class SmellieController(object):
 
         :param fs_output_channel: the fibre switch output channel
 
-        :param n_pulses: the number of pulses
+        :param n_pulses: the number of pulses, unless :func:`stop_run` is called (or stop_event is set) first
+
+        :param stop_event: optional Event which ends the run early when set
         """
-        self.laser_switch.set_active_channel(ls_chan)
-        self.laser_driver.set_intensity(intensity)
-        self.fibre_switch.set_io_channel_numbers(fs_input_chan, fs_output_chan)
-        self.trig_signals.generate_triggers(n_pulses)
-        self.go_safe()
+        with self._run_stop(stop_event) as stop:
+            self._set_laser_switch_channel(ls_chan)
+            self._set_intensity(intensity)
+            self._set_fibre_switch_channels(fs_input_chan, fs_output_chan)
+            try:
+                self._fire_triggers([n_pulses], stop)
+            finally:
+                self.go_safe()
         return 0
 
-    def laserheads_slave_mode(self, ls_chan, intensity, fs_input_chan, fs_output_chan, time):
+    def _fire_triggers(self, pulse_counts, stop):
+        """
+        Send bursts of trigger pulses, one pulse train on the NI Unit, and wait for the last pulse or for the run's stop event, which stops the pulses
+        This is a private function, indicated by the underscore before the name - do not change that!
+
+        :param pulse_counts: the number of pulses in each burst
+
+        :param stop: the run's stop event (see :func:`_run_stop`)
+
+        :returns: True if every pulse was sent, False if the train was stopped (or the run was stopped before it started)
+        """
+        if stop.is_set():
+            return False
+        self.trig_signals.start_bursts(pulse_counts)
+        while not self.trig_signals.wait_until_done(smellie_config.TRIG_GEN_STOP_POLL):
+            if stop.is_set():
+                self.trig_signals.stop()
+                return False
+        return True
+
+    @uses_devices(LASER_SWITCH, LASER_DRIVER, FIBRE_SWITCH)
+    def laserheads_slave_mode(self, ls_chan, intensity, fs_input_chan, fs_output_chan, time, stop_event = None):
         """
         Run the SMELLIE system in Slave Mode (SNO+ MTC/D provides the trigger signal for both the lasers and the detector) using the PicoQuant Laser Heads
 
@@ -79,21 +224,49 @@ class SmellieController(object):
 
         :param n_pulses: the number of pulses
         
-        :param time: time until SNODROP exits slave mode
+        :param time: time until SNODROP exits slave mode, unless :func:`stop_run` is called (or stop_event is set) first
+
+        :param stop_event: optional Event which ends the run early when set
         """
-        self.laser_switch.set_active_channel(ls_chan)
-        self.laser_driver.set_intensity(intensity)
-        self.fibre_switch.set_io_channel_numbers(fs_input_chan, fs_output_chan)
-        sleep(time)
-        self.go_safe()
+        with self._run_stop(stop_event) as stop:
+            self._set_laser_switch_channel(ls_chan)
+            self._set_intensity(intensity)
+            self._set_fibre_switch_channels(fs_input_chan, fs_output_chan)
+            stop.wait(time)
+            self.go_safe()
         return 0
 
+    @uses_devices(LASER_SWITCH, LASER_DRIVER, FIBRE_SWITCH, TRIGGER)
+    def run_calibration_plan(self, ls_chans, intensities, fs_chans, n_pulses, reorder = True, stop_event = None):
+        """
+        Run a full calibration grid in Master Mode using the PicoQuant Laser Heads: every combination of the given laser switch channels, intensities, fibre switch channels and pulse counts.
+        The grid is reordered to minimise laser switch and fibre switch changes, and a device is only written to when its setting changes (see :mod:`calibration_plan`).
+        Consecutive points with the same settings go to the NI Unit as one multi-burst pulse train.  :func:`stop_run` cuts the current pulse train short and ends the plan.
+
+        :param ls_chans: list of laser switch channels
+
+        :param intensities: list of laser intensities in per mil
+
+        :param fs_chans: list of [input channel, output channel] fibre switch pairs
+
+        :param n_pulses: list of pulse counts
+
+        :param reorder: reorder the grid before running it
+
+        :param stop_event: optional Event which ends the plan early when set
+
+        :returns: report of estimated and actual plan duration, and the number of hardware changes made
+        """
+        with self._run_stop(stop_event) as stop:
+            return CalibrationPlanExecutor(self).run(build_grid(ls_chans, intensities, fs_chans, n_pulses), reorder, stop)
+
     def superK_master_mode(): # incomplete function!!
         """
         Run the SMELLIE system in Master Mode (NI Unit provides the trigger signal for both the lasers and the detector) using the SuperK Supercontinuum laser
         """
         return 0
 
+    @uses_devices(GAIN_VOLTAGE)
     def set_gain_control(self, voltage):
         """
         Set the Gain Voltage of the MPU's PMT ... applicable to both Master and Slave modes and both the Laser Heads and the SuperK laser
@@ -103,6 +276,18 @@ class SmellieController(object):
         self.gain_voltage.generate_voltage(voltage)
         return 0
 
+    @uses_devices(GAIN_VOLTAGE)
+    def step_gain_control(self, voltages, dwell_time):
+        """
+        Step the Gain Voltage of the MPU's PMT through a list of values, holding each for dwell_time seconds
+
+        :param voltages: list of PMU gain voltage set values
+
+        :param dwell_time: time to hold each voltage, in seconds
+        """
+        self.gain_voltage.step_voltages(voltages, dwell_time)
+        return 0
+
     def log_info(self):
         # pipe info return into logger
         pass
@@ -114,35 +299,48 @@ class SmellieController(object):
         :param dummy_mode_on: True for dummy mode/False for normal functioning
         '''
         smellie_config.DUMMY_MODE = dummy_mode_on
+        system_state.provenance.verify()
         return 0
 
     def info(self):
         pass
 
+    def provenance(self):
+        '''
+        The git SHA, dirty flag and configuration of the running software, from the snapshot kept by :data:`system_state.provenance`
+
+        :returns: {"sha", "dirty", "config", "refreshed", "verified"[, "error"]}, times in seconds since the epoch
+        :type returns: dict
+        '''
+        return system_state.provenance.snapshot()
+
     def system_state(self):
         '''
         Return a formatted string with the current system settings
         '''
+        provenance = system_state.provenance.snapshot()
         return ''' SMELLIE git SHA: {0}
 git repository dirty : {1}
+provenance last verified : {2}
 
 CONFIGURATION:
-{2}
+{3}
 
 LASER DRIVER:
-{3}
+{4}
 
 LASER SWITCH:
-{4}
+{5}
 
 FIBRE SWITCH:
-{5}
+{6}
 
 GAIN CONTROL:
-{6}
-'''.format(system_state.get_SHA(),
-           True if system_state.git_is_dirty() else False,
-           system_state.get_config_str(),
+{7}
+'''.format(provenance["sha"],
+           provenance["dirty"],
+           datetime.utcfromtimestamp(provenance["verified"]).isoformat(),
+           provenance["config"],
            self.laser_driver.current_state(),
            self.laser_switch.current_state(),
            self.fibre_switch.current_state(),
@@ -0,0 +1,109 @@
+from smellie_config import STATE_CACHE_MAX_AGE
+from threading import Lock
+from time import time
+
+"""
+Write-through cache of the last known hardware state, so that the SMELLIE controller can skip device I/O that would not change anything
+"""
+
+# Cache keys
+LASER_SWITCH_CHANNEL = "laser_switch_channel"
+FIBRE_SWITCH_CHANNEL = "fibre_switch_channel"
+LASER_INTENSITY      = "laser_intensity"
+
+class DeviceStateCache(object):
+    """
+    Last known value of each piece of hardware state, recorded only from confirmed reads and successful writes.
+    Values older than max_age seconds (STATE_CACHE_MAX_AGE in config.py) are treated as unknown.
+    """
+    def __init__(self, max_age = STATE_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def lookup(self, key):
+        """
+        :param key: the piece of state
+
+        :returns: the cached value, or None if it is unknown or stale
+        """
+        with self.lock:
+            if key in self.values:
+                value, recorded = self.values[key]
+                if time() - recorded <= self.max_age:
+                    return value
+        return None
+
+    def record(self, key, value):
+        """
+        Record a confirmed value
+
+        :param key: the piece of state
+        :param value: its value
+        """
+        with self.lock:
+            self.values[key] = (value, time())
+
+    def invalidate(self, key = None):
+        """
+        Forget a value, so the next write to it goes to the hardware
+
+        :param key: the piece of state, or None to forget everything
+        """
+        with self.lock:
+            if key is None:
+                self.values.clear()
+            else:
+                self.values.pop(key, None)
+
+    def write_through(self, key, value, write, force = False):
+        """
+        Call write() to set the hardware, unless the cache says it is already at value.
+        The value is recorded if the write succeeds and forgotten if it fails.
+
+        :param key: the piece of state
+        :param value: the requested value
+        :param write: function taking no arguments that sets the hardware to value
+        :param force: write even if the cached value matches
+
+        :returns: True if the hardware was written to
+        :type written: bool
+        """
+        if not force and self.lookup(key) == value:
+            with self.lock:
+                self.hits += 1
+            return False
+        with self.lock:
+            self.misses += 1
+        try:
+            write()
+        except:
+            self.invalidate(key)
+            raise
+        self.record(key, value)
+        return True
+
+    def known_value(self, key, read):
+        """
+        The cached value, or if it is unknown, read it from the hardware and record it
+
+        :param key: the piece of state
+        :param read: function taking no arguments that reads the value from the hardware
+        """
+        value = self.lookup(key)
+        if value is None:
+            value = read()
+            self.record(key, value)
+        return value
+
+    def stats(self):
+        """
+        :returns: dictionary with the number of writes skipped ('hits'), the number made ('misses') and the currently cached values
+        """
+        with self.lock:
+            return {"hits" : self.hits,
+                    "misses" : self.misses,
+                    "max_age" : self.max_age,
+                    "values" : dict((k, v) for (k, (v, recorded)) in self.values.iteritems())}
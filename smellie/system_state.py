@@ -1,22 +1,158 @@
-from subprocess import check_output
+from subprocess import check_output, CalledProcessError
+from smellie_config import PROVENANCE_REFRESH_PERIOD
+from threading import Thread, Event, Lock
+from time import time
 import smellie_config
 import os
 
-def get_SHA():
+"""
+Provenance of the running SMELLIE software: its git SHA, whether the repository has uncommitted changes, and the configuration.
+Finding these forks git, so :data:`provenance` keeps a snapshot taken once at startup, which an optional background refresher re-verifies
+every PROVENANCE_REFRESH_PERIOD seconds (set in config.py) - git is only run again when one of the repository's files has changed.
+"""
+
+# The top directory of the repository, where config.py lives
+REPO_ROOT = os.path.dirname(os.path.abspath(smellie_config.__file__))
+
+def get_SHA(root = REPO_ROOT):
     """
     Returns the current git SHA of the SMELLIE software
     """
-    return check_output(["git", "describe", "--always", "--tag"]).strip()
+    return check_output(["git", "describe", "--always", "--tag"], cwd = root).strip()
 
-def git_is_dirty():
+def git_is_dirty(root = REPO_ROOT):
     '''
     Are there any uncommited changes in the repository?
     '''
-    return True if check_output(["git", "status", "--porcelain"]) else False
+    return True if check_output(["git", "status", "--porcelain"], cwd = root) else False
+
+def git_tracked_files(root = REPO_ROOT):
+    '''
+    The paths of every file git tracks in the repository
+    '''
+    return [os.path.join(root, path) for path in check_output(["git", "ls-files"], cwd = root).splitlines()]
 
 def get_config_str():
     '''
     Reads the config.py module (located one folder-level up from this file) into a string
     '''
-    return "\n".join("{0} : {1}".format(k, v) for (k, v) in config.__dict__.iteritems() if not k.startswith("__"))
+    return "\n".join("{0} : {1}".format(k, v) for (k, v) in sorted(smellie_config.__dict__.iteritems()) if not k.startswith("__"))
+
+def modification_times(paths):
+    '''
+    :returns: {path : modification time, or None if it does not exist}
+    '''
+    times = {}
+    for path in paths:
+        try:
+            times[path] = os.stat(path).st_mtime
+        except OSError:
+            times[path] = None
+    return times
+
+class Provenance(object):
+    '''
+    A snapshot of the software's git SHA, dirty flag and configuration, with the times it was last taken and last verified.
+    Verifying checks the modification times of the git HEAD and index, and of every tracked file and its directory, which costs no process forks; git is only run again if one has changed.
+    '''
+    def __init__(self, root = REPO_ROOT):
+        self.root = root
+        self.lock = Lock()
+        self.current = None
+        self.watched = {}
+        self.stop_refreshing = Event()
+        self.refresher = None
+
+    def _watched_paths(self, tracked):
+        '''
+        This is a private function, indicated by the underscore before the name - do not change that!
+        '''
+        paths = set([os.path.join(self.root, ".git", "HEAD"), os.path.join(self.root, ".git", "index")])
+        paths.update(tracked)
+        paths.update(os.path.dirname(path) for path in tracked)
+        return sorted(paths)
+
+    def refresh(self):
+        '''
+        Take a new snapshot, running git
+
+        :returns: the snapshot, see :func:`snapshot`
+        '''
+        now = time()
+        current = {"config" : get_config_str(), "refreshed" : now, "verified" : now}
+        try:
+            current["sha"] = get_SHA(self.root)
+            current["dirty"] = git_is_dirty(self.root)
+            tracked = git_tracked_files(self.root)
+        except (CalledProcessError, OSError) as e:
+            # not a git checkout, or no git: the provenance is unknown, so it is not claimed clean
+            current.update(sha = "unknown", dirty = True, error = str(e))
+            tracked = []
+        watched = modification_times(self._watched_paths(tracked))
+        with self.lock:
+            self.current = current
+            self.watched = watched
+        return dict(current)
+
+    def verify(self):
+        '''
+        Check the snapshot is still right, taking a new one if any watched file has changed.  The configuration is re-read either way, as it can be changed at run time.
+
+        :returns: the snapshot, see :func:`snapshot`
+        '''
+        with self.lock:
+            current = self.current
+            watched = self.watched
+        if current is None or modification_times(watched) != watched:
+            return self.refresh()
+        with self.lock:
+            self.current = dict(current, config = get_config_str(), verified = time())
+            return dict(self.current)
+
+    def snapshot(self):
+        '''
+        The provenance, taking the snapshot on first use
+
+        :returns: {"sha", "dirty", "config", "refreshed" : time of the last git run, "verified" : time last checked[, "error" : why git could not be run]}
+        :type returns: dict
+        '''
+        with self.lock:
+            current = self.current
+        if current is None:
+            return self.refresh()
+        return dict(current)
+
+    def _refresh_loop(self, period):
+        '''
+        This is a private function, indicated by the underscore before the name - do not change that!
+        '''
+        while not self.stop_refreshing.wait(period):
+            self.verify()
+
+    def start_refresher(self, period = PROVENANCE_REFRESH_PERIOD):
+        '''
+        Take the snapshot now, and verify it every period seconds in a background thread
+
+        :param period: seconds between checks - the refresher is not started if this is not positive
+        '''
+        self.snapshot()
+        if period <= 0 or self.refresher is not None:
+            return
+        self.stop_refreshing.clear()
+        self.refresher = Thread(target = self._refresh_loop, args = (period,), name = "provenance-refresher")
+        self.refresher.daemon = True
+        self.refresher.start()
+
+    def stop_refresher(self):
+        '''
+        Stop the background refresher, if it is running
+        '''
+        if self.refresher is not None:
+            self.stop_refreshing.set()
+            self.refresher.join()
+            self.refresher = None
 
+"""
+The provenance of this copy of the software, shared by the controller and the benchmarks
+"""
+provenance = Provenance()
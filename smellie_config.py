@@ -2,13 +2,41 @@
 DUMMY_MODE = False
 
 # SEPIA Laser Driver
-SEPIA_DLL_PATH        = "C:\Users\LocalAdmin\Desktop\Pysepia\Sepia2_Lib.dll"
+SEPIA_DLL_PATH        = "C:\Users\LocalAdmin\Desktop\Pysepia\Sepia2_Lib.dll"  # the .so on Linux
+SEPIA_DLL_STAND_IN    = False  # use the pure-python stand-in .dll (sepia/stand_in.py) instead of SEPIA_DLL_PATH
 SEPIA_STR_BUFFER_SIZE = 128  # must be at minimum = 64 bytes
+SEPIA_PREFILL_DECODE_TABLES = True  # decode every frequency mode and head type when the connection opens, rather than on first use
 LASER_DRIVER_DEV_ID   = 0
 LASER_DRIVER_SLOT_ID  = 200
+LASER_DRIVER_STATUS_MAX_AGE = 1.0  # re-poll the laser driver status snapshot when older than this, in seconds
 
 # Smellie Controller Server
 PORT = 5020
+SERVER_THREADED = True  # handle requests concurrently, serialising calls per hardware device
+JOB_WORKERS = 1  # number of background jobs (see server/jobs.py) that may run at once
+JOB_HISTORY = 100  # number of jobs remembered for polling
+STATE_CACHE_MAX_AGE = 600  # trust the last known hardware state for this long, in seconds
+METRICS_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 60, 600)  # upper bounds of the per-method call latency histogram buckets, in seconds
+METRICS_MAX_METHODS = 100  # number of methods the server keeps separate call metrics for
+METRICS_SCRAPE_PATH = "/metrics"  # serve the call metrics as plain text on an HTTP GET of this path; None to disable
+JSON_RPC_PORT = 5022  # also serve the controller as JSON over kept-open HTTP/1.1 connections on this port (see server/json_rpc.py); None to disable
+JSON_RPC_PATH = "/json"  # the path JSON calls are POSTed to
+TRACING_ENABLED = False  # record a trace of the device operations made by each controller call (see tracing.py); can be switched on over the server
+TRACE_BUFFER_SIZE = 200  # number of completed traces kept
+TRACE_FILE = "traces.jsonl"  # write_traces appends the traces here, relative to this file
+PROVENANCE_REFRESH_PERIOD = 60  # re-verify the git SHA, dirty flag and config reported by system_state this often, in seconds; 0 to take them once at startup
+
+# Hardware simulator (see smellie/simulator.py)
+SIMULATE_HARDWARE = False  # run the controller on simulated devices - no hardware, or hardware libraries, needed
+SIMULATOR_SEED    = None  # seed for the simulated latencies, so a run can be reproduced; None for a different run each time
+SIMULATOR_LATENCY = {"usb_call"         : (0.002, 0.0005),  # one SEPIA .dll call over USB
+                     "u12_call"         : (0.004, 0.001),  # one LabJack U12 digital read or write
+                     "relay_settle"     : (5.0, 1.0),  # Laser Switch relay move, after the execute pulse - RELAY_SLEEP is the upper bound on this
+                     "serial_rtt"       : (0.02, 0.005),  # Fibre Switch serial round trip
+                     "daqmx_task_setup" : (0.05, 0.01)}  # creating and configuring a DAQmx task
+                     # each is (mean, jitter) in seconds; the pulse train itself lasts n_pulses / TRIG_GEN_FREQUENCY
+BENCHMARK_RESULTS_FILE = "benchmark_results.jsonl"  # bin/run_benchmarks appends its results here, relative to this file
+RPC_BENCHMARK_RESULTS_FILE = "rpc_benchmark_results.jsonl"  # bin/run_rpc_benchmark appends its results here, relative to this file
 
 # Logging Server
 LOGGER_PORT = 0
@@ -16,26 +44,40 @@ LOGGER_PORT = 0
 # Fibre Switch 
 FIBRE_SWITCH_SERIAL_PORT = 0
 FIBRE_SWITCH_BAUD_RATE   = 57600
-FIBRE_SWITCH_WAIT_TIME   = 0.1  # in seconds
+FIBRE_SWITCH_WAIT_TIME   = 0.1  # read-back timeout, in seconds
+FIBRE_SWITCH_RECONNECT_ATTEMPTS = 2  # re-open the serial port this many times on error before giving up
 
 # Interlock
 INTERLOCK_SERIAL_PORT      = 3  # = COM4
 INTERLOCK_BAUD_RATE = 57600
 INTERLOCK_SERVER_PORT = 80
+INTERLOCK_PULSE_PERIOD = 0.01  # time between keep alive pulses, in seconds - must be well inside the interlock's timeout
+INTERLOCK_JITTER_BUDGET = 0.005  # a pulse later than this after its deadline is reported as missed, in seconds
+INTERLOCK_REPORT_PERIOD = 60  # bin/local_interlock and bin/run_interlock_server print their pulse rate and missed deadlines this often, in seconds; 0 for never
+INTERLOCK_HEARTBEAT_PORT = 5021  # bin/run_interlock_server listens for heartbeat streams on this port (its XML-RPC statistics are on INTERLOCK_SERVER_PORT)
+INTERLOCK_HEARTBEAT_PERIOD = 0.05  # time between a client's heartbeats, in seconds
+INTERLOCK_HEARTBEAT_TIMEOUT = 0.5  # the interlock server stops pulsing, and drops the stream, if a client is silent for this long, in seconds
 
 # Laser Switch
 RELAY_COM_CHANNEL = 1
-RELAY_SLEEP       = 30  # in seconds
+RELAY_SLEEP       = 30  # in seconds - fixed wait, or the upper bound on the wait if RELAY_ADAPTIVE_SETTLE is True
+RELAY_ADAPTIVE_SETTLE = True  # poll the active channel and return as soon as the relay has settled
+RELAY_POLL_PERIOD     = 0.1  # time between polls of the active channel, in seconds
+RELAY_SETTLE_DWELL    = 1.0  # the active channel must be stable for this long to count as settled, in seconds
+RELAY_SETTLE_HISTORY  = 100  # number of observed settle times to keep
 
 # NI Unit - Gain Control and Trigger Generator
 NI_DEV_NAME               = "Dev1"
 GAIN_CONTROL_N_SAMPLES    = 100
 GAIN_CONTROL_SAMP_FREQ    = 3000
 GAIN_CONTROL_PIN_OUT      = "/ao0"
+GAIN_CONTROL_PERSISTENT_TASK = True  # keep the gain voltage task alive between voltage changes, only rewriting its buffer
 TRIG_GEN_HIGH_TIME        = 0.0000005  # in seconds
 TRIG_GEN_FREQUENCY        = 1000  # in Hz
 TRIG_GEN_MINIMUM_LOW_TIME = 0.0001  # in seconds
 TRIG_GEN_PIN_OUT          = "/Ctr0"
+TRIG_GEN_BURST_GAP        = 0.01  # pause between the bursts of a multi-burst pulse train, in seconds
+TRIG_GEN_STOP_POLL        = 0.1  # how often a controller waiting for a pulse train checks for stop_run, in seconds
 
 # DAQMX Library
 FILE_LOC_WINXP      = r"C:\Program Files (x86)\National Instruments\NI-DAQ\DAQmx ANSI C Dev\include\NIDAQmx.h"  # full path of the NIDAQmx.h file if installed on Windows XP
@@ -0,0 +1,157 @@
+"""
+Lightweight call tracing for SMELLIE.
+A controller call opens a root span, and the device-level operations it makes (Fibre Switch and Laser Switch commands, SEPIA .dll calls and DAQmx calls) record child spans inside it, each with its timing.
+Completed traces go to a ring buffer of the last TRACE_BUFFER_SIZE traces (set in config.py), which can be dumped over the server or written to a file.
+When tracing is disabled a traced function only checks :data:`tracer`.enabled before calling straight through.
+"""
+from smellie_config import TRACING_ENABLED, TRACE_BUFFER_SIZE
+from contextlib import contextmanager
+from collections import deque
+from functools import wraps
+from threading import local, Lock, current_thread
+from time import time
+import json
+
+class Span(object):
+    """
+    One timed operation, and the spans of the operations it made
+    """
+    def __init__(self, name):
+        self.name = name
+        self.thread = current_thread().name
+        self.start = time()
+        self.duration = None
+        self.error = None
+        self.children = []
+
+    def finish(self):
+        self.duration = time() - self.start
+
+    def to_dict(self):
+        """
+        The span and its children as plain types, which can be sent over XML-RPC or written as JSON
+
+        :returns: {"name", "thread", "start", "duration", "children"[, "error"]}
+        :type returns: dict
+        """
+        span = {"name" : self.name,
+                "thread" : self.thread,
+                "start" : self.start,
+                "duration" : self.duration,
+                "children" : [child.to_dict() for child in self.children]}
+        if self.error is not None:
+            span["error"] = self.error
+        return span
+
+class Tracer(object):
+    """
+    Records spans on a per-thread stack, and keeps each completed trace (a root span and its children) in a ring buffer
+    """
+    def __init__(self, enabled = TRACING_ENABLED, size = TRACE_BUFFER_SIZE):
+        self.enabled = enabled
+        self.traces = deque(maxlen = size)
+        self.lock = Lock()
+        self.local = local()
+
+    def _stack(self):
+        """
+        This thread's stack of open spans
+        This is a private function, indicated by the underscore before the name - do not change that!
+        """
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def enable(self, enabled = True):
+        """
+        Switch tracing on or off.  Traces already recorded are kept.
+        """
+        self.enabled = enabled
+
+    @contextmanager
+    def span(self, name, root = False):
+        """
+        Time the body of a with block as a span.
+        A span opened inside another is recorded as its child.  Otherwise it starts a new trace if root is set, and is not recorded if not, so device operations made outside any controller call do not fill the buffer.
+
+        :param name: span name
+
+        :param root: start a new trace if there is no open span
+
+        :returns: the :class:`Span`, or None if it is not being recorded
+        """
+        stack = self._stack()
+        if not self.enabled or not (stack or root):
+            yield None
+            return
+        span = Span(name)
+        if stack:
+            stack[-1].children.append(span)
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.finish()
+            stack.pop()
+            if not stack:
+                with self.lock:
+                    self.traces.append(span)
+
+    def dump(self):
+        """
+        :returns: the buffered traces, oldest first, as from :func:`Span.to_dict`
+        :type returns: list
+        """
+        with self.lock:
+            traces = list(self.traces)
+        return [trace.to_dict() for trace in traces]
+
+    def write(self, path):
+        """
+        Append the buffered traces to a file, one JSON trace per line
+
+        :param path: the file
+
+        :returns: the number of traces written
+        """
+        traces = self.dump()
+        with open(path, "a") as trace_file:
+            for trace in traces:
+                trace_file.write(json.dumps(trace, sort_keys = True) + "\n")
+        return len(traces)
+
+    def clear(self):
+        """
+        Empty the trace buffer
+        """
+        with self.lock:
+            self.traces.clear()
+
+"""
+The tracer shared by the controller, the devices and the SEPIA and DAQmx libraries
+"""
+tracer = Tracer()
+
+def traced(name = None, root = False):
+    """
+    Decorator to record every call of a function as a span of :data:`tracer` (see :func:`Tracer.span`)
+
+    :param name: span name - by default the function's name
+
+    :param root: start a new trace if the call is not inside one
+    """
+    def decorate(func):
+        span_name = func.__name__ if name is None else name
+        @wraps(func)
+        def traced_function(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(span_name, root):
+                return func(*args, **kwargs)
+        return traced_function
+    return decorate